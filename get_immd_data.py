@@ -5,12 +5,13 @@
 """
 import requests
 import datetime
-import sqlite3
 import re
 import sys
 sys.path.append('/home/odaiwai/src/dob_DBHelper')
 import db_helper as dbdo # This is a library of my own database routines - it just 
                          # wraps sqlite commands into handier methods I like
+import ncor_log
+import ncor_db
 
 def get_all_data_in_range(from_date, to_date):
     this_date = from_date
@@ -105,7 +106,8 @@ if __name__ == '__main__':
     FIRSTRUN = 0
     VERBOSE = 0
 
-    db_connect = sqlite3.connect(r'immd.sqlite')
+    ncor_log.setup()
+    db_connect = ncor_db.connect(r'immd.sqlite')
     dbc = db_connect.cursor()
     
     results = main()
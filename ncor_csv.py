@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Streaming, header-driven CSV reader for the JHU daily reports and the
+other CSV sources in process_ncor_2019_data.py.
+
+This uses the C csv module, so commas inside quotes ("Korea, South",
+"Autauga, Alabama, US") are handled by the tokenizer instead of being
+swapped for '#' by a lookahead regex and patched back up afterwards.
+
+Run it on a daily report to compare it with the old regex approach:
+    ./ncor_csv.py JHU_data/COVID-19/csse_covid_19_data/csse_covid_19_daily_reports/01-01-2021.csv
+
+CC: BY-SA
+"""
+import sys
+import re
+import csv
+import time
+
+def normalise_fieldnames(line_fields):
+    # normalise the fields
+    # Keep the field names consistent
+    normalise_fields ={'Country_Region': 'Country',
+                       'Province_State': 'Province',
+                       'Lat': 'Latitude',
+                       'Long_': 'Longitude',
+                       'Case-Fatality_Ratio': 'Case_Fatality_Ratio'
+                  }
+    norm_fields = []#'admin2']
+    for field in line_fields:
+        if field in normalise_fields.keys():
+            norm_fields.append(normalise_fields[field].lower())
+        else:
+            norm_fields.append(field.lower())
+    return norm_fields
+
+def clean_header(header):
+    """ Tidy the raw header fields: 'Province/State' -> 'Province', 'Last Update' -> 'Last_Update' """
+    fixprov  = re.compile(r'([A-Za-z]+)/([A-Za-z]+)')
+    fixspcs  = re.compile(r'(\s+)')
+    fields = []
+    for field in header:
+        field = fixprov.sub(r'\1', field.strip())
+        fields.append(fixspcs.sub(r'_', field))
+    return fields
+
+class CSVReader:
+    """ Read a CSV file one row at a time.
+        The first row gives the field names, which are cleaned up and passed
+        through normalise_fieldnames(). Iterating gives a dict per row, or use
+        tuples() to get the values in field order. Blank lines are skipped.
+    """
+    def __init__(self, filename, delimiter = ',', encoding = 'utf-8-sig'):
+        self.filename = filename
+        self.infile = open(filename, mode='r', encoding=encoding, newline='')
+        self.reader = csv.reader(self.infile, delimiter = delimiter)
+        self.line_fields = clean_header(next(self.reader))
+        self.fields = normalise_fieldnames(self.line_fields)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.infile.close()
+
+    def tuples(self):
+        for row in self.reader:
+            if row:
+                yield tuple(row)
+
+    def __iter__(self):
+        fields = self.fields
+        for row in self.reader:
+            if row:
+                yield dict(zip(fields, row))
+
+def regex_rows(filename):
+    """ The old way of splitting a daily report, kept for the benchmark """
+    with open(filename, mode='r', encoding='utf-8-sig') as infile:
+        lines = list(infile)
+    lines.pop(0)
+    rows = []
+    for line in lines:
+        line = re.sub(',(?=[^"]*"[^"]*(?:"[^"]*"[^"]*)*$)', '#', line)
+        line = re.sub('"', '', line).rstrip()
+        rows.append(line.split(','))
+    return rows
+
+def csv_rows(filename):
+    with CSVReader(filename) as reader:
+        return list(reader.tuples())
+
+def benchmark(filename, repeats = 10):
+    """ Time the regex splitting against the csv reader on one file """
+    lines = len(csv_rows(filename))
+    print('{}: {} lines, best of {}'.format(filename, lines, repeats))
+    results = {}
+    for name, function in (('regex', regex_rows), ('csv', csv_rows)):
+        best = None
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            function(filename)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results[name] = best
+        print('\t{:6s} {:8.3f} ms {:8.2f} us/line'.format(name, best * 1000, best * 1e6 / max(lines, 1)))
+    print('\tspeedup: {:.1f}x'.format(results['regex'] / results['csv']))
+    return results
+
+if __name__ == '__main__':
+    for filename in sys.argv[1:]:
+        benchmark(filename)
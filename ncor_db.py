@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+One place to open the SQLite databases, with the PRAGMAs tuned for what
+the script is going to do with them, and the CAGR() function registered.
+
+The profiles are:
+    default     - SQLite's own settings
+    bulk-load   - for FIRSTRUN: WAL, no fsyncs, a big page cache and temp
+                  tables in memory. A crash part way through means starting
+                  again, which is what FIRSTRUN does anyway.
+    read-mostly - for plotting: memory-mapped reads, and query_only so a
+                  stray write fails instead of taking the write lock.
+
+    db_connect = ncor_db.connect('ncorv2019.sqlite', 'read-mostly')
+    dbc = db_connect.cursor()
+
+CC: BY-SA
+"""
+import sqlite3
+from ncor_log import LOG
+
+PROFILES = {'default': [],
+            'bulk-load': [('journal_mode', 'WAL'),
+                          ('synchronous', 'OFF'),
+                          ('cache_size', -512 * 1024), # KiB, i.e. 512MB
+                          ('temp_store', 'MEMORY')],
+            'read-mostly': [('mmap_size', 1024 * 1024 * 1024),
+                            ('cache_size', -128 * 1024),
+                            ('temp_store', 'MEMORY'),
+                            ('query_only', 'ON')]}
+
+def cagr(value1, value2, interval):
+    """ Calculate the CAGR (Compound Average Growth Rate) between value1 and value 2 over interval
+        e.g. Value1 is today's data, Value2 is 7 days ago
+    """
+    value1 = float(value1)
+    value2 = float(value2)
+    if value2 <= 0 or interval <= 0:
+        cagr = -1
+    else:
+        cagr = ((value1/value2) ** (1/interval))-1
+    return cagr
+
+def connect(filename, profile = 'default'):
+    """ Open filename with the named profile and return the connection """
+    db_connect = sqlite3.connect(filename)
+    applied = []
+    for pragma, value in PROFILES[profile]:
+        result = db_connect.execute('PRAGMA {} = {}'.format(pragma, value)).fetchone()
+        # journal_mode says what it actually got, e.g. 'memory' for an in-memory database
+        applied.append('{}={}'.format(pragma, value if result is None else result[0]))
+    db_connect.create_function('CAGR', 3, cagr, deterministic = True)
+    LOG.info('opened %s with the %s profile (%s)', filename, profile, ', '.join(applied))
+    return db_connect
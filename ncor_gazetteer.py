@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+In-memory gazetteer for translating Chinese province and city names to
+English, built once from the OCHA [places] table.
+
+This answers the same question as
+    select distinct(ADM2_EN) from [places] where ADM2_ZH like '<name>%'
+but from a sorted list of names with bisect, and remembers every answer,
+instead of an unindexed LIKE scan for every province and city in every
+getAreaStat snapshot. As with LIKE, only A-Z are matched regardless of
+case, and a % or _ in a name is a wildcard (those are matched by a scan
+of the names, as the query did).
+
+CC: BY-SA
+"""
+import re
+import bisect
+import string
+import sys
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+
+# LIKE folds the case of ASCII letters only
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def like_prefix(prefix):
+    """ A regex for LIKE '<prefix>%' on names folded with ASCII_LOWER """
+    pattern = ''.join(['.*' if char == '%' else '.' if char == '_' else re.escape(char)
+                       for char in prefix])
+    return re.compile(pattern, re.DOTALL)
+
+class PrefixIndex:
+    """ Sorted (name, order, value) entries for prefix lookups.
+        When several names share a prefix, the one first in table order wins,
+        which is what the LIKE query returned.
+    """
+    def __init__(self, pairs):
+        entries = []
+        for order, (name, value) in enumerate(pairs):
+            if name is not None:
+                entries.append((name.translate(ASCII_LOWER), order, value))
+        entries.sort()
+        self.names = [entry[0] for entry in entries]
+        self.entries = entries
+
+    def lookup(self, prefix):
+        prefix = prefix.translate(ASCII_LOWER)
+        best = None
+        if '%' in prefix or '_' in prefix:
+            # wildcards: no help from the sort order
+            pattern = like_prefix(prefix)
+            for entry in self.entries:
+                if pattern.match(entry[0]) and (best is None or entry[1] < best[1]):
+                    best = entry
+        else:
+            index = bisect.bisect_left(self.names, prefix)
+            while index < len(self.names) and self.names[index].startswith(prefix):
+                if best is None or self.entries[index][1] < best[1]:
+                    best = self.entries[index]
+                index += 1
+        if best is None:
+            return None
+        return best[2]
+
+class Gazetteer:
+    """ Province (ADM1) and city (ADM2) name translation with memoised results.
+        Names which can't be found are returned as 'Null' (as value_from_query
+        did) and are counted so they can be reported at the end of a run.
+    """
+    def __init__(self, dbc, table = 'places'):
+        rows = dbdo.rows_from_query(dbc,
+                                    ('SELECT ADM1_ZH, ADM1_EN, ADM2_ZH, ADM2_EN '
+                                     'from [{}] order by rowid'.format(table)))
+        self.indexes = {'ADM1': PrefixIndex([(row[0], row[1]) for row in rows]),
+                        'ADM2': PrefixIndex([(row[2], row[3]) for row in rows])}
+        self.cache = {}
+        self.unresolved = {}
+
+    def lookup(self, level, name):
+        key = (level, name)
+        if key not in self.cache:
+            value = self.indexes[level].lookup(name)
+            if value is None:
+                value = 'Null'
+            self.cache[key] = value
+        value = self.cache[key]
+        if value == 'Null':
+            self.unresolved[key] = self.unresolved.get(key, 0) + 1
+        return value
+
+    def province_en(self, name):
+        return self.lookup('ADM1', name)
+
+    def city_en(self, name):
+        return self.lookup('ADM2', name)
+
+    def report(self):
+        """ Log the names that couldn't be translated, and how often they came up """
+        if self.unresolved:
+            LOG.warning('Unresolved place names ({}):'.format(len(self.unresolved)))
+            for (level, name), count in sorted(self.unresolved.items()):
+                LOG.warning('\t{} {}: {}'.format(level, name, count))
+        return self.unresolved
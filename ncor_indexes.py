@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+The secondary indexes the pipeline's queries need, and a way to check
+that they're being used.
+
+make_indexes() creates them (CREATE INDEX IF NOT EXISTS, so it's safe to
+run every time) after the bulk loads, and refreshes the statistics with
+ANALYZE so the query planner knows about them. explain() prints the
+EXPLAIN QUERY PLAN for each of the queries in QUERIES and flags any full
+table scans:
+    ./process_ncor_2019_data.py EXPLAIN
+
+CC: BY-SA
+"""
+import sys
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+
+# index name: (table, columns), or (table, columns, where) for a partial index
+INDEXES = {'jhu_data_country_province_date': ('jhu_data', 'Country, Province, Date'),
+           'jhu_data_date': ('jhu_data', 'Date'),
+           'jhu_data_filename': ('jhu_data', 'Filename'),
+           'jhu_us_data_province_date': ('jhu_us_data', 'Province, Date'),
+           'jhu_us_data_filename': ('jhu_us_data', 'Filename'),
+           'cn_prov_province_timestamp': ('cn_prov', 'ProvinceName, Timestamp'),
+           'cn_prov_filename': ('cn_prov', 'Filename'),
+           'cn_city_province_timestamp': ('cn_city', 'ProvinceName, Timestamp'),
+           'cn_city_filename': ('cn_city', 'Filename'),
+           'hgis_data_filename': ('hgis_data', 'Filename'),
+           'files_source_filename': ('files', 'Source, filename'),
+           # for the top counties by 7 day growth on a date
+           'summaries_county_date_c7day': ('summaries', 'Date, C7day', 'Level = \'county\'')}
+
+# The queries the pipeline runs against the big tables: {C}, {P}, {D}, {N} and {F}
+# are filled in with a country, province, date, Chinese province name and filename.
+QUERIES = {'summary countries': 'select distinct(country) from [jhu_data]',
+           'summary provinces': ('select country, province from [jhu_data] where province > "" '
+                                 'group by country, province'),
+           'summary refresh': ('SELECT country, date || \' 17:00\' AS Date, sum(Confirmed) as Confirmed '
+                               'FROM [jhu_data] where date >= \'{D}\' group by country, date'),
+           'summary batch': ('SELECT country, date || \' 17:00\' AS Date, sum(Confirmed) as Confirmed '
+                             'FROM [jhu_data] where date >= \'\' and country in (\'{C}\') group by country, date'),
+           'summary series': ('SELECT Date, Confirmed from [summaries] '
+                              'where Level = \'country\' and Country = \'{C}\' and Province = \'\' order by Date'),
+           'summary top counties': ('SELECT Province as FIPS, Date, Confirmed, C7day from [summaries] '
+                                    'where Level = \'county\' and Date = (SELECT max(Date) from [summaries] '
+                                    '                                   where Level = \'county\') '
+                                    'order by C7day DESC limit 10'),
+           'summary dates': 'select distinct(Date) from [jhu_data] order by date',
+           'plots first date': 'SELECT Date from [jhu_data] order by Date ASC limit 1',
+           'plots last date': 'SELECT Date from [jhu_data] order by Date DESC limit 1',
+           'plots countries on date': ('select distinct(country) from [jhu_data] '
+                                       'where date like \'{D}%\' and confirmed > 1'),
+           'plots dxy province': ('select iso_date, confirmedCount from [cn_prov] '
+                                  'where provinceName = \'{N}\' order by timestamp'),
+           'reload jhu file': 'DELETE FROM [jhu_data] WHERE Filename = \'{F}\'',
+           'reload jhu_us file': 'DELETE FROM [jhu_us_data] WHERE Filename = \'{F}\'',
+           'reload dxy file': 'DELETE FROM [cn_prov] WHERE Filename = \'{F}\'',
+           'reload hgis file': 'DELETE FROM [hgis_data] WHERE Filename = \'{F}\''}
+
+def make_indexes(dbc, verbose = 0, analyze = True):
+    """ Create any missing indexes, then ANALYZE the tables they're on, unless
+        analyze is False (the data hasn't changed) and there were none missing
+    """
+    existing = dbdo.list_from_query(dbc, 'select name from sqlite_master where type = \'index\'')
+    missing = [name for name in INDEXES if name not in existing]
+    dbdo.dbdo(dbc, 'BEGIN', verbose)
+    for name, spec in INDEXES.items():
+        table, columns = spec[0:2]
+        where = 'WHERE {}'.format(spec[2]) if len(spec) > 2 else ''
+        if name not in existing:
+            LOG.info('creating index %s on [%s] (%s) %s', name, table, columns, where)
+        dbdo.dbdo(dbc, 'CREATE INDEX IF NOT EXISTS [{}] ON [{}] ({}) {}'.format(name, table, columns, where), verbose)
+    dbdo.dbdo(dbc, 'COMMIT', verbose)
+    if not analyze and not missing:
+        return None
+    tables = []
+    for spec in INDEXES.values():
+        table = spec[0]
+        if table not in tables:
+            tables.append(table)
+            dbdo.dbdo(dbc, 'ANALYZE [{}]'.format(table), verbose)
+    return None
+
+def sample_values(dbc):
+    """ Something real to put in the queries, so the plans are the ones we'd get """
+    row = dbdo.row_from_query(dbc, ('select country, province, date, filename from [jhu_data] '
+                                    'where province > "" order by date desc limit 1'))
+    if row is None:
+        row = ('China', 'Hubei', '2020-01-22', '01-22-2020.csv')
+    province_name = dbdo.value_from_query(dbc, 'select provinceName from [cn_prov] limit 1')
+    return {'C': row[0], 'P': row[1], 'D': row[2], 'F': row[3], 'N': province_name}
+
+def explain(dbc):
+    """ Print the query plan of each of the pipeline's queries. Returns the names of
+        the ones that scan a whole table.
+    """
+    values = sample_values(dbc)
+    scans = []
+    for name, query in QUERIES.items():
+        sql = query.format(**values)
+        print('{}:\n\t{}'.format(name, sql))
+        for row in dbdo.rows_from_query(dbc, 'EXPLAIN QUERY PLAN {}'.format(sql)):
+            detail = row[-1]
+            # 'SCAN jhu_data' and 'SCAN jhu_data USING INDEX' visit every row;
+            # a SEARCH, or a SCAN of a covering index, doesn't
+            full_scan = detail.startswith('SCAN') and 'COVERING INDEX' not in detail
+            if full_scan and name not in scans:
+                scans.append(name)
+            print('\t\t{}{}'.format(detail, ' <-- FULL SCAN' if full_scan else ''))
+    print('{} of {} queries scan a whole table: {}'.format(len(scans), len(QUERIES), ', '.join(scans)))
+    return scans
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Compiled, parameterised INSERT statements for the loaders in
+process_ncor_2019_data.py.
+
+Each (table, fields) signature gets one INSERT with ? placeholders, and
+rows are fed to it through executemany() in batches, so SQLite can reuse
+the prepared statement. If a new header variant turns up with columns the
+table doesn't have yet, they're added with ALTER TABLE before the first
+insert (this replaces add_column_to_tables.sh).
+
+CC: BY-SA
+"""
+import re
+import sys
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+
+def sql_param(value):
+    """ Make a value safe to use as an SQL parameter. None becomes an empty string
+        (as the old quoted SQL did) and anything structured is stored as its text.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+def column_type(value):
+    """ Guess an SQLite column type for a sample value """
+    if isinstance(value, int):
+        return 'Integer'
+    if isinstance(value, float):
+        return 'Real'
+    if isinstance(value, str):
+        if re.match(r'^-?[0-9]+$', value):
+            return 'Integer'
+        if re.match(r'^-?[0-9]*\.[0-9]+$', value):
+            return 'Real'
+    return 'Text'
+
+class InsertPlan:
+    """ One parameterised INSERT for a table and a fixed list of fields.
+        Rows are buffered and sent with executemany() every batch_size rows.
+    """
+    def __init__(self, dbc, verb, table, fields, batch_size):
+        self.dbc = dbc
+        self.sql = '{V} INTO [{T}] ({F}) Values ({P})'.format(
+            V = verb, T = table, F = ', '.join(fields),
+            P = ', '.join(['?'] * len(fields)))
+        self.width = len(fields)
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+        self.ignored = 0
+
+    def add(self, values):
+        if len(values) != self.width:
+            raise ValueError('{} values for {} fields in: {}'.format(len(values), self.width, self.sql))
+        self.rows.append([sql_param(value) for value in values])
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.dbc.executemany(self.sql, self.rows)
+            self.count += len(self.rows)
+            # rows an INSERT OR IGNORE skipped
+            if self.dbc.rowcount >= 0:
+                self.ignored += len(self.rows) - self.dbc.rowcount
+            self.rows = []
+
+class InsertPlans:
+    """ A cache of InsertPlans keyed by (verb, table, fields).
+        Call flush() before committing so nothing is left in the buffers.
+    """
+    def __init__(self, dbc, verbose = 0, batch_size = 1000):
+        self.dbc = dbc
+        self.verbose = verbose
+        self.batch_size = batch_size
+        self.plans = {}
+        self.columns = {}
+        self.last_plan = None
+        self.bulk_count = 0
+        self.bulk_ignored = 0
+
+    def table_columns(self, table):
+        if table not in self.columns:
+            rows = dbdo.rows_from_query(self.dbc, 'PRAGMA table_info([{}])'.format(table))
+            self.columns[table] = set([row[1].lower() for row in rows])
+        return self.columns[table]
+
+    def add_missing_columns(self, table, fields, values):
+        """ ALTER the table to add any fields it doesn't have, typed from the sample values.
+            Returns the list of fields that were added.
+        """
+        columns = self.table_columns(table)
+        added = []
+        for field, value in zip(fields, values):
+            if field.lower() not in columns:
+                ctype = column_type(value)
+                LOG.info('adding column %s (%s) to [%s]', field, ctype, table)
+                dbdo.dbdo(self.dbc, 'ALTER TABLE [{}] ADD COLUMN {} {}'.format(table, field, ctype), self.verbose)
+                columns.add(field.lower())
+                added.append(field)
+        return added
+
+    def plan(self, table, fields, values, verb = 'INSERT'):
+        key = (verb, table, tuple(fields))
+        if key not in self.plans:
+            self.add_missing_columns(table, fields, values)
+            self.plans[key] = InsertPlan(self.dbc, verb, table, fields, self.batch_size)
+        return self.plans[key]
+
+    def insert(self, table, fields, values, verb = 'INSERT'):
+        plan = self.plan(table, fields, values, verb)
+        # Keep the rows in input order when the signature changes mid-file
+        if self.last_plan is not None and self.last_plan is not plan:
+            self.last_plan.flush()
+        self.last_plan = plan
+        plan.add(values)
+
+    def insert_rows(self, table, fields, rows, sample, verb = 'INSERT'):
+        """ Insert a whole block of rows with one executemany(). The values go in
+            as they are, so None is stored as NULL. sample types any new columns.
+        """
+        self.flush()
+        self.last_plan = None
+        self.add_missing_columns(table, fields, sample)
+        if rows:
+            plan = InsertPlan(self.dbc, verb, table, fields, len(rows))
+            self.dbc.executemany(plan.sql, rows)
+            self.bulk_count += len(rows)
+            if self.dbc.rowcount >= 0:
+                self.bulk_ignored += len(rows) - self.dbc.rowcount
+
+    def flush(self):
+        for plan in self.plans.values():
+            plan.flush()
+
+    def rows_inserted(self):
+        return self.bulk_count + sum([plan.count for plan in self.plans.values()])
+
+    def rows_ignored(self):
+        return self.bulk_ignored + sum([plan.ignored for plan in self.plans.values()])
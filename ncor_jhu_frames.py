@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+A columnar reader for the JHU CSSE daily reports, using pandas.
+
+This does what parse_jhu_daily_report() in process_ncor_2019_data.py does,
+but to whole columns at a time: each report is read into a DataFrame, the
+countries, Hong Kong/Macau, 'City, ST' provinces, last update dates and
+empty values are fixed up with vectorised operations, and the result goes
+to the database with one executemany() per file.
+
+The rows that land in [jhu_data] and [jhu_us_data] are the same as the row
+at a time reader's, including its quirks: the split 'Province' of a
+'City, ST' row is passed along after the original province column, and
+SQLite keeps the first of a repeated column, so only the Admin2 part sticks,
+and a row with no last update takes the year of the last MDY date above it.
+
+Use it with:
+    ./process_ncor_2019_data.py ENGINE=pandas
+
+CC: BY-SA
+"""
+import sys
+import pandas as pd
+from ncor_csv import CSVReader
+from ncor_normalise import COUNTRY_NAMES, STATE_NAMES, jhu_patterns
+from ncor_log import LOG, FileStats
+
+def read_report_frame(path):
+    """ Read a daily report as a DataFrame of strings, with our field names.
+        The tokenising is left to CSVReader, so short rows come out with missing
+        values (not empty strings) just as they do for the row reader.
+    """
+    with CSVReader(path) as reader:
+        width = len(reader.fields)
+        rows = [row[:width] for row in reader.tuples()]
+        return pd.DataFrame.from_records(rows, columns = reader.fields)
+
+def split_city_state(frame, patterns):
+    """ Earlier in the data, American Provinces were "City, ST": split them into Admin2 and State.
+        Only rows that match get values; the others are left as None.
+    """
+    parts = frame['province'].str.extract(patterns['city_state'])
+    matched = parts[0].notna()
+    if not matched.any():
+        return None
+    admin2 = parts[0]
+    admin1 = parts[1]
+    # Sometimes there's something like: 'Omaha, NE (From Diamond Princess)' (case from cruise ship)
+    from_cruise = admin1.str.extract(patterns['cruise'])
+    on_cruise = from_cruise[0].notna()
+    admin2 = admin2.where(~on_cruise, admin2 + from_cruise[1])
+    admin1 = admin1.where(~on_cruise, from_cruise[0])
+    is_state = admin1.str.match(patterns['az2']).fillna(False).astype(bool)
+    states = admin1[is_state].map(STATE_NAMES)
+    if states.isna().any():
+        raise KeyError(admin1[is_state][states.isna()].iloc[0])
+    admin1 = admin1.where(~is_state, states)
+    return (admin2.where(matched, None).astype(object),
+            admin1.where(matched, None).astype(object))
+
+def last_update_timestamps(update, patterns, source, year, month, day):
+    """ Parse the last_update column into integer YYYYmmddHHMMSS timestamps.
+        MDY first, then ISO, and an empty value means midnight on the file's
+        month and day. As in the row reader, where an MDY date overwrites the
+        file's year, that's in the year of the last MDY row before it.
+    """
+    mdy = update.str.extract(patterns['mdy_date'])
+    ymd = update.str.extract(patterns['ymd_date'])
+    is_mdy = mdy[0].notna()
+    is_ymd = ymd[0].notna() & ~is_mdy
+    unparsed = ~(is_mdy | is_ymd | (update == ''))
+    if unparsed.any():
+        LOG.error('BARF! %s', update[unparsed].iloc[0])
+        sys.exit()
+
+    parts = pd.DataFrame({'year': year, 'month': month, 'day': day,
+                          'hour': 0, 'minute': 0, 'second': 0}, index = update.index)
+    if is_mdy.any():
+        found = mdy[is_mdy].astype(int)
+        parts.loc[is_mdy, 'year'] = found[2].where(found[2] >= 100, found[2] + 2000)
+        parts.loc[is_mdy, 'month'] = found[0]
+        parts.loc[is_mdy, 'day'] = found[1]
+        parts.loc[is_mdy, 'hour'] = found[3]
+        parts.loc[is_mdy, 'minute'] = found[4]
+        # the empty ones after an MDY row get its year
+        empty = update == ''
+        years = parts['year'].where(is_mdy).ffill().fillna(year)
+        parts.loc[empty, 'year'] = years[empty].astype(int)
+    if is_ymd.any():
+        found = ymd[is_ymd].astype(int)
+        for column, name in enumerate(['year', 'month', 'day', 'hour', 'minute']):
+            parts.loc[is_ymd, name] = found[column]
+        # The US reports carry seconds, the global ones are truncated to the minute
+        if source == 'JHU_US':
+            parts.loc[is_ymd, 'second'] = found[5]
+    stamps = pd.to_datetime(parts)
+    return stamps.dt.strftime('%Y%m%d%H%M%S').astype('int64')
+
+def parse_jhu_daily_frame(datadir, filename, source, field_types):
+    """ Parse and normalise one daily report into a DataFrame ready for insertion.
+        The columns are timestamp, date and filename, then the report's own
+        fields, then Admin2 and Province if any row needed splitting.
+    """
+    patterns = jhu_patterns(source)
+    match = patterns['namedate'].match(filename)
+    month, day, year = int(match[1]), int(match[2]), int(match[3])
+    filedate = '{:04d}-{:02d}-{:02d}'.format(year, month, day)
+    stats = FileStats(source, filename)
+    frame = read_report_frame('{}/{}'.format(datadir, filename))
+
+    # Normalise some of the inputs: Countries
+    frame['country'] = frame['country'].map(COUNTRY_NAMES).fillna(frame['country'])
+    if source == 'JHU':
+        home = (frame['country'] == 'China') & frame['province'].isin(['Hong Kong', 'Macau'])
+        frame.loc[home, 'country'] = frame.loc[home, 'province']
+
+    split = split_city_state(frame, patterns)
+    if split is not None:
+        frame['Admin2'], frame['Province'] = split
+
+    timestamps = last_update_timestamps(frame['last_update'], patterns, source, year, month, day)
+
+    # if there's empty fields, set them to an appropriate null value base on the type
+    # (columns we haven't seen before are left as they are)
+    for key in frame.columns:
+        nulls = {'integer': 0, 'real': 0.0}
+        if field_types.get(key) in nulls:
+            empty = frame[key] == ''
+            if empty.any():
+                frame[key] = frame[key].astype(object).mask(empty, nulls[field_types[key]])
+
+    frame.insert(0, 'timestamp', timestamps.astype(object))
+    frame.insert(1, 'date', filedate)
+    frame.insert(2, 'filename', filename)
+
+    stats.rows = len(frame)
+    if stats.debug:
+        for row in frame.iloc[stats.every - 1::stats.every].itertuples(index = False):
+            LOG.debug('row: %s', row)
+    stats.done()
+    return frame
+
+def frame_rows(frame):
+    """ Return (fields, rows, sample) for InsertPlans.insert_rows(): missing
+        values become None, and the sample is the first value in each column
+        (for typing any new columns).
+    """
+    frame = frame.astype(object).where(frame.notna(), None)
+    sample = []
+    for column in range(len(frame.columns)):
+        values = frame.iloc[:, column]
+        first = values.first_valid_index()
+        sample.append(None if first is None else values[first])
+    return list(frame.columns), list(frame.itertuples(index = False, name = None)), sample
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Leveled logging for the ingestion scripts.
+
+Everything goes through the 'ncor' logger. INFO gives the stages and one
+summary line per source file (rows, rejects, elapsed time); DEBUG adds the
+headers and a sample of the rows themselves, 1 in every SAMPLE of them, so
+a full rebuild at debug level doesn't write out millions of lines.
+
+The loops only test a boolean for each row, and that's False unless the
+level is DEBUG, so they pay nothing for it otherwise:
+
+    stats = FileStats('JHU', filename)
+    for row in rows:
+        if stats.sample():
+            LOG.debug('row: %s', row)
+        ...
+    stats.done()
+
+Set the level with LOGLEVEL=debug and the sampling with SAMPLE=100 on the
+command line. Worker processes need setup() called with the same values.
+
+CC: BY-SA
+"""
+import sys
+import time
+import logging
+
+LOG = logging.getLogger('ncor')
+SAMPLE = 1
+
+def setup(level = 'info', sample = 1):
+    """ Send the 'ncor' log to stdout (where the prints used to go) at the given level.
+        Used as the initializer for pool workers as well as in __main__.
+    """
+    global SAMPLE
+    if not LOG.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(processName)s: %(message)s'))
+        LOG.addHandler(handler)
+        LOG.propagate = False
+    LOG.setLevel(level.upper())
+    SAMPLE = max(1, sample)
+    return None
+
+def level_name():
+    return logging.getLevelName(LOG.getEffectiveLevel()).lower()
+
+class FileStats:
+    """ Counters for one source file: rows, rejects and elapsed time.
+        With plans given, rejects are the rows an INSERT OR IGNORE dropped
+        while the file was loaded, so call done() after plans.flush().
+    """
+    def __init__(self, source, filename, plans = None):
+        self.source = source
+        self.filename = filename
+        self.plans = plans
+        self.ignored = plans.rows_ignored() if plans is not None else 0
+        self.debug = LOG.isEnabledFor(logging.DEBUG)
+        self.every = SAMPLE
+        self.rows = 0
+        self.rejects = 0
+        self.start = time.perf_counter()
+
+    def sample(self):
+        """ Count a row, and say whether it's one to show at debug level """
+        self.rows += 1
+        return self.debug and self.rows % self.every == 0
+
+    def done(self):
+        if self.plans is not None:
+            self.rejects += self.plans.rows_ignored() - self.ignored
+        self.elapsed = time.perf_counter() - self.start
+        LOG.info('%s %s: %d rows, %d rejects, %.3fs',
+                 self.source, self.filename, self.rows, self.rejects, self.elapsed)
+        return self
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Content-hash manifest of the source files, kept in the [files] table.
+
+For each (source, filename) we keep the size, mtime and a SHA-256 of the
+contents. A file whose size and mtime haven't moved is skipped without
+being opened; otherwise it's hashed, and only reprocessed if the hash is
+different (a 'git pull' that touches a file without changing it costs a
+hash, nothing more).
+
+Files processed before the manifest existed have no hash: the first time
+they're seen they are hashed and adopted as they are.
+
+CC: BY-SA
+"""
+import os
+import hashlib
+import datetime
+import sys
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+
+def file_hash(path, blocksize = 1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as infh:
+        for block in iter(lambda: infh.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class Manifest:
+    """ The manifest entries for one source: filename -> (size, mtime, hash)
+        check() says whether a file is 'new', 'changed' or 'unchanged', and
+        record() writes its entry as part of the caller's transaction.
+    """
+    def __init__(self, dbc, plans, source, verbose = 0):
+        self.dbc = dbc
+        self.plans = plans
+        self.source = source
+        self.verbose = verbose
+        # Older databases only have filename, Source and dateProcessed
+        plans.add_missing_columns('files', ['Size', 'Mtime', 'Hash'], [0, 0.0, ''])
+        rows = dbdo.rows_from_query(dbc,
+                                    ('SELECT filename, Size, Mtime, Hash from [files] '
+                                     'where Source = \'{}\''.format(source)))
+        self.entries = {}
+        for filename, size, mtime, digest in rows:
+            self.entries[filename] = (size, mtime, digest)
+        self.pending = {}
+        self.restat = []
+        self.counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+
+    def check(self, datadir, filename):
+        path = os.path.join(datadir, filename)
+        stat = os.stat(path)
+        size, mtime = stat.st_size, stat.st_mtime
+        known = self.entries.get(filename)
+        if known is not None and known[0] == size and known[1] == mtime:
+            status = 'unchanged'
+        else:
+            digest = file_hash(path)
+            if known is None:
+                status = 'new'
+            elif known[2] is None or known[2] == digest:
+                # Same contents (or a file from before the manifest): just note the new stat
+                status = 'unchanged'
+                self.restat.append((size, mtime, digest, filename, self.source))
+            else:
+                status = 'changed'
+            if status != 'unchanged':
+                self.pending[filename] = (size, mtime, digest)
+
+        self.counts[status] += 1
+        return status
+
+    def files_to_process(self, datadir, filenames):
+        """ Check each file and return [(filename, status)] for the new and changed ones """
+        to_process = []
+        for filename in filenames:
+            status = self.check(datadir, filename)
+            if status != 'unchanged':
+                to_process.append((filename, status))
+        self.save_restats()
+        LOG.info('{}: {new} new, {changed} changed, {unchanged} unchanged'.format(self.source, **self.counts))
+        return to_process
+
+    def record(self, filename):
+        """ Replace the [files] entry for filename. Call inside the transaction that loads it. """
+        size, mtime, digest = self.pending.pop(filename)
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        dbdo.dbdo_params(self.dbc, 'DELETE FROM [files] WHERE filename = ? and Source = ?',
+                         (filename, self.source), self.verbose)
+        self.plans.insert('files', ['Filename', 'Source', 'DateProcessed', 'Size', 'Mtime', 'Hash'],
+                          [filename, self.source, now, size, mtime, digest])
+        self.entries[filename] = (size, mtime, digest)
+
+    def save_restats(self):
+        if self.restat:
+            dbdo.dbdo(self.dbc, 'BEGIN', self.verbose)
+            self.dbc.executemany('UPDATE [files] SET Size = ?, Mtime = ?, Hash = ? '
+                                 'WHERE filename = ? and Source = ?', self.restat)
+            dbdo.dbdo(self.dbc, 'COMMIT', self.verbose)
+            self.restat = []
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+The summaries of every country (and World) in memory, as dense countries x
+days NumPy matrices, one for each column, loaded from [summaries] in one
+query instead of one query per country per graph.
+
+A row of the matrix is a country, a column a date, and a day the country
+has no row for is NaN (and False in present). The new cases per day over
+each window and the days since each threshold are already in the
+summaries (NewC7, DaysC10...), so the days since N cases alignment of a
+graph is just a mask of the matrix:
+
+    matrix = SummaryMatrix(dbc, ['Confirmed', 'NewC7', 'DaysC10'])
+    for country, days, cases in matrix.aligned(countries, 'Confirmed', 10, 'NewC7', 'DaysC10', divisors):
+        ...
+
+with the per-million scaling done for every country at once.
+
+CC: BY-SA
+"""
+import sys
+import numpy as np
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+
+class SummaryMatrix:
+    """ columns of the summaries of every country, and World, as countries x days
+        arrays in values, by the lower case column name. countries are in the
+        order of the rows, dates (datetime64) in the order of the columns.
+    """
+    def __init__(self, dbc, columns):
+        self.columns = []
+        for column in columns:
+            if column.lower() not in [known.lower() for known in self.columns]:
+                self.columns.append(column)
+        # no need for an order by: the rows are put in their places
+        rows = dbdo.rows_from_query(dbc, ('SELECT Country, Date, {} from [summaries] '
+                                          'where Level in (\'country\', \'rollup\') and Province = \'\''
+                                          .format(', '.join(self.columns))))
+        values = list(zip(*rows)) or [()] * (len(self.columns) + 2)
+        self.countries, country_rows = np.unique(np.array(values[0], dtype = object), return_inverse = True)
+        self.countries = self.countries.tolist()
+        self.dates, date_columns = np.unique(np.array(values[1], dtype = 'datetime64[m]'), return_inverse = True)
+        self.index = dict([(country, row) for row, country in enumerate(self.countries)])
+        shape = (len(self.countries), len(self.dates))
+        self.present = np.zeros(shape, dtype = bool)
+        self.present[country_rows, date_columns] = True
+        self.values = {}
+        for column, column_values in zip(self.columns, values[2:]):
+            matrix = np.full(shape, np.nan)
+            matrix[country_rows, date_columns] = np.array(column_values, dtype = float)
+            self.values[column.lower()] = matrix
+        LOG.info('loaded %d summary columns of %d countries x %d days', len(self.columns), shape[0], shape[1])
+
+    def rows(self, countries):
+        """ The row of each of countries, or -1 for one that isn't there """
+        return np.array([self.index.get(country, -1) for country in countries], dtype = int)
+
+    def series(self, country, columns, above = None):
+        """ One country's columns as arrays, with 'Date', as country_series() in
+            produce_ncor_plots.py: the days it has a row for, or, with above =
+            (column, limit), just the ones where column >= limit
+        """
+        if country in self.index:
+            row = self.index[country]
+            found = self.present[row].copy()
+            if above is not None:
+                found &= self.values[above[0].lower()][row] >= above[1]
+        else:
+            row = 0
+            found = np.zeros(len(self.dates), dtype = bool)
+        series = {'Date': self.dates[found]}
+        for column in columns:
+            series[column] = self.values[column.lower()][row][found] if len(self.countries) else np.array([])
+        return series
+
+    def aligned(self, countries, column, limit, value, days, divisors = None):
+        """ For each of countries, (country, days, values): the days since limit
+            (the days column) and the value column, on the days column >= limit
+            and value isn't NULL, with the values divided by divisors (one for
+            each country) if there are any
+        """
+        rows = self.rows(countries)
+        exists = rows >= 0
+        rows = np.where(exists, rows, 0)
+        values = self.values[value.lower()][rows]
+        found = (self.values[column.lower()][rows] >= limit) & ~np.isnan(values) & exists[:, None]
+        if divisors is not None:
+            values = values / np.array(divisors, dtype = float)[:, None]
+        day_counts = self.values[days.lower()][rows]
+        return [(country, day_counts[idx][found[idx]], values[idx][found[idx]])
+                for idx, country in enumerate(countries)]
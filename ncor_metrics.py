@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+The growth metrics of the summaries, CFR, CRR, the 1 day growth and the
+n-day CAGR columns, worked out with NumPy over whole series at a time
+instead of by the CAGR() function SQLite calls back into Python for every
+row, and the plots' new cases per day and days since N cases columns.
+
+The results are the same as the window SQL's: a LAG before the start of a
+series is 0, a division by 0 or by NULL is NULL, and an invalid CAGR (no
+positive value to grow from) is -1. The one difference is that a NULL value
+gives a NULL CAGR, where CAGR() fell over. They aren't rounded here: the
+inserts round them with SQLite's own ROUND(?, 4) (see insert_values() in
+ncor_summaries.py), as the window SQL does, since ROUND()'s results can't
+be reproduced exactly in Python.
+
+To compare it with the SQL and CAGR() way of doing it on the summaries in a
+database (nothing is written to the database itself):
+    ./ncor_metrics.py ncorv2019.sqlite
+
+CC: BY-SA
+"""
+import sys
+import time
+import numpy as np
+
+def series_positions(series):
+    """ Each row's position in its series, for rows sorted by series then date.
+        series is a list of the key columns, e.g. [countries, provinces].
+    """
+    count = len(series[0])
+    starts = np.zeros(count, dtype = bool)
+    if count:
+        starts[0] = True
+    for column in series:
+        column = np.array(column, dtype = object)
+        starts[1:] |= column[1:] != column[:-1]
+    index = np.arange(count)
+    return index - np.maximum.accumulate(np.where(starts, index, 0))
+
+def lagged(values, positions, lag):
+    """ LAG(values, lag, 0) within each series """
+    out = np.zeros_like(values)
+    if lag < len(values):
+        out[lag:] = values[:-lag]
+    out[positions < lag] = 0
+    return out
+
+def ratio(top, bottom):
+    """ top / bottom, NaN (NULL) where bottom is 0 """
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(bottom == 0, np.nan, top / np.where(bottom == 0, 1, bottom))
+
+def growth(values, positions, lag):
+    """ values / LAG(values, lag, 0) - 1 """
+    return ratio(values, lagged(values, positions, lag)) - 1
+
+def cagr(values, positions, interval):
+    """ The compound growth rate from LAG(values, interval, 0) to values, over interval:
+        -1 if the earlier value isn't > 0, as cagr() in ncor_db.py
+    """
+    base = lagged(values, positions, interval)
+    valid = base > 0
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        rate = (values / np.where(valid, base, 1)) ** (1 / interval) - 1
+    return np.where(valid | np.isnan(values), rate, -1.0)
+
+def series_total(values, positions):
+    """ The running total of values within each series """
+    total = np.cumsum(values)
+    starts = np.arange(len(values)) - positions
+    return total - total[starts] + values[starts]
+
+def carried(values, positions):
+    """ Each series' values carried forward over the NaNs after them """
+    index = np.arange(len(values))
+    last = np.maximum.accumulate(np.where(np.isnan(values), -1, index))
+    found = (last >= 0) & (last >= index - positions)
+    return np.where(found, values[np.maximum(last, 0)], np.nan)
+
+def new_per_day(values, positions, window):
+    """ (values - LAG(values, window, 0)) / window: the new cases per day over window """
+    return (values - lagged(values, positions, window)) / window
+
+def days_since(values, positions, threshold, fresh, prior):
+    """ The number of days so far each series has been at or over threshold:
+        its prior count from before the fresh rows, plus theirs
+    """
+    count = series_total(((values >= threshold) & fresh).astype(int), positions)
+    return np.nan_to_num(carried(prior, positions)) + count
+
+def series_metrics(series, confirmed, deaths, recovered, lags = (7,)):
+    """ The metric columns for rows sorted by series then date, as {column: array},
+        with NaN for NULL, unrounded. series is a list of the key columns, lags the CAGR intervals.
+    """
+    positions = series_positions(series)
+    confirmed = np.array(confirmed, dtype = float)
+    deaths = np.array(deaths, dtype = float)
+    recovered = np.array(recovered, dtype = float)
+    metrics = {'CFR': ratio(deaths, confirmed), 'CRR': ratio(recovered, confirmed)}
+    for prefix, values in (('C', confirmed), ('D', deaths), ('R', recovered)):
+        metrics['{}1day'.format(prefix)] = growth(values, positions, 1)
+    for lag in lags:
+        for prefix, values in (('C', confirmed), ('D', deaths), ('R', recovered)):
+            metrics['{}{}day'.format(prefix, lag)] = cagr(values, positions, lag)
+    return metrics
+
+def plot_metrics(series, values, since, priors, thresholds, windows):
+    """ The plots' columns for rows sorted by series then date, as {column: array}:
+        New{X}{n}, the new cases per day over each of windows, and Days{X}{limit},
+        the days at or over the threshold. values is {column: list}, with the
+        Date, and thresholds {column: limit}. The days are counted from since,
+        on top of priors, the Days{X}{limit} of the rows before it (NaN after).
+    """
+    positions = series_positions(series)
+    fresh = np.array(values['Date'], dtype = object) >= since
+    metrics = {}
+    for column, limit in thresholds.items():
+        column_values = np.array(values[column], dtype = float)
+        for window in windows:
+            metrics['New{}{}'.format(column[0], window)] = new_per_day(column_values, positions, window)
+        name = 'Days{}{}'.format(column[0], limit)
+        prior = np.array(priors[name], dtype = float)
+        metrics[name] = days_since(column_values, positions, limit, fresh, prior)
+    return metrics
+
+def as_values(values):
+    """ A metric array as a list for SQL parameters, NaN as None """
+    return np.where(np.isnan(values), None, values).tolist()
+
+def benchmark(filename):
+    """ Work out the metrics of everything in [summaries] both ways, and compare """
+    import ncor_db
+    import ncor_summaries
+    db_connect = ncor_db.connect(filename)
+    dbc = db_connect.cursor()
+    columns = ncor_summaries.metric_columns()
+    keys = 'Level, Country, Province, Date'
+    window = 'WINDOW series AS (PARTITION BY Level, Country, Province order by Date)'
+
+    start = time.perf_counter()
+    dbc.execute('CREATE TEMP TABLE sql_metrics AS SELECT {K}, {M} FROM [summaries] {W}'.format(
+                K = keys, M = ncor_summaries.sql_metrics(), W = window))
+    sql_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = dbc.execute('SELECT {K}, Confirmed, Deaths, Recovered FROM [summaries] '
+                       'order by Level, Country, Province, Date'.format(K = keys)).fetchall()
+    fetched = time.perf_counter()
+    values = [[row[idx] for row in rows] for idx in range(7)]
+    metrics = series_metrics(values[0:3], values[4], values[5], values[6])
+    computed = time.perf_counter()
+    dbc.execute('CREATE TEMP TABLE numpy_metrics AS SELECT {K}, {M} FROM sql_metrics limit 0'.format(
+                K = keys, M = ', '.join(columns)))
+    dbc.executemany('INSERT INTO numpy_metrics Values ({})'.format(
+                    ncor_summaries.insert_values(keys.split(', ') + columns)),
+                    (row[:4] + extra for row, extra in
+                     zip(rows, zip(*[as_values(metrics[column]) for column in columns]))))
+    numpy_time = time.perf_counter() - start
+
+    differ = dbc.execute('SELECT count(*) FROM (SELECT * FROM sql_metrics EXCEPT SELECT * FROM numpy_metrics)').fetchone()[0]
+    print('{} rows of [summaries]'.format(len(rows)))
+    print('SQL windows + CAGR(): {:.3f}s'.format(sql_time))
+    print('NumPy: {:.3f}s ({:.3f}s fetch, {:.3f}s metrics, {:.3f}s write)'.format(
+          numpy_time, fetched - start, computed - fetched, numpy_time - (computed - start)))
+    print('{} rows differ'.format(differ))
+    db_connect.close()
+    return differ
+
+if __name__ == '__main__':
+    import ncor_log
+    ncor_log.setup('warning')
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'ncorv2019.sqlite'
+    sys.exit(1 if benchmark(filename) else 0)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Country and state names, and the patterns used to pick apart the JHU
+daily reports. Shared by the row-at-a-time reader in
+process_ncor_2019_data.py and the DataFrame one in ncor_jhu_frames.py, so
+the two can't drift apart.
+
+CC: BY-SA
+"""
+import re
+
+# There's been a bit of inconsistency with naming of countries
+# Make a dict to keep things consistent.
+# On March 10th, the naming has started to get a bit political
+COUNTRY_NAMES = {'Republic of Ireland': 'Ireland', # Now that the UK has had such a bad response
+                 'North Ireland': 'United Kingdom',# they can own the north too.
+                 ' Azerbaijan': 'Azerbaijan', # Spurious Spacing issue
+                 'US': 'USA',
+                 'U.S.': 'USA',
+                 'UK': 'United Kingdom',
+                 'Mainland China': 'China',
+                 'Hong Kong SAR': 'Hong Kong', # stick with initial usage
+                 'Macao SAR': 'Macau',         # Stick with initial usage
+                 'Taipei and environs': 'Taiwan', # Taiwan, just Taiwan
+                 'Taiwan*': 'Taiwan',          # Taiwan
+                 'occupied Palestinian territory': 'Palestine', # Pointless change
+                 'West Bank and Gaza': 'Palestine', # Pointless change
+                 'Russian Federation': 'Russia', # Pointless change
+                 'The Bahamas': 'Bahamas', # Pointless change
+                 'Bahamas, The': 'Bahamas', # Pointless change
+                 'Czech Republic': 'Czechia',
+                 'Iran (Islamic Republic of)': 'Iran',# Are there multiple Irans?
+                 'Holy See': 'Vatican City',
+                 'Viet Nam': 'Vietnam',
+                 'Korea, South': 'South Korea',
+                 'Gambia, The': 'The Gambia',
+                 'Cote d\'Ivoire': 'Ivory Coast'
+                 }
+
+# State Names given the abbrevation as defined in ISO 3166-2
+# Extended for Canada
+STATE_NAMES = {'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas',
+               'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware',
+               'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois',
+               'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana',
+               'ME': 'Maine', 'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota',
+               'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada',
+               'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York',
+               'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma',
+               'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
+               'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
+               'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin',
+               'WY': 'Wyoming', 'DC': 'District of Columbia', 'AS': 'American Samoa', 'GU': 'Guam',
+               'MP': 'Northern Mariana Islands', 'PR': 'Puerto Rico', 'UM': 'United States Minor Outlying Islands',
+               'VI': 'Virgin Islands, U.S.',
+               'NL': 'Newfoundland and Labrador', 'PE': 'Prince Edward Island', 'NS': 'Nova Scotia',
+               'NB': 'New Brunswick', 'QC': 'Quebec', 'ON': 'Ontario', 'MB': 'Manitoba', 'SK': 'Saskatchewan',
+               'AB': 'Alberta', 'BC': 'British Columbia', 'YT': 'Yukon', 'NT': 'Northwest Territories',
+               'NU': 'Nunavut'}
+
+def normalise_countries(country):
+    return COUNTRY_NAMES.get(country, country)
+
+def admin1_from_abbr(abbr):
+    """ Return the State Name given the abbrevation as defined in ISO 3166-2"""
+    return STATE_NAMES[abbr]
+
+def jhu_patterns(source):
+    """ The regular expressions for one source of daily reports, as a dict:
+        namedate, mdy_date, ymd_date, city_state, cruise and az2
+    """
+    patterns = {'namedate': r'^([0-9]{2})-([0-9]{2})-([0-9]{4}).csv$',
+                'city_state': r'^(.*?),\s*(.*)', # split 'Tempe, AZ' into 'Tempe' and 'AZ'
+                'cruise': r'^([A-Z][A-Z])\s+(\(.*\))$',
+                'az2': r'^([A-Z][A-Z])$'}
+    if source == 'JHU_US':
+        patterns['mdy_date'] = r'^([0-9]+)/([0-9]+)/([0-9]{2,4}) ([0-9]+):([0-9]+)$'
+        patterns['ymd_date'] = r'^([0-9]{4})-([0-9]{2})-([0-9]{2})[T ]([0-9]{2}):([0-9]{2}):([0-9]{2})$'
+    else:
+        patterns['mdy_date'] = r'^([0-9]+)/([0-9]+)/([0-9]{2,4}) ([0-9]+):([0-9]+)'
+        patterns['ymd_date'] = r'^([0-9]{4})-([0-9]{2})-([0-9]{2})[T ]+([0-9]{2}):([0-9]{2})'
+    return dict([(name, re.compile(pattern)) for name, pattern in patterns.items()])
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+In-memory population lookup for the per million plots, built once from
+[wiki_populations], [populations] and the JHU [UID_ISO_FIPS] lookup.
+
+This answers the same question as
+    SELECT population from [wiki_populations] where country like '<name>'
+for every country of every plot, but from three queries in all. A name is
+looked for as the plots' own alias for it (PLOT_NAMES), as itself, and as
+it was normalised at ingestion (normalise_countries), in wiki_populations
+first, then populations, then the country rows of UID_ISO_FIPS, so the
+countries the wiki list hasn't got still get a population. Countries none
+of them have are reported, rather than quietly given a population of 1.
+
+    populations = PopulationIndex(dbc)
+    divisors = np.fmax(1, populations.vector(countries) / 1000000)
+
+CC: BY-SA
+"""
+import sys
+import numpy as np
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+from ncor_normalise import normalise_countries
+
+# The names JHU uses for some countries, as the wiki list has them
+PLOT_NAMES = {'USA': 'United States',
+              'Czechia': 'Czech Republic',
+              #'Ivory Coast': 'Côte%',
+              'Congo (Kinshasa)': 'Congo',
+              'Cabo Verde': 'Cape Verde',
+              'Hong Kong': 'Hong Kong (China)',
+              'Macau': 'Macau (China)',
+              'Sao Tome and Principe': 'São Tomé and Príncipe',
+              'Congo (Brazzaville)': 'DR Congo',
+              'Burma': 'Myanmar',
+              'Timor-Leste': 'East Timor',
+              'Diamond Princess': 'Vatican City', # Stand-in
+              'MS Zaandam': 'Vatican City', # Stand-in
+              #'Palestine': 'State of Palestine',
+              #'Kosovo': ''
+             }
+
+# Where to look, in order: the table, and its name and population columns
+SOURCES = [('wiki_populations', 'country', 'population'),
+           ('populations', 'Country', 'Population'),
+           ('populations', 'alt_name', 'Population'),
+           ('UID_ISO_FIPS', 'Country', 'Population')]
+
+def table_exists(dbc, table):
+    return dbdo.value_from_query(dbc, ('SELECT count(*) from sqlite_master '
+                                       'where type = \'table\' and name = \'{}\''.format(table))) == 1
+
+class PopulationIndex:
+    """ Populations by country name, case-insensitively (as LIKE did). When a
+        table has a name more than once, the first in table order wins.
+        Countries that can't be found are NaN, and are kept, once each, so
+        they can be reported.
+    """
+    def __init__(self, dbc):
+        self.tables = []
+        rows = {}
+        for table, name, population in SOURCES:
+            if table not in rows:
+                rows[table] = self.read_table(dbc, table)
+            index = {}
+            for row in rows[table]:
+                key = row[name]
+                if key is not None and row[population] not in (None, ''):
+                    index.setdefault(key.lower(), row[population])
+            self.tables.append(index)
+        self.cache = {}
+        self.unmatched = set()
+        LOG.info('loaded the populations of %s names',
+                 ', '.join([str(len(index)) for index in self.tables]))
+
+    @staticmethod
+    def read_table(dbc, table):
+        """ The rows of a population table as dicts, the country rows only for UID_ISO_FIPS """
+        if not table_exists(dbc, table):
+            LOG.warning('no [%s] table for the populations', table)
+            return []
+        columns = {'wiki_populations': ['country', 'population'],
+                   'populations': ['Country', 'alt_name', 'Population'],
+                   'UID_ISO_FIPS': ['Country', 'Population']}[table]
+        query = 'SELECT {} from [{}]'.format(', '.join(columns), table)
+        if table == 'UID_ISO_FIPS':
+            query += ' where coalesce(Province, \'\') = \'\' and coalesce(Admin2, \'\') = \'\''
+        return [dict(zip(columns, row)) for row in dbdo.rows_from_query(dbc, query + ' order by rowid')]
+
+    def names(self, country):
+        """ The names a country might be under, the plots' alias for it first """
+        names = [PLOT_NAMES.get(country, country), country, normalise_countries(country)]
+        names.append(PLOT_NAMES.get(names[-1], names[-1]))
+        return [name.lower() for name in dict.fromkeys(names)]
+
+    def lookup(self, country):
+        """ The population of country, or None """
+        if country not in self.cache:
+            population = None
+            names = self.names(country)
+            for index in self.tables:
+                found = [index[name] for name in names if name in index]
+                if found:
+                    population = found[0]
+                    break
+            self.cache[country] = population
+        population = self.cache[country]
+        if population is None:
+            self.unmatched.add(country)
+        return population
+
+    def vector(self, countries):
+        """ The populations of countries as a NumPy array in the same order, NaN for the unmatched """
+        return np.array([np.nan if population is None else population
+                         for population in map(self.lookup, countries)], dtype = float)
+
+    def report(self):
+        """ Log the countries that have had no population, once for the run """
+        if self.unmatched:
+            LOG.warning('No population for {} countries: {}'.format(
+                len(self.unmatched), ', '.join(sorted(self.unmatched))))
+        return self.unmatched
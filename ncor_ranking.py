@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+The countries ranked for the plots, biggest first, from one grouped query
+of [summaries] instead of one
+    SELECT max(confirmed) from [<country>]
+for every country in jhu_data on the day, each time a plot asks.
+
+The query gets every ranking key of every country at once, so the ranking
+of a day is worked out once, and each key's order after that is just a
+sort. The keys are in KEYS: the peak confirmed cases (what the plots have
+always used), the latest of the other columns, and the 7 day growth, and
+any of them can be per million people:
+
+    ranking = CountryRanking(dbc)
+    for country, deaths in ranking.ranked('2020-04-01', 'deaths_per_million', populations):
+        ...
+
+Countries with the same value are in alphabetical order. The old way kept
+them in the order SQLite's distinct(country) scan of jhu_data gave them,
+which was usually, but not always, the same. Countries in jhu_data that
+have no summaries are kept, with no values, last, and logged.
+
+CC: BY-SA
+"""
+import sys
+import numpy as np
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+from ncor_summaries import next_day
+
+# The ranking keys, and the column of the query they're in
+KEYS = {'confirmed': 'Peak',
+        'latest_confirmed': 'Confirmed',
+        'deaths': 'Deaths',
+        'recovered': 'Recovered',
+        'active': 'Active',
+        'growth': 'C7day',
+        'deaths_growth': 'D7day'}
+PER_MILLION = '_per_million'
+
+class CountryRanking:
+    """ Every country's ranking keys, by the day they're for, as
+        {key: NumPy array} with the countries in alphabetical order
+    """
+    def __init__(self, dbc):
+        self.dbc = dbc
+        self.days = {}
+
+    def keys(self, final_date_str):
+        """ The ranking keys of the countries in jhu_data with more than one
+            case on final_date_str, from their summaries, in one query
+        """
+        if final_date_str not in self.days:
+            columns = [column for column in dict.fromkeys(KEYS.values()) if column != 'Peak']
+            # the countries on the day, with the latest row of each one's summaries
+            # and its peak, by the summaries' primary key, or NULLs if it has none
+            rows = dbdo.rows_from_query(self.dbc,
+                ('SELECT d.Country, p.Peak, {C} from '
+                 '(SELECT distinct Country from [jhu_data] where Date >= \'{D}\' and Date < \'{N}\' '
+                 'and Confirmed > 1) as d '
+                 'LEFT JOIN (SELECT Country, max(Date) as Latest, max(Confirmed) as Peak from [summaries] '
+                 'where Level = \'country\' and Province = \'\' group by Country) as p on p.Country = d.Country '
+                 'LEFT JOIN [summaries] as s '
+                 'on s.Level = \'country\' and s.Country = d.Country and s.Province = \'\' and s.Date = p.Latest '
+                 'order by d.Country').format(C = ', '.join(['s.{}'.format(column) for column in columns]),
+                                              D = final_date_str[0:10], N = next_day(final_date_str[0:10])))
+            values = list(zip(*rows)) or [()] * (len(columns) + 2)
+            day = {'Country': list(values[0])}
+            for column, column_values in zip(['Peak'] + columns, values[1:]):
+                day[column] = np.array(column_values, dtype = float)
+            missing = [country for country, peak in zip(day['Country'], day['Peak']) if np.isnan(peak)]
+            if missing:
+                LOG.warning('No summaries for %d countries in jhu_data on %s: %s',
+                            len(missing), final_date_str, ', '.join(missing))
+            LOG.info('ranked %d countries on %s', len(day['Country']), final_date_str)
+            self.days[final_date_str] = day
+        return self.days[final_date_str]
+
+    def ranked(self, final_date_str, key = 'confirmed', populations = None):
+        """ [(country, value)], the biggest value first, for one of KEYS, or one
+            of them + '_per_million' with a PopulationIndex. Countries with no
+            value (or population) are last.
+        """
+        day = self.keys(final_date_str)
+        per_million = key.endswith(PER_MILLION)
+        if per_million:
+            key = key[:-len(PER_MILLION)]
+        if key not in KEYS:
+            raise KeyError('no ranking key {}: {}'.format(key, ', '.join(KEYS)))
+        values = day[KEYS[key]]
+        if per_million:
+            values = values / (populations.vector(day['Country']) / 1000000)
+        # a stable sort keeps the countries with the same value in alphabetical order
+        order = np.argsort(-np.nan_to_num(values, nan = -np.inf), kind = 'stable')
+        return [(day['Country'][idx], values[idx].item()) for idx in order]
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+A render worker that stays up, so that making one plot again doesn't pay
+for starting Python, importing matplotlib, loading the fonts and reading
+the summaries every time, which is most of the time it takes.
+
+Start it where produce_ncor_plots.py runs (with ncorv2019.sqlite and plots/):
+    ./ncor_render.py serve
+and send it jobs, one figure each:
+    ./ncor_render.py country USA                 # plots/USA.png
+    ./ncor_render.py since_start 'Hong Kong'     # plots/Hong Kong_since_start.png
+    ./ncor_render.py chart Deaths_per_million_new  # plots/Deaths_per_million_new_since_start.png
+    ./ncor_render.py grid                        # the grid plots
+    ./ncor_render.py disease TB                  # plots/TB.png, from the NID database
+    ./ncor_render.py stats                       # the number and times of the jobs so far
+    ./ncor_render.py stop
+
+The jobs go over a Unix socket, ncor_render.sock, or SOCKET=path, as one
+line of JSON each way. The worker keeps the database connections and the
+summary matrix, and drops the matrix, populations and ranking when a new
+version of the summaries is recorded (ncor_watermark), which is only done
+once they've been committed. The client doesn't
+import matplotlib, NumPy or the plotting code, so it starts straight away.
+The worker logs the time of each job, and the client shows the time
+there and back.
+
+CC: BY-SA
+"""
+import os
+import sys
+import json
+import time
+import socket
+import socketserver
+import ncor_log
+from ncor_log import LOG
+
+SOCKET = 'ncor_render.sock'
+DBFILE = 'ncorv2019.sqlite'
+NIDFILE = 'notifiable_infections_diseases.sqlite'
+FIGSIZE = [9, 6] # as produce_ncor_plots.py
+
+class RenderWorker:
+    """ The warm state: the plotting modules with their connections, and the
+        count, total and longest time of each kind of job
+    """
+    def __init__(self, dbfile, nidfile, figsize, level):
+        import io
+        import produce_ncor_plots
+        self.plots = produce_ncor_plots
+        self.plots.start_worker(dbfile, figsize, level)
+        self.nidfile = nidfile
+        self.nid = None
+        self.version = None
+        self.settings = None
+        self.timings = {}
+        self.stopping = False
+        self.refresh()
+        # the first text drawn loads the fonts
+        fig = self.plots.plt.figure(figsize = figsize)
+        fig.suptitle('warm up')
+        fig.savefig(io.BytesIO(), format = 'png')
+        self.plots.plt.close()
+
+    def refresh(self):
+        """ Forget the summaries if a new version of them has been recorded since they were read """
+        version = self.plots.ncor_watermark.recorded(self.plots.dbc, 'summaries')
+        if self.settings is None or version != self.version:
+            if self.settings is not None:
+                LOG.info('the summaries have been made again since they were read: reading them again')
+            self.plots.forget_cached()
+            self.version = version
+            self.settings = self.plots.since_start_settings()
+            self.plots.summary_matrix()
+        return None
+
+    def country_of(self, country):
+        if country not in self.plots.summary_matrix().index:
+            raise ValueError('no summaries for {}'.format(country))
+        return country
+
+    def country(self, country):
+        self.refresh()
+        return [self.plots.make_country_plot(self.country_of(country), self.settings['final_date_str'])]
+
+    def since_start(self, country):
+        self.refresh()
+        return [self.plots.make_days_since_start_plot_for(self.country_of(country), self.settings)]
+
+    def chart(self, name):
+        self.refresh()
+        savefile = 'plots/{}_since_start.png'.format(name)
+        charts = []
+        for by_pop in (True, False):
+            for graph in self.plots.graph_definitions_as_dict():
+                graph['by_pop'] = by_pop
+                charts.append(self.plots.since_start_savefile(graph))
+        if savefile not in charts:
+            raise ValueError('no chart {}: {}'.format(name, ', '.join(
+                [chart[len('plots/'):-len('_since_start.png')] for chart in charts])))
+        self.plots.make_days_since_start_plot([savefile])
+        return [savefile]
+
+    def grid(self, name = None):
+        self.refresh()
+        self.plots.make_world_gridplots_from_jhu()
+        return [self.plots.grid_savefile(graph) for graph in self.plots.graph_definitions_as_dict()]
+
+    def disease(self, disease):
+        if self.nid is None:
+            import produce_nid_plots
+            import ncor_db
+            produce_nid_plots.dbc = ncor_db.connect(self.nidfile, 'read-mostly').cursor()
+            self.nid = produce_nid_plots
+        plot_data = self.nid.disease_plot_data()
+        if disease not in plot_data['names']:
+            raise ValueError('no disease {}'.format(disease))
+        # in matplotlib's own style, as produce_nid_plots.py has it
+        with self.plots.plt.style.context('default'):
+            return [self.nid.make_disease_plot(disease, plot_data)]
+
+    def stats(self, name = None):
+        return ['{}: {} jobs, {:.2f}s each, the longest {:.2f}s'.format(
+                kind, count, total / count, longest)
+                for kind, (count, total, longest) in sorted(self.timings.items())]
+
+    def stop(self, name = None):
+        self.stopping = True
+        return []
+
+    def run(self, job):
+        """ Do a job, {'job': kind, 'name': name}, and time it """
+        start = time.perf_counter()
+        kind = job.get('job')
+        if kind not in JOBS:
+            return {'ok': False, 'error': 'no job {}: {}'.format(kind, ', '.join(JOBS))}
+        try:
+            files = getattr(self, kind)(job.get('name'))
+        except Exception as error:
+            LOG.exception('%s %s failed', kind, job.get('name'))
+            return {'ok': False, 'error': '{}: {}'.format(type(error).__name__, error)}
+        seconds = time.perf_counter() - start
+        if kind in FIGURE_JOBS:
+            count, total, longest = self.timings.get(kind, (0, 0.0, 0.0))
+            self.timings[kind] = (count + 1, total + seconds, max(longest, seconds))
+            LOG.info('%s %s: %s in %.2fs', kind, job.get('name') or '', ', '.join(files), seconds)
+        return {'ok': True, 'files': files, 'seconds': round(seconds, 3)}
+
+# The jobs, and the ones that make figures (and are timed)
+FIGURE_JOBS = ['country', 'since_start', 'chart', 'grid', 'disease']
+JOBS = FIGURE_JOBS + ['stats', 'stop']
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """ One line of JSON in, one line of JSON out """
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            job = json.loads(line)
+        except ValueError:
+            reply = {'ok': False, 'error': 'not a job: {!r}'.format(line[0:80])}
+        else:
+            reply = self.server.worker.run(job)
+        self.wfile.write((json.dumps(reply) + '\n').encode())
+
+def serve(path, dbfile, nidfile, level):
+    """ Start the worker, and do the jobs sent to path one at a time (matplotlib
+        isn't thread safe) until it's sent stop
+    """
+    if os.path.exists(path):
+        try:
+            submit(path, {'job': 'stats'})
+            sys.exit('A worker is already listening on {}'.format(path))
+        except OSError:
+            os.remove(path) # left over from one that died
+    ncor_log.setup(level)
+    start = time.perf_counter()
+    worker = RenderWorker(dbfile, nidfile, FIGSIZE, level)
+    server = socketserver.UnixStreamServer(path, JobHandler)
+    server.worker = worker
+    LOG.info('listening on %s, warmed up in %.2fs', path, time.perf_counter() - start)
+    try:
+        while not worker.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        for line in worker.stats():
+            LOG.info(line)
+    return 0
+
+def submit(path, job):
+    """ Send a job to the worker listening on path, and return its reply """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(job) + '\n').encode())
+        with sock.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+def main():
+    path = SOCKET
+    dbfile = DBFILE
+    nidfile = NIDFILE
+    level = 'info'
+    words = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('SOCKET='):
+            path = arg.split('=', 1)[1]
+        elif arg.startswith('DBFILE='):
+            dbfile = arg.split('=', 1)[1]
+        elif arg.startswith('NIDFILE='):
+            nidfile = arg.split('=', 1)[1]
+        elif arg.startswith('LOGLEVEL='):
+            level = arg.split('=', 1)[1]
+        else:
+            words.append(arg)
+    if len(words) == 0:
+        sys.exit('usage: {} serve|{} [name] [SOCKET=path]'.format(sys.argv[0], '|'.join(JOBS)))
+    if words[0] == 'serve':
+        return serve(path, dbfile, nidfile, level)
+
+    start = time.perf_counter()
+    try:
+        reply = submit(path, {'job': words[0], 'name': ' '.join(words[1:]) or None})
+    except OSError as error:
+        sys.exit('No worker on {} ({}): start one with {} serve'.format(path, error, sys.argv[0]))
+    if not reply['ok']:
+        sys.exit(reply['error'])
+    for line in reply['files']:
+        print(line)
+    if words[0] in FIGURE_JOBS:
+        print('{:.2f}s in the worker, {:.2f}s there and back'.format(reply['seconds'], time.perf_counter() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
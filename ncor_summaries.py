@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+The summaries made from [jhu_data]: every country, the provinces of the
+countries that have more than one, the US counties, and World, by date,
+with the CFR/CRR and 1 and 7 day growth columns.
+
+They're all kept in one table, [summaries], keyed by (Level, Country,
+Province, Date), where Level is 'country', 'province', 'county' (Country =
+'USA', Province = the zero-padded FIPS code) or 'rollup' (World, with
+Country = 'World'). Any set of countries is one query:
+    SELECT Country, Date, Confirmed from [summaries]
+     where Level = 'country' and Country in ('Italy', 'Spain') order by Country, Date
+Each series also gets a view with the name its table used to have, [China],
+[USA.Washington], [World], so the existing queries still work. The
+thousands of counties are one series, and one view, [USA counties], and
+top_counties() gives the fastest growing of them straight off an index.
+
+Each series has a high-water mark in [summary_marks]: the last date of the
+base data it was brought up to. The loaders note the dates of every file
+they (re)load in [summary_pending]. A level is then refreshed from the
+earliest of the first pending date and the days after its series' marks:
+its rows from that date on are deleted and recomputed in one go, with the
+last few rows of each series before it read back in so the windowed
+columns (C1day, C7day, D7day...) come out the same as a full rebuild. Rows
+before that date never change, as the windows only look backwards.
+
+The metrics are worked out by ncor_metrics with NumPy, or with METRICS=sql
+by window SQL calling CAGR() for each row, as they used to be. Extra CAGR
+intervals (LAGS=3,14,28) get their own columns (C3day, C14day...) in
+[summaries]; the views keep to the old ones.
+
+The plots' columns are kept with them: NewC1, NewC7, NewC14... the new
+cases (deaths, recovered, active) per day over 1, 7 and 14 days, and
+DaysC10, DaysD1... the number of days the series has been at or over
+THRESHOLDS, 0 before it gets there. A plot of the days since 10 cases is
+    SELECT DaysC10, NewC7 from [Italy] where Confirmed >= 10 order by Date
+
+With WORKERS > 1 the new rows are worked out in a process pool, a batch of
+countries at a time on read-only connections, before the one transaction
+that writes them all.
+
+A new series, or one without its view, means its level is rebuilt from
+scratch. A run with nothing pending and every mark at the latest date does
+nothing.
+
+CC: BY-SA
+"""
+import re
+import sys
+import datetime
+import concurrent.futures
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+import ncor_db
+import ncor_log
+from ncor_log import LOG
+try:
+    import ncor_metrics # needs numpy; without it the metrics are done in SQL
+except ImportError:
+    ncor_metrics = None
+
+ROUNDING = 4
+LAGS = [7] # the CAGR intervals: C7day, D7day and R7day. More can be added with LAGS=3,14,28
+
+KEYS = ['Level', 'Country', 'Province']
+COLUMNS = ['Date', 'Confirmed', 'Deaths', 'Recovered', 'Active', 'Tested', 'Hospitalized']
+
+def metric_columns(lags = LAGS):
+    """ CFR, CRR, the 1 day growths, then the CAGR columns for each of lags """
+    columns = ['CFR', 'CRR', 'C1day', 'D1day', 'R1day']
+    for lag in lags:
+        columns += ['C{}day'.format(lag), 'D{}day'.format(lag), 'R{}day'.format(lag)]
+    return columns
+
+METRIC_COLUMNS = metric_columns([7]) # the ones the views have, as the old tables did
+
+# The plots' columns: the new cases per day over each of WINDOWS (New{X}1 is
+# just the new cases), and the number of days so far that each series has
+# been at or over the threshold its graphs start from, as in
+# produce_ncor_plots.py, which are the x-axis of the days since N plots
+THRESHOLDS = {'Confirmed': 10, 'Deaths': 1, 'Recovered': 10, 'Active': 10}
+WINDOWS = [1, 7, 14]
+
+def new_column(column, window):
+    """ e.g. NewC7, the new confirmed cases per day over 7 days """
+    return 'New{}{}'.format(column[0], window)
+
+def days_column(column):
+    """ e.g. DaysC10, the days since confirmed cases reached 10 """
+    return 'Days{}{}'.format(column[0], THRESHOLDS[column])
+
+PLOT_COLUMNS = {}
+for column in THRESHOLDS:
+    for window in WINDOWS:
+        PLOT_COLUMNS[new_column(column, window)] = 'Integer' if window == 1 else 'Real'
+    PLOT_COLUMNS[days_column(column)] = 'Integer'
+
+TABLES = {'summary_marks': 'Series Text Unique Primary Key, Source Text, HighWater Text',
+          'summary_pending': 'Source Text, Date Text, Unique (Source, Date)',
+          'summaries': ('Level Text, Country Text, Province Text, Date Text, '
+                        'Confirmed Integer, Deaths Integer, Recovered Integer, Active Integer, '
+                        'Tested Integer, Hospitalized Integer, '
+                        'CFR Real, CRR Real, C1day Real, D1day Real, R1day Real, '
+                        'C7day Real, D7day Real, R7day Real, '
+                        '{}, '
+                        'Primary Key (Level, Country, Province, Date)'
+                       ).format(', '.join(['{} {}'.format(name, kind) for name, kind in PLOT_COLUMNS.items()]))}
+
+def sql_metrics(lags = LAGS):
+    """ The metric columns as window SQL, over the 'series' window,
+        i.e. each (Country, Province) of a level in date order
+    """
+    metrics = ('ROUND(CAST(Deaths as REAL) / Confirmed, {R}) as CFR, '
+               'ROUND(CAST(Recovered as REAL) / Confirmed, {R}) as CRR, '
+               'ROUND(Cast(Confirmed as REAL)/(LAG (Confirmed, 1, 0) OVER series)-1, {R}) as C1day, '
+               'ROUND(Cast(Deaths    as REAL)/(LAG (Deaths,    1, 0) OVER series)-1, {R}) as D1day, '
+               'ROUND(Cast(Recovered as REAL)/(LAG (Recovered, 1, 0) OVER series)-1, {R}) as R1day'
+              ).format(R = ROUNDING)
+    for lag in lags:
+        metrics += (', ROUND(CAGR(Confirmed, LAG (Confirmed, {L}, 0) OVER series, {L}), {R}) as C{L}day, '
+                    'ROUND(CAGR(Deaths,    LAG (Deaths,    {L}, 0) OVER series, {L}), {R}) as D{L}day, '
+                    'ROUND(CAGR(Recovered, LAG (Recovered, {L}, 0) OVER series, {L}), {R}) as R{L}day'
+                   ).format(L = lag, R = ROUNDING)
+    return metrics
+
+def sql_plot_columns(since):
+    """ The plots' columns as window SQL, over the 'series' window. The days
+        are counted from since, on top of each series' count from before it,
+        the Prior{Days...} of its context rows.
+    """
+    columns = []
+    for column, limit in THRESHOLDS.items():
+        for window in WINDOWS:
+            if window == 1:
+                columns.append('{G} - LAG ({G}, 1, 0) OVER series as {N}'.format(G = column, N = new_column(column, 1)))
+            else:
+                columns.append('CAST({G} - LAG ({G}, {W}, 0) OVER series as REAL) / {W} as {N}'.format(
+                               G = column, W = window, N = new_column(column, window)))
+        columns.append(('coalesce(MAX(Prior{N}) OVER series, 0) '
+                        ' + SUM(CASE WHEN Date >= {D} and {G} >= {L} THEN 1 ELSE 0 END) OVER series as {N}'
+                       ).format(G = column, L = limit, D = quoted(since), N = days_column(column)))
+    return ', '.join(columns)
+
+def settings(lags = LAGS):
+    """ What the summaries are made with, for the data version they record
+        (see ncor_watermark): new columns mean they have to be made again
+    """
+    return 'COLUMNS={}'.format(','.join(metric_columns(lags) + list(PLOT_COLUMNS)))
+
+def add_missing_tables(dbc, verbose = 0):
+    """ Databases from before the summary store don't have its tables """
+    dbdo.dbdo(dbc, 'BEGIN', verbose)
+    for table, spec in TABLES.items():
+        dbdo.dbdo(dbc, 'CREATE TABLE IF NOT EXISTS [{}] ({})'.format(table, spec), verbose)
+    dbdo.dbdo(dbc, 'COMMIT', verbose)
+    return None
+
+def file_date(filename):
+    """ The Date a JHU daily report's rows get: MM-DD-YYYY.csv -> YYYY-MM-DD """
+    match = re.match(r'^([0-9]{2})-([0-9]{2})-([0-9]{4})\.csv$', filename)
+    return '{}-{}-{}'.format(match[3], match[1], match[2])
+
+def mark_pending(dbc, source, filename, verbose = 0):
+    """ Note that the rows for filename's date in [source] have changed.
+        Call inside the transaction that loads the file.
+    """
+    dbdo.dbdo_params(dbc, 'INSERT OR IGNORE INTO [summary_pending] (Source, Date) Values (?, ?)',
+                     (source, file_date(filename)), verbose)
+    return None
+
+def quoted(value):
+    """ value as an SQL string literal, for the views, which can't take parameters """
+    return '\'{}\''.format(value.replace('\'', '\'\''))
+
+def context(lag, since, countries = None):
+    """ The rows of a level's series before since that its windows need:
+        the last lag of each, found series by series down the primary key,
+        with their Days{X}{limit} as Prior{Days...}. (ROW_NUMBER() over the
+        whole level sorts all of it.) Takes ?1 = Level. countries limits it
+        to those series.
+    """
+    where = ''
+    if countries is not None:
+        where = 'and Country in ({})'.format(', '.join([quoted(country) for country in countries]))
+    return ('SELECT {S}, {P} FROM (SELECT distinct Country, Province from [summaries] where Level = ?1 {W}) as k '
+            'JOIN [summaries] as s on s.Level = ?1 and s.Country = k.Country and s.Province = k.Province '
+            ' and s.Date < {D} and s.Date >= coalesce((SELECT Date from [summaries] as t '
+            '   where t.Level = ?1 and t.Country = k.Country and t.Province = k.Province and t.Date < {D} '
+            '   order by Date DESC limit 1 offset {O}), \'\') '
+           ).format(S = ', '.join(['s.{}'.format(column) for column in KEYS + COLUMNS]),
+                    P = ', '.join(['s.{N} as Prior{N}'.format(N = days_column(column)) for column in THRESHOLDS]),
+                    W = where, D = quoted(since), O = lag - 1)
+
+def with_context(base, since, lags, countries = None):
+    """ A level's context rows, enough for the longest LAG, then its base rows
+        with no Prior counts
+    """
+    return '{X} UNION ALL SELECT *, {N} FROM ({B})'.format(X = context(max(lags + WINDOWS), since, countries),
+                                                           N = ', '.join(['NULL'] * len(THRESHOLDS)), B = base)
+
+def window_sql(base, since, lags, countries = None):
+    """ A level's rows with the metrics by window SQL, with CAGR() called back
+        for each row. Takes ?1 = Level, then base's parameters, then since.
+    """
+    return ('SELECT * FROM ('
+            '  SELECT {K}, {M}, {PC} FROM ({U}) '
+            '  WINDOW series AS (PARTITION BY Country, Province order by Date)'
+            ') WHERE Date >= ?'
+           ).format(K = ', '.join(KEYS + COLUMNS), M = sql_metrics(lags), PC = sql_plot_columns(since),
+                    U = with_context(base, since, lags, countries))
+
+def numpy_rows(dbc, level, base, params, since, lags, countries = None):
+    """ A level's rows from since on, with the metrics worked out by ncor_metrics """
+    rows = dbc.execute('SELECT * FROM ({}) order by Country, Province, Date'.format(
+                       with_context(base, since, lags, countries)), [level] + list(params)).fetchall()
+    names = KEYS + COLUMNS + ['Prior{}'.format(days_column(column)) for column in THRESHOLDS]
+    values = dict([(name, [row[idx] for row in rows]) for idx, name in enumerate(names)])
+    series = [values['Country'], values['Province']]
+    metrics = ncor_metrics.series_metrics(series, values['Confirmed'], values['Deaths'], values['Recovered'], lags)
+    priors = dict([(days_column(column), values['Prior{}'.format(days_column(column))]) for column in THRESHOLDS])
+    metrics.update(ncor_metrics.plot_metrics(series, values, since, priors, THRESHOLDS, WINDOWS))
+    extras = zip(*[ncor_metrics.as_values(metrics[column]) for column in metric_columns(lags) + list(PLOT_COLUMNS)])
+    width = len(KEYS + COLUMNS)
+    date = names.index('Date')
+    return [row[:width] + extra for row, extra in zip(rows, extras) if row[date] >= since]
+
+def insert_values(columns, lags = LAGS):
+    """ The Values () of an insert of columns, with the metric columns rounded by
+        SQLite's ROUND(), as the window SQL has them
+    """
+    rounded = metric_columns(lags)
+    return ', '.join(['ROUND(?, {})'.format(ROUNDING) if column in rounded else '?' for column in columns])
+
+def level_rows(dbc, level, base, params, since, lags, engine, countries = None):
+    """ A level's rows from since on, KEYS + COLUMNS + the metric and plot columns """
+    if engine == 'numpy':
+        return numpy_rows(dbc, level, base, params, since, lags, countries)
+    return dbc.execute(window_sql(base, since, lags, countries), [level] + list(params) + [since]).fetchall()
+
+def refresh(dbc, level, base, params, since, lags = LAGS, engine = 'numpy', verbose = 0, rows = None):
+    """ Replace the rows of level from since on with base's, where base gives
+        KEYS + COLUMNS for the dates from since on. The last rows of each series
+        before since are put in front of them for the windows, then left out of
+        the insert. since = '' rebuilds the level. rows are the new rows, if
+        they've been worked out already (see SummaryMarks.compute()).
+    """
+    dbdo.dbdo_params(dbc, 'DELETE FROM [summaries] WHERE Level = ? and Date >= ?', (level, since), verbose)
+    columns = KEYS + COLUMNS + metric_columns(lags) + list(PLOT_COLUMNS)
+    if rows is None and engine != 'numpy':
+        # it can all stay in SQLite
+        dbdo.dbdo_params(dbc, 'INSERT INTO [summaries] ({}) {}'.format(', '.join(columns), window_sql(base, since, lags)),
+                         [level] + list(params) + [since], verbose)
+        return None
+    if rows is None:
+        rows = numpy_rows(dbc, level, base, params, since, lags)
+    dbc.executemany('INSERT INTO [summaries] ({}) Values ({})'.format(
+                    ', '.join(columns), insert_values(columns, lags)), rows)
+    return None
+
+# The pool workers' own read-only connection, opened by start_worker()
+worker_dbc = None
+
+def start_worker(filename, level, sample):
+    """ Set up a pool worker: logging as the main process has it, and the database """
+    global worker_dbc
+    ncor_log.setup(level, sample)
+    worker_dbc = ncor_db.connect(filename, 'read-mostly').cursor()
+    return None
+
+def worker_rows(level, base, params, since, lags, engine, countries):
+    """ level_rows() for some of a level's countries, in a pool worker """
+    return level_rows(worker_dbc, level, base, params, since, lags, engine, countries)
+
+def make_view(dbc, name, level, country, province, columns, verbose = 0):
+    """ A view of one series, under the name its table used to have.
+        province None is all of the country's, e.g. [USA counties].
+    """
+    where = 'order by Province, Date'
+    if province is not None:
+        where = 'and Province = {} order by Date'.format(quoted(province))
+    dbdo.dbdo(dbc,
+              ('CREATE VIEW [{N}] AS SELECT {C}, {MC} FROM [summaries] '
+               'where Level = {L} and Country = {CN} {W}'
+              ).format(N = name, C = ', '.join(columns), MC = ', '.join(METRIC_COLUMNS + list(PLOT_COLUMNS)),
+                       L = quoted(level), CN = quoted(country), W = where),
+              verbose)
+    return None
+
+def top_counties(dbc, count = 10, date = None):
+    """ The count US counties with the highest 7 day growth (C7day) on date, the
+        latest by default, as [(FIPS, Admin2, State, Date, Confirmed, C7day)],
+        off the summaries_county_date_c7day index.
+    """
+    if date is None:
+        date = dbdo.value_from_query(dbc, 'SELECT max(Date) from [summaries] where Level = \'county\'')
+    # the lookup table's FIPS is text, and not always zero-padded
+    return dbdo.rows_from_query(dbc,
+        ('SELECT s.Province as FIPS, u.Admin2, u.Province, s.Date, s.Confirmed, s.C7day '
+         'FROM (SELECT Province, Date, Confirmed, C7day from [summaries] '
+         '      where Level = \'county\' and Date = {D} order by C7day DESC limit {N}) as s '
+         'LEFT JOIN [UID_ISO_FIPS] as u on CAST(u.FIPS as INTEGER) = CAST(s.Province as INTEGER) '
+         'order by s.C7day DESC').format(D = quoted(date), N = int(count)))
+
+def next_day(date):
+    return (datetime.date.fromisoformat(date) + datetime.timedelta(days = 1)).isoformat()
+
+class SummaryMarks:
+    """ The high-water marks of the series made from one source table, and its
+        pending dates. update() brings a level up to date, done() clears the
+        pending dates once they've all been through.
+    """
+    def __init__(self, dbc, source, verbose = 0, lags = LAGS, engine = 'numpy', workers = 1):
+        self.dbc = dbc
+        self.source = source
+        self.verbose = verbose
+        self.lags = lags
+        self.engine = engine if ncor_metrics is not None else 'sql'
+        self.workers = workers
+        self.computed = {} # level: (since, rows), from compute()
+        # New CAGR intervals need their columns, and everything recomputed to fill them
+        self.rebuild = self.add_metric_columns()
+        self.marks = dbdo.dict_from_query(dbc, ('SELECT Series, HighWater from [summary_marks] '
+                                                'where Source = \'{}\''.format(source)))
+        self.latest = dbdo.value_from_query(dbc, 'SELECT max(Date) from [{}]'.format(source))
+        if self.latest in (None, 'Null'):
+            self.latest = ''
+        pending = dbdo.value_from_query(dbc, ('SELECT min(Date) from [summary_pending] '
+                                              'where Source = \'{}\''.format(source)))
+        self.pending = None if pending in (None, 'Null') else pending
+        self.views = set(dbdo.list_from_query(dbc, 'SELECT name from sqlite_master where type = \'view\''))
+        self.counts = {'built': 0, 'refreshed': 0, 'unchanged': 0}
+
+    def add_metric_columns(self):
+        """ Add the columns for any new lags, or the plots' columns, to [summaries].
+            Returns the ones added.
+        """
+        existing = [row[1].lower() for row in dbdo.rows_from_query(self.dbc, 'PRAGMA table_info([summaries])')]
+        kinds = dict([(column, 'Real') for column in metric_columns(self.lags)])
+        kinds.update(PLOT_COLUMNS)
+        added = []
+        for column, kind in kinds.items():
+            if column.lower() not in existing:
+                LOG.info('adding column %s to [summaries]', column)
+                dbdo.dbdo(self.dbc, 'ALTER TABLE [summaries] ADD COLUMN {} {}'.format(column, kind), self.verbose)
+                added.append(column)
+        return added
+
+    def up_to_date(self, required = ()):
+        """ True if nothing's been loaded since the last run, and each of the
+            required series, e.g. a new level's, has been made
+        """
+        return (self.pending is None and len(self.marks) > 0 and not self.rebuild
+                and all([name in self.marks for name in required])
+                and min(self.marks.values()) >= self.latest
+                and all([name in self.views for name in self.marks]))
+
+    def since(self, names):
+        """ The first date to recompute for the series, or '' to rebuild them """
+        if self.rebuild:
+            return ''
+        since = None
+        for name in names:
+            if not self.marks.get(name) or name not in self.views:
+                return ''
+            after = next_day(self.marks[name])
+            if since is None or after < since:
+                since = after
+        if self.pending is not None and (since is None or self.pending < since):
+            since = self.pending
+        return '' if since is None else since
+
+    def compute(self, levels):
+        """ With more than one worker, work out the new rows of levels, a list of
+            (level, series, base_for) as for update(), in a process pool, for
+            update() to write. A level with more than one country is split into
+            batches of them, with base_for(since, countries) giving just theirs.
+            Call it before the transaction update() is in: the workers read the
+            database as it was committed, on their own read-only connections.
+        """
+        filename = dbdo.row_from_query(self.dbc, 'PRAGMA database_list')[2]
+        if self.workers < 2 or filename == '':
+            return None
+        jobs = []
+        for level, series, base_for in levels:
+            since = self.since([name for name, country, province in series])
+            if since > self.latest:
+                continue
+            countries = sorted(set([country for name, country, province in series]))
+            if len(countries) < 2:
+                jobs.append((level, since) + base_for(since) + (None,))
+                continue
+            # a few batches per worker, so the big countries don't hold everything up
+            size = -(-len(countries) // (self.workers * 4))
+            for start in range(0, len(countries), size):
+                batch = countries[start:start + size]
+                jobs.append((level, since) + base_for(since, batch) + (batch,))
+
+        LOG.info('Working out %d batches of summaries with %d workers', len(jobs), self.workers)
+        with concurrent.futures.ProcessPoolExecutor(max_workers = self.workers,
+                                                    initializer = start_worker,
+                                                    initargs = (filename, ncor_log.level_name(), ncor_log.SAMPLE)) as pool:
+            futures = [(level, since, pool.submit(worker_rows, level, base, params, since, self.lags, self.engine, batch))
+                       for level, since, base, params, batch in jobs]
+            for level, since, future in futures:
+                self.computed.setdefault(level, (since, []))[1].extend(future.result())
+        return None
+
+    def update(self, level, series, columns, base_for):
+        """ Bring every series of a level up to date. series is a list of
+            (name, country, province), base_for(since) gives (sql, params) for
+            the base rows of the level from since on, and columns are the ones
+            the views show. If compute() has already worked out the rows, they're
+            written as they are.
+        """
+        names = [name for name, country, province in series]
+        since = self.since(names)
+        if since > self.latest:
+            self.counts['unchanged'] += len(names)
+            return None
+        if level in self.computed:
+            since, rows = self.computed.pop(level)
+            refresh(self.dbc, level, None, None, since, self.lags, self.engine, self.verbose, rows)
+        else:
+            base, params = base_for(since)
+            refresh(self.dbc, level, base, params, since, self.lags, self.engine, self.verbose)
+        self.counts['built' if since == '' else 'refreshed'] += len(names)
+
+        for name, country, province in series:
+            if name in self.views and self.rebuild:
+                # it's missing the columns just added
+                dbdo.dbdo(self.dbc, 'DROP VIEW [{}]'.format(name), self.verbose)
+                self.views.remove(name)
+            if name not in self.views:
+                # there's a table of that name from before the summary store
+                if dbdo.value_from_query(self.dbc, ('SELECT count(*) from sqlite_master '
+                                                    'where type = \'table\' and name = {}'.format(quoted(name)))):
+                    dbdo.dbdo(self.dbc, 'DROP TABLE [{}]'.format(name), self.verbose)
+                make_view(self.dbc, name, level, country, province, columns, self.verbose)
+                self.views.add(name)
+        self.dbc.executemany('INSERT OR REPLACE INTO [summary_marks] (Series, Source, HighWater) Values (?, ?, ?)',
+                             [(name, self.source, self.latest) for name in names])
+        for name in names:
+            self.marks[name] = self.latest
+        return None
+
+    def done(self):
+        """ Clear the pending dates. Call inside a transaction, after the last update() """
+        dbdo.dbdo_params(self.dbc, 'DELETE FROM [summary_pending] WHERE Source = ?', (self.source,), self.verbose)
+        LOG.info('{} summaries to {}: {built} built, {refreshed} refreshed, {unchanged} unchanged ({} metrics, {} workers)'.format(
+                 self.source, self.latest, self.engine, self.workers, **self.counts))
+        return None
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+The data-version watermark: what the loaders had put in the database the
+last time they finished, and what each later stage (the summaries, the
+plots) was last made from, in [data_versions].
+
+The version is the number of files of each source in [files] with a digest
+of their hashes, and the rows and latest date of each of the data tables,
+so a reloaded file that changed counts even if the row counts don't. It's
+kept as JSON so it can be read:
+    SELECT * from [data_versions]
+
+process_ncor_2019_data.py records the 'ingest' version after the loads,
+and each stage compares the version it last recorded with the version of
+what it's made from, and skips itself if they're the same: the summaries
+with 'ingest' (and their settings), the plots with 'summaries', which is
+only recorded once they've been committed. FORCE (or --force) runs them
+anyway.
+
+CC: BY-SA
+"""
+import sys
+import json
+import hashlib
+import datetime
+sys.path.append('/home/odaiwai/src/dob_DBHelper')
+import db_helper as dbdo # This is a library of my own database routines - it just
+                         # wraps sqlite commands into handier methods I like
+from ncor_log import LOG
+
+TABLES = {'data_versions': 'Stage Text Unique Primary Key, Version Text, Recorded Text'}
+
+# The data tables, and their date column
+SOURCES = {'jhu_data': 'Date',
+           'jhu_us_data': 'Date',
+           'cn_prov': 'ISO_Date',
+           'cn_city': 'ISO_Date',
+           'hgis_data': 'Date'}
+
+def add_missing_tables(dbc, verbose = 0):
+    """ Databases from before the watermark don't have its table """
+    dbdo.dbdo(dbc, 'BEGIN', verbose)
+    for table, spec in TABLES.items():
+        dbdo.dbdo(dbc, 'CREATE TABLE IF NOT EXISTS [{}] ({})'.format(table, spec), verbose)
+    dbdo.dbdo(dbc, 'COMMIT', verbose)
+    return None
+
+def table_exists(dbc, table):
+    return dbdo.value_from_query(dbc, ('SELECT count(*) from sqlite_master '
+                                       'where type = \'table\' and name = \'{}\''.format(table))) == 1
+
+def data_version(dbc):
+    """ The version of what's in the database now, as JSON """
+    version = {}
+    for source, count in dbdo.rows_from_query(dbc, 'SELECT Source, count(*) from [files] group by Source order by Source'):
+        sha = hashlib.sha256()
+        for filename, digest in dbdo.rows_from_query(dbc, ('SELECT filename, Hash from [files] where Source = \'{}\' '
+                                                           'order by filename'.format(source))):
+            sha.update('{} {}\n'.format(filename, digest).encode())
+        version['files {}'.format(source)] = [count, sha.hexdigest()[0:16]]
+    for table, date in SOURCES.items():
+        if table_exists(dbc, table):
+            version[table] = list(dbdo.row_from_query(dbc, 'SELECT count(*), max({}) from [{}]'.format(date, table)))
+    return json.dumps(version, sort_keys = True)
+
+def recorded(dbc, stage):
+    """ The version stage last recorded, or None """
+    if not table_exists(dbc, 'data_versions'):
+        return None
+    version = dbdo.value_from_query(dbc, 'SELECT Version from [data_versions] where Stage = \'{}\''.format(stage))
+    return None if version in (None, 'Null') else version
+
+def record(dbc, stage, version, verbose = 0):
+    """ Note that stage is up to date with version """
+    dbdo.dbdo(dbc, 'BEGIN', verbose)
+    dbdo.dbdo_params(dbc, 'INSERT OR REPLACE INTO [data_versions] (Stage, Version, Recorded) Values (?, ?, ?)',
+                     (stage, version, datetime.datetime.now().isoformat(timespec = 'seconds')), verbose)
+    dbdo.dbdo(dbc, 'COMMIT', verbose)
+    return None
+
+def record_ingest(dbc, verbose = 0):
+    """ Record the version the loads have left. Returns True if it's changed. """
+    version = data_version(dbc)
+    changed = version != recorded(dbc, 'ingest')
+    if changed:
+        LOG.info('new data version: %s', version)
+        record(dbc, 'ingest', version, verbose)
+    return changed
+
+def stage_version(dbc, settings = '', source = 'ingest'):
+    """ What a stage records when it's done: the version of the stage it's made
+        from (source), and any of its settings that change what it makes, e.g.
+        the summaries' columns
+    """
+    version = recorded(dbc, source)
+    if version is None:
+        return None
+    return '{} {}'.format(version, settings).strip()
+
+def up_to_date(dbc, stage, settings = '', source = 'ingest'):
+    """ True if stage was last made from the version source last recorded, with the same settings """
+    version = stage_version(dbc, settings, source)
+    return version is not None and recorded(dbc, stage) == version
@@ -10,13 +10,29 @@ CC: BY-SA
 import sys
 import os
 import re
-import sqlite3
 import json
 import datetime
+import itertools
+import concurrent.futures
 
 sys.path.append('/home/odaiwai/src/dob_DBHelper')
 import db_helper as dbdo # This is a library of my own database routines - it just
                          # wraps sqlite commands into handier methods I like
+from ncor_inserts import InsertPlans
+from ncor_csv import CSVReader, normalise_fieldnames
+from ncor_manifest import Manifest
+from ncor_gazetteer import Gazetteer
+from ncor_normalise import normalise_countries, admin1_from_abbr, jhu_patterns
+import ncor_log
+from ncor_log import LOG, FileStats
+import ncor_indexes
+import ncor_db
+import ncor_summaries
+import ncor_watermark
+try:
+    import ncor_jhu_frames # needs pandas, which is only used for ENGINE=pandas
+except ImportError:
+    ncor_jhu_frames = None
 
 def make_tables():
     # Make the Database tables from the JSON
@@ -46,7 +62,7 @@ def make_tables():
         'hksarg': ('timestamp text Unique Primary Key, New Integer, Total Integer, '
                    'Cured Integer, Remain Integer, Stable Integer, Serious Integer, '
                    'Critical Integer, Confirmed Integer, Dead Integer'),
-        'cn_prov': ('Timestamp Integer, ISO_Date Text, '
+        'cn_prov': ('Timestamp Integer, ISO_Date Text, Filename Text, '
                     'ProvinceName Text, Province_EN Text, confirmedCount Integer, '
                     'suspectedCount Integer, deadCount Integer, curedCount Integer, '
                     'LocationID Integer, Comment Text, provinceShortName Text, '
@@ -54,14 +70,14 @@ def make_tables():
                     'highDangerCount Int midDangerCount Int, detectOrgCount Int, '
                     'vaccinationOrgCount Int, dangerAreas Text, '
                     'notShowCurrentConfirmedCount Text, currentConfirmedCountStr Text' ),
-        'cn_city': ('Timestamp Integer, ISO_Date Text, '
+        'cn_city': ('Timestamp Integer, ISO_Date Text, Filename Text, '
                     'ProvinceName Text, Province_EN Text, CityName Text, City_EN Text, '
                     'currentConfirmedCount Integer, suspectedCount Integer, '
                     'deadCount Integer, LocationID Integer, confirmedCount Integer, '
                     'curedCount Integer, highDangerCount Int midDangerCount Int, '
                     'detectOrgCount Int, cavvinationOrgCount Int, dangerAreas Text, '
                     'notShowCurrentConfirmedCount Text, currentConfirmedCountStr Text' ),
-        'jhu_data': ('Timestamp Integer, Date Text, '
+        'jhu_data': ('Timestamp Integer, Date Text, Filename Text, '
                      'FIPS Integer, Admin2 Text, Country Text, Province Text, '
                      'Last_Update Text, incident_rate Real, '
                      'People_tested Integer, People_hospitalized Integer, '
@@ -69,7 +85,7 @@ def make_tables():
                      'Active Integer, Latitude Real, Longitude Real, '
                      'Combined_Key Text, comment Text, '
                      'Incidence_Rate Real, Case_Fatality_ratio Real'),
-        'jhu_us_data': ('Timestamp Integer, Date Text, Province Text, Country Text, '
+        'jhu_us_data': ('Timestamp Integer, Date Text, Filename Text, Province Text, Country Text, '
                         'Last_Update Text, Latitude Real, Longitude Real, '
                         'Confirmed Integer, Deaths Integer, Recovered Integer, '
                         'Active Integer, FIPS Integer, Incident_rate Real, '
@@ -96,48 +112,41 @@ def make_tables():
                          'Admin2 Text, Province Text, Country Text, '
                          'Latitude Real, Longitude Real, Combined_Key Text, Population Integer'),
         'hgis_data': ('Date Text, Place Text, Confirmed Integer, Dead Integer, '
-                      'Recovered Integer, Active Integer'),
-        'files': ('filename Text, Source Text, dateProcessed Text')
+                      'Recovered Integer, Active Integer, Filename Text'),
+        'files': ('filename Text, Source Text, dateProcessed Text, '
+                  'Size Integer, Mtime Real, Hash Text')
             }
+    # the summary tables' high-water marks go with the data they were made from
+    tabledefs.update(ncor_summaries.TABLES)
+    tabledefs.update(ncor_watermark.TABLES)
     dbdo.make_tables_from_dict(dbc, tabledefs, VERBOSE)
 
-def cagr(value1, value2, interval):
-    """ Calculate the CAGR (Compound Average Growth Rate) between value1 and value 2 over interval
-        e.g. Value1 is today's data, Value2 is 7 days ago
+def typed_list(list):
     """
-    value1 = float(value1)
-    value2 = float(value2)
-    if value2 <= 0 or interval <= 0:
-        cagr = -1
-    else:
-        cagr = ((value1/value2) ** (1/interval))-1
-    return cagr
-
-def escaped_list(list):
-    """
-    Given a list, return it as a comma-separated list, quoted if necessary
+    Given a list of strings, return the values as Python types for use as SQL
+    parameters. Items which aren't dates, names, numbers or empty are dropped.
     """
-    escaped_list = []
+    typed_list = []
     for item in list:
         match = re.match(r'^[0-9]+\/[0-9]+\/[0-9]+ [0-9]+\:[0-9]+$', item)
         if match:
             #print(match)
-            escaped_list.append('\\\"{}\\\"'.format(item))
+            typed_list.append(item)
 
         match = re.match(r'[A-Za-z\u4e00-\u9fff]+', item)
         if match:
-            escaped_list.append('\\\"{}\\\"'.format(item))
+            typed_list.append(item)
 
         match = re.match(r'^[0-9]+$', item)
         if match:
-            escaped_list.append(item)
+            typed_list.append(int(item))
 
         match = re.match(r'^$', item)
         if match:
-            escaped_list.append('0')
+            typed_list.append(0)
 
-    #print(escaped_list)
-    return ', '.join(escaped_list)
+    #print(typed_list)
+    return typed_list
 
 def read_hksarg_pr():
     # read in the HK SARG Press Releases
@@ -145,16 +154,19 @@ def read_hksarg_pr():
     datesplit = re.compile(r'[/: ]')
     newline = re.compile(r'\n')
     filename = DATADIR + '/hksarg_pr.csv'
-    print(filename)
+    stats = FileStats('HKSARG', filename, plans)
     with open(filename, 'r') as infh:
         lines = list(infh)
 
+    fields = 'Timestamp, New, Total, Cured, Remain, Stable, Serious, Critical, Confirmed, Dead'.split(', ')
     dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
     for line in lines:
         values = tab.split(line)
+        if stats.sample():
+            LOG.debug('values: %s', values)
         date_str = values.pop(0)
-        # convert the components into escaped
-        escaped = escaped_list(values)
+        # convert the components into SQL parameters
+        typed = typed_list(values)
 
         # make a datetime object of the date
         date_list = datesplit.split(date_str)
@@ -162,116 +174,38 @@ def read_hksarg_pr():
                                  int(date_list[0]), int(date_list[3]),
                                  int(date_list[4]))
 
-        sqlcmd = 'INSERT OR IGNORE INTO [hksarg] (Timestamp, New, Total, Cured, Remain, Stable, Serious, Critical, Confirmed, Dead) Values (\"{}\", {});'.format(date, escaped)
-        dbdo.dbdo(dbc, sqlcmd, VERBOSE)
+        plans.insert('hksarg', fields, [str(date)] + typed, 'INSERT OR IGNORE')
 
+    plans.flush()
+    stats.done()
     dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
     return None
 
-def quoted_if_required(string):
-    if type(string) == str:
-        return '"{}"'.format(string)
-    elif string is None:
-        return '""'
-    else:
-        return '{}'.format(string)
-
-def normalise_countries(country):
-    # There's been a bit of inconsistency with naming of countries
-    # Make a dict to keep things consistent.
-    # On March 10th, the naming has started to get a bit political
-    normalise_countries ={'Republic of Ireland': 'Ireland', # Now that the UK has had such a bad response
-                          'North Ireland': 'United Kingdom',# they can own the north too.
-                          ' Azerbaijan': 'Azerbaijan', # Spurious Spacing issue
-                          'US': 'USA',
-                          'U.S.': 'USA',
-                          'UK': 'United Kingdom',
-                          'Mainland China': 'China',
-                          'Hong Kong SAR': 'Hong Kong', # stick with initial usage
-                          'Macao SAR': 'Macau',         # Stick with initial usage
-                          'Taipei and environs': 'Taiwan', # Taiwan, just Taiwan
-                          'Taiwan*': 'Taiwan',          # Taiwan
-                          'occupied Palestinian territory': 'Palestine', # Pointless change
-                          'West Bank and Gaza': 'Palestine', # Pointless change
-                          'Russian Federation': 'Russia', # Pointless change
-                          'The Bahamas': 'Bahamas', # Pointless change
-                          'Bahamas# The': 'Bahamas', # Pointless change
-                          'Czech Republic': 'Czechia',
-                          'Iran (Islamic Republic of)': 'Iran',# Are there multiple Irans?
-                          'Holy See': 'Vatican City',
-                          'Viet Nam': 'Vietnam',
-                          'Korea# South': 'South Korea',
-                          'Gambia# The': 'The Gambia',
-                          'Cote d\'Ivoire': 'Ivory Coast'
-                          }
-    if country in normalise_countries.keys():
-        return normalise_countries[country]
-    else:
-        return country
-
-def admin1_from_abbr(abbr):
-    """ Return the State Name given the abbrevation as defined in ISO 3166-2"""
-    # Extended for Canada
-    states_dict = {'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas',
-                   'CA': 'California', 'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware',
-                   'FL': 'Florida', 'GA': 'Georgia', 'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois',
-                   'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas', 'KY': 'Kentucky', 'LA': 'Louisiana',
-                   'ME': 'Maine', 'MD': 'Maryland', 'MA': 'Massachusetts', 'MI': 'Michigan', 'MN': 'Minnesota',
-                   'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana', 'NE': 'Nebraska', 'NV': 'Nevada',
-                   'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico', 'NY': 'New York',
-                   'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma',
-                   'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
-                   'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
-                   'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin',
-                   'WY': 'Wyoming', 'DC': 'District of Columbia', 'AS': 'American Samoa', 'GU': 'Guam',
-                   'MP': 'Northern Mariana Islands', 'PR': 'Puerto Rico', 'UM': 'United States Minor Outlying Islands',
-                   'VI': 'Virgin Islands, U.S.',
-                   'NL': 'Newfoundland and Labrador', 'PE': 'Prince Edward Island', 'NS': 'Nova Scotia',
-                   'NB': 'New Brunswick', 'QC': 'Quebec', 'ON': 'Ontario', 'MB': 'Manitoba', 'SK': 'Saskatchewan',
-                   'AB': 'Alberta', 'BC': 'British Columbia', 'YT': 'Yukon', 'NT': 'Northwest Territories',
-                   'NU': 'Nunavut'}
-    return states_dict[abbr]
-
 def read_generic_file(datafile, table_name):
     """Read a generic single file into a named table
     """
-    with open(datafile, 'r') as infile:
-        lines = list(infile)
-        fields = field_types_from_schema(table_name)
-        # first line is fieldnames
+    with CSVReader(datafile) as reader:
         fixcomma = re.compile(r'([0-9]),([0-9])')
-        fixprov  = re.compile(r'([A-Za-z]+)/([A-Za-z]+)')
-        fixspcs  = re.compile(r'(\s+)')
         # First Line - gives us the fieldnames
-        line = fixprov.sub(r'\1', lines.pop(0))
-        line = fixspcs.sub(r'_', line.rstrip())
         # The fields can change (23 March 2020), so need to have a more robust way of handling them
         # This figures out the fields from the first line, and adds extra if necessary
-        line_fields = line.rstrip().split(r',')
-        norm_fields = normalise_fieldnames(line_fields)
-        print(line_fields, '\n', norm_fields)
+        norm_fields = reader.fields
+        LOG.debug('%s -> %s', reader.line_fields, norm_fields)
+        stats = FileStats(table_name, datafile, plans)
 
         dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
-        for line in lines:
-            # remove commas between double quotes - replace with #
-            line = re.sub(',(?=[^"]*"[^"]*(?:"[^"]*"[^"]*)*$)', '#', line)
-            line = re.sub('"', '', line).rstrip()
-
-            values = line.rstrip('\n').split(',')
-            print(values)
+        for values in reader.tuples():
             value_list = []
             for value in values:
                 value = fixcomma.sub(r'\1\2', value)
-                print(value, type(value))
 
-                value_list.append(quoted_if_required(value))
-            values = ', '.join(value_list)
-            field_names = ', '.join(norm_fields)
-            dbdo.dbdo(dbc,
-                      ('INSERT INTO [{T}] ({F}) '
-                       'Values ({V})'.format(T = table_name, F = field_names, V = values)),
-                      VERBOSE)
+                value_list.append(value)
+            if stats.sample():
+                LOG.debug('values: %s', value_list)
+            plans.insert(table_name, norm_fields, value_list)
 
+        plans.flush()
+        stats.done()
         dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
     return None
     #result = read_generic_file(datafile, fields, table_name)
@@ -281,66 +215,65 @@ def read_populations():
     """
     with open('./01_download_data/world_population.csv', 'r') as infile:
         lines = list(infile)
-        fields = ('id, Country, Population, Yearly_Change, Net_Change , Density, '
+        fields = ('id, Country, Population, Yearly_Change, Net_Change, Density, '
                   'Land_Area, Migrants, Fert_rate, median_age, Urban_pct, '
-                  'world_pct, alt_name')
+                  'world_pct, alt_name').split(', ')
         # first line is fieldnames
         fixcomma = re.compile(r'([0-9]),([0-9])')
         descriptions = lines.pop(0)
-        print(descriptions)
+        LOG.debug(descriptions.rstrip())
+        stats = FileStats('populations', 'world_population.csv', plans)
         dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
         for line in lines:
             values = line.rstrip('\n').split(';')
-            print(values)
             country = values[1]
             alt_name = normalise_countries(country)
-            print(alt_name)
             values.append(alt_name)
 
             value_list = []
-            print(values)
             for value in values:
                 value = fixcomma.sub(r'\1\2', value)
-                print(value, type(value))
                 if value[-1:] == '%':
                     value = value[0:-2]
 
 
-                value_list.append(quoted_if_required(value))
-            values = ', '.join(value_list)
-            dbdo.dbdo(dbc,'INSERT OR IGNORE INTO [populations] ({F}) Values ({V})'.format(F=fields, V=values), VERBOSE)
+                value_list.append(value)
+            if stats.sample():
+                LOG.debug('values: %s', value_list)
+            plans.insert('populations', fields, value_list, 'INSERT OR IGNORE')
+        plans.flush()
+        stats.done()
         dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
 
     with open('./01_download_data/wiki_populations.csv', 'r') as infile:
         lines = list(infile)
-        fields = 'id, Country, Population, pct_Global, date, Source, alt_name'
+        fields = 'id, Country, Population, pct_Global, date, Source, alt_name'.split(', ')
         # first line is fieldnames
         fixcomma = re.compile(r'([0-9]),([0-9])')
         descriptions = lines.pop(0)
-        print(descriptions)
+        LOG.debug(descriptions.rstrip())
+        stats = FileStats('wiki_populations', 'wiki_populations.csv', plans)
         dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
         for line in lines:
             values = line.rstrip('\n').split(';')
-            print(values)
             country = values[1]
             alt_name = normalise_countries(country)
-            print(alt_name)
             values.append(alt_name)
 
             value_list = []
-            print(values)
             for value in values:
                 value = fixcomma.sub(r'\1\2', value)
-                print(value, type(value))
                 if value[-1:] == '%':
                     value = value[0:-2]
 
 
-                value_list.append(quoted_if_required(value))
-            values = ', '.join(value_list)
-            dbdo.dbdo(dbc,'INSERT INTO [wiki_populations] ({F}) Values ({V})'.format(F=fields, V=values), VERBOSE)
-
+                value_list.append(value)
+            if stats.sample():
+                LOG.debug('values: %s', value_list)
+            plans.insert('wiki_populations', fields, value_list)
 
+        plans.flush()
+        stats.done()
         dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
     return None
 
@@ -351,26 +284,26 @@ def read_un_places():
         un_countries = json.loads(infile.read())
         fields = ('id, hrinfo_id, fts_api_id, reliefweb_id, m49, admin_level, dgacm_list, '
                   'iso2, iso3, lat, long, arabic_short, chinese_short, french_short, '
-                  'default_form, fts, russian_short, spanish_short')
+                  'default_form, fts, russian_short, spanish_short').split(', ')
         dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
         for entity in un_countries['data']:
             value_list = []
             for object in ['id', 'hrinfo_id', 'fts_api_id', 'reliefweb_id', 'm49', 'admin_level', 'dgacm-list', 'iso2', 'iso3']:
-                value_list.append(quoted_if_required(entity[object]))
+                value_list.append(entity[object])
 
             # Add the gelocation data
             geo = entity['geolocation']
-            value_list.append(quoted_if_required(geo['lat']))
-            value_list.append(quoted_if_required(geo['lon']))
+            value_list.append(geo['lat'])
+            value_list.append(geo['lon'])
 
            # Add the Label Data
             labels = entity['label']
             for label in ['arabic-short', 'chinese-short', 'french-short', 'default', 'fts', 'russian-short', 'spanish-short']:
-                value_list.append(quoted_if_required(labels[label]))
+                value_list.append(labels[label])
 
-            values = ', '.join(value_list)
-            dbdo.dbdo(dbc,'INSERT INTO [un_places] ({F}) Values ({V})'.format(F=fields, V=values), VERBOSE)
+            plans.insert('un_places', fields, value_list)
 
+        plans.flush()
         dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
     return None
 
@@ -381,17 +314,14 @@ def read_china_places():
     with open('./gis/chn_admbnda_adm2_ocha/chn_admbnda_adm2_ocha.csv', 'r') as infh:
         lines = list(infh)
 
-    fields =  'OBJECTID, ADMIN_TYPE, ADM2_CAP, ADM2_EN, ADM2_ZH, ADM2_PCODE, ADM1_EN, ADM1_ZH, ADM1_PCODE, ADM0_EN, ADM0_ZH, ADM0_PCODE'
+    fields =  'OBJECTID, ADMIN_TYPE, ADM2_CAP, ADM2_EN, ADM2_ZH, ADM2_PCODE, ADM1_EN, ADM1_ZH, ADM1_PCODE, ADM0_EN, ADM0_ZH, ADM0_PCODE'.split(', ')
     dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
     for line in lines:
         components = line.rstrip('\n').split(';')
         #print(components)
-        values = '{}'.format(components.pop(0))
-        for component in components:
-            values += r', "{}"'.format(component)
-
-        dbdo.dbdo(dbc, 'INSERT into [places] ({}) Values ({})'.format(fields, values), VERBOSE)
+        plans.insert('places', fields, components)
 
+    plans.flush()
     dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
     return None
 
@@ -402,74 +332,71 @@ def read_3g_dxy_cn_json():
     """
     files = os.listdir(DATADIR)
     areastat = re.compile(r'^([0-9]{8})_([0-9]{6})_getAreaStat.json$')
-    already_processed = dbdo.list_from_query(dbc, 'select filename from files;')
-    print('Reading 3G_DXY.CN data')
-    for filename in files:
+    LOG.info('Reading 3G_DXY.CN data')
+    areastat_files = [filename for filename in files if areastat.match(filename)]
+    manifest = Manifest(dbc, plans, '3GDXY', VERBOSE)
+    gazetteer = Gazetteer(dbc)
+    for filename, status in manifest.files_to_process(DATADIR, areastat_files):
         match = areastat.match(filename)
-
-        if match and not(filename in already_processed):
-            dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
-            date = match[1]
-            time = match[2]
-            timestamp = '{}{}'.format(date, time)
-            #print(int(date[0:4]), int(date[4:6]), int(date[6:]), int(time[0:2]), int(time[2:4]), int(time[4:]))
-            iso_date = datetime.datetime(int(date[0:4]), int(date[4:6]), int(date[6:]), int(time[0:2]), int(time[2:4]), int(time[4:]))
-            print(timestamp, filename, iso_date)
-            with open('{}/{}'.format(DATADIR, filename), 'r') as infile:
-                areastats = json.loads(infile.read())
-
-            print(len(areastats))
-            # Walk the tree
-            pfields_base = 'Timestamp, ISO_Date, ProvinceName, Province_EN'
-            cfields_base = 'Timestamp, ISO_Date, ProvinceName, Province_EN, City_EN'
-            #cfields = 'Timestamp, ISO_Date, Province_ZH, Province_EN, CityEN, CityName, Confirmed, Suspected, Cured, Dead, AllConfirmed, LocationID'
-            for province in areastats:
-                province_en = dbdo.value_from_query(dbc, 'select distinct(ADM1_EN) from places where ADM1_ZH like \'{}%\';'.format(province['provinceName']))
-                #print('Province:', province.keys())
-                values = '{}, "{}", "{}", "{}"'.format(
-                            int(timestamp), iso_date,
-                            province['provinceName'], province_en)
+        dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
+        if status == 'changed':
+            for table in ('cn_prov', 'cn_city'):
+                dbdo.dbdo_params(dbc, 'DELETE FROM [{}] WHERE Filename = ?'.format(table), (filename,), VERBOSE)
+        date = match[1]
+        time = match[2]
+        timestamp = '{}{}'.format(date, time)
+        #print(int(date[0:4]), int(date[4:6]), int(date[6:]), int(time[0:2]), int(time[2:4]), int(time[4:]))
+        iso_date = datetime.datetime(int(date[0:4]), int(date[4:6]), int(date[6:]), int(time[0:2]), int(time[2:4]), int(time[4:]))
+        stats = FileStats('3GDXY', filename, plans)
+        with open('{}/{}'.format(DATADIR, filename), 'r') as infile:
+            areastats = json.loads(infile.read())
+
+        # Walk the tree
+        pfields_base = ['Timestamp', 'ISO_Date', 'Filename', 'ProvinceName', 'Province_EN']
+        cfields_base = ['Timestamp', 'ISO_Date', 'Filename', 'ProvinceName', 'Province_EN', 'City_EN']
+        #cfields = 'Timestamp, ISO_Date, Province_ZH, Province_EN, CityEN, CityName, Confirmed, Suspected, Cured, Dead, AllConfirmed, LocationID'
+        for province in areastats:
+            province_en = gazetteer.province_en(province['provinceName'])
+            #print('Province:', province.keys())
+            values = [int(timestamp), iso_date, filename, province['provinceName'], province_en]
+            if stats.sample():
+                LOG.debug('province: %s', province)
+
+            # Build up the list of Columns and values depending on what's in the JSON
+            pfields = list(pfields_base)
+            #print('Province:', province.keys(), province)
+            for key in province.keys():
+                if key != 'cities':
+                    pfields.append(key)
+                    values.append(province[key])
+
+            plans.insert('cn_prov', pfields, values)
+            #printlog (case_count)
+
+            # Now do the same for every city in the province
+            for city in province['cities']:
+                city_en = gazetteer.city_en(city['cityName'])
+                if stats.sample():
+                    LOG.debug('city: %s', city)
+                #print('City:', city.keys(), city)
 
                 # Build up the string of Columns and values depending on what's in the JSON
-                pfields = pfields_base
-                #print('Province:', province.keys(), province)
-                for key in province.keys():
-                    if key != 'cities':
-                        pfields += ', {}'.format(key)
-                        if type(key) is str:
-                            values += ', "{}"'.format(province[key])
-                        else:
-                            values += ', {}'.format(province[key])
-
-                sql_cmd = 'INSERT into [cn_prov] ({}) Values ({})'.format(pfields, values)
-                dbdo.dbdo(dbc, sql_cmd, VERBOSE)
-                #printlog (case_count)
-
-                # Now do the same for every city in the province
-                for city in province['cities']:
-                    city_en = dbdo.value_from_query(dbc, 'select distinct(ADM2_EN) from [places] where ADM2_ZH like \'{}%\';'.format(city['cityName']))
-                    #print('City:', city.keys(), city)
-
-                    # Build up the string of Columns and values depending on what's in the JSON
-                    cfields = cfields_base
-                    values = '{}, "{}", "{}", "{}", "{}"'.format(
-                            int(timestamp), iso_date, province['provinceName'],
-                            province_en, city_en)
-                    for key in city.keys():
-                        cfields += ', {}'.format(key)
-                        if type(city[key]) is str:
-                            values += ', "{}"'.format(city[key])
-                        else:
-                            values += ', {}'.format(city[key])
-
-                    sql_cmd = 'INSERT into [cn_city] ({}) Values ({})'.format(cfields, values)
-                    dbdo.dbdo(dbc, sql_cmd, VERBOSE)
-
-            # Only add to the database on success addition
-            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            dbdo.dbdo(dbc, 'INSERT INTO [files] (Filename, Source, DateProcessed) Values ("{}", "3GDXY", "{}")'.format(filename, now), VERBOSE)
-            dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
+                cfields = list(cfields_base)
+                values = [int(timestamp), iso_date, filename, province['provinceName'],
+                          province_en, city_en]
+                for key in city.keys():
+                    cfields.append(key)
+                    values.append(city[key])
+
+                plans.insert('cn_city', cfields, values)
+
+        # Only add to the database on success addition
+        manifest.record(filename)
+        plans.flush()
+        stats.done()
+        dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
 
+    gazetteer.report()
     return None
 
 def field_types_from_schema(table):
@@ -482,7 +409,7 @@ def field_types_from_schema(table):
         key = line[1].lower()
         value = line[2].lower()
         field_types[key] = value
-    print(field_types)
+    LOG.debug('field_types for %s: %s', table, field_types)
     return field_types
 
 def read_hgis_data():
@@ -497,10 +424,13 @@ def read_hgis_data():
                 D: Dead
     """
     datadir = r'./HGIS_UW_data'
-    already_processed = dbdo.list_from_query(dbc, 'select filename from files;')
     files = os.listdir(datadir)
-    dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
-    for filename in files:
+    manifest = Manifest(dbc, plans, 'HGIS', VERBOSE)
+    for filename, status in manifest.files_to_process(datadir, files):
+        dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
+        # Rows loaded before they carried a Filename can't be told apart, so they go too
+        dbdo.dbdo_params(dbc, 'DELETE FROM [hgis_data] WHERE Filename = ? or Filename is NULL',
+                         (filename,), VERBOSE)
         with open('{}/{}'.format(datadir, filename), 'r') as infh:
             lines = list(infh)
 
@@ -508,7 +438,8 @@ def read_hgis_data():
             line = lines.pop(0)
             line_fields = line.rstrip().split(r',')
             norm_fields = normalise_fieldnames(line_fields)
-            print(line_fields, '\n', norm_fields)
+            LOG.debug('%s -> %s', line_fields, norm_fields)
+            stats = FileStats('HGIS', filename, plans)
 
             for line in lines:
                 line_data = line.rstrip().split(r',')
@@ -520,34 +451,174 @@ def read_hgis_data():
                     cases = value.split(r'-')
                     if len(cases)<4:
                         cases = [0, 0, 0, 0]
-                    values = (date, key, ) + tuple(cases)
+                    values = (date, key, ) + tuple(cases) + (filename, )
 
-                    fields = 'date, place, Confirmed, Active, Recovered, Dead'
-                    print(fields, ':', values)
-                    dbdo.dbdo_params(dbc,
-                                     ('INSERT OR IGNORE INTO [hgis_data] ({}) '
-                                      'Values(?, ?, ?, ?, ?, ?)').format(fields),
-                                     (values), VERBOSE)
+                    fields = ['date', 'place', 'Confirmed', 'Active', 'Recovered', 'Dead', 'Filename']
+                    if stats.sample():
+                        LOG.debug('%s: %s', fields, values)
+                    plans.insert('hgis_data', fields, values, 'INSERT OR IGNORE')
 
-    dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
+        manifest.record(filename)
+        plans.flush()
+        stats.done()
+        dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
     return None
 
-def normalise_fieldnames(line_fields):
-    # normalise the fields
-    # Keep the field names consistent
-    normalise_fields ={'Country_Region': 'Country',
-                       'Province_State': 'Province',
-                       'Lat': 'Latitude',
-                       'Long_': 'Longitude',
-                       'Case-Fatality_Ratio': 'Case_Fatality_Ratio'
-                  }
-    norm_fields = []#'admin2']
-    for field in line_fields:
-        if field in normalise_fields.keys():
-            norm_fields.append(normalise_fields[field].lower())
-        else:
-            norm_fields.append(field.lower())
-    return norm_fields
+def parse_jhu_daily_report(datadir, filename, source, field_types):
+    """ Parse and normalise one JHU CSSE daily report into a list of
+        (fields, values) rows ready for insertion.
+        This doesn't touch the database, so it can run in a worker process.
+    """
+    # precompile some regular expressions...
+    patterns = jhu_patterns(source)
+    namedate = patterns['namedate']
+    mdy_date = patterns['mdy_date']
+    ymd_date = patterns['ymd_date']
+    city_state = patterns['city_state']
+    cruise = patterns['cruise']
+    az2 = patterns['az2']
+
+    match = namedate.match(filename)
+    month, day, year = match[1], match[2], match[3]
+    filedate = '{:04d}-{:02d}-{:02d}'.format(int(year), int(month), int(day))
+    stats = FileStats(source, filename)
+    rows = []
+    with CSVReader('{}/{}'.format(datadir, filename)) as reader:
+        # First Line - gives us the fieldnames
+        # The fields can change (23 March 2020), so need to have a more robust way of handling them
+        # This figures out the fields from the first line, and adds extra if necessary
+        LOG.debug('%s -> %s', reader.line_fields, reader.fields)
+
+        for line_dict in reader:
+            show = stats.sample()
+            if show:
+                LOG.debug('line_dict: %s', line_dict)
+
+            # Normalise some of the inputs: Countries
+            line_dict['country'] = normalise_countries(line_dict['country'])
+            if source == 'JHU':
+                if line_dict['country'] == 'China' and line_dict['province'] == 'Hong Kong':
+                        line_dict['country'] = 'Hong Kong'
+                if line_dict['country'] == 'China' and line_dict['province'] == 'Macau':
+                        line_dict['country'] = 'Macau'
+
+            # Earlier in the data, American Provinces were "City, ST": split them into Admin2 and State
+            # We should Fix this to have Proper State names prior to 26 Feb
+            match = city_state.match(line_dict['province'])
+            if match:
+                if show:
+                    LOG.debug('Match:%s; City:%s; State:%s.', match[0], match[1], match[2])
+                admin2 = match[1]
+                admin1 = match[2]
+                # Sometimes there's something like: 'Omaha, NE (From Diamond Princess)' (case from cruise ship)
+                # we shoud add the 'from ...' to the Admin2?  Or maybe to a comment field?
+                from_cruise = cruise.match(admin1)
+                if from_cruise:
+                    #print('match:{}; admin1:{}; admin2:{}.'.format(from_cruise[0], from_cruise[1], from_cruise[2]))
+                    admin1 = from_cruise[1]
+                    admin2 += from_cruise[2]
+                # Test for 'Calgary, Alberta' or test for [A-Z]{2}?
+                is_state = az2.match(admin1)
+                if is_state:
+                    admin1 = admin1_from_abbr(admin1)
+                line_dict['Admin2'] = admin2
+                line_dict['Province'] = admin1
+
+            # Date of last update:
+            # check which form the date is in: There's a MDY format and there's a proper ISO
+            update   = line_dict['last_update']
+            last_update = 'NULL' # So we can catch it if it falls
+             # Trap the null set
+            if update == '':
+                last_update = datetime.datetime(int(year), int(month), int(day), 0, 0, 0)
+            match = mdy_date.match(update)
+            if match:
+                #print(match)
+                year = int(match[3])
+                if year < 100:
+                    year = 2000 + year
+                last_update = datetime.datetime(year, int(match[1]), int(match[2]), int(match[4]), int(match[5]), 0)
+            else:
+                match = ymd_date.match(update)
+                if match:
+                    # The US reports carry seconds, the global ones are truncated to the minute
+                    seconds = int(match[6]) if source == 'JHU_US' else 0
+                    last_update = datetime.datetime(int(match[1]), int(match[2]), int(match[3]), int(match[4]), int(match[5]), seconds)
+            if last_update == 'NULL':
+                LOG.error('BARF! %s in %s', update, filename)
+                exit()
+            timestamp = last_update.strftime('%Y%m%d%H%M%S')
+
+            # if there's empty fields, set them to an appropriate null value base on the type
+            # (columns we haven't seen before are left as they are)
+            for key in line_dict.keys():
+                if line_dict[key] == '':
+                    if field_types.get(key) == 'integer':
+                        line_dict[key] = 0
+                    if field_types.get(key) == 'real':
+                        line_dict[key] = 0.0
+                    if field_types.get(key) == 'text':
+                        line_dict[key] =''
+
+            #build up the values list
+            fields = ['timestamp', 'date', 'filename']
+            values = [int(timestamp), filedate, filename]
+            for key in line_dict.keys():
+                fields.append(key)
+                values.append(line_dict[key])
+
+            if show:
+                LOG.debug('update %s -> %s; values: %s', update, last_update, values)
+            rows.append((fields, values))
+
+    stats.done()
+    return rows
+
+def parsed_jhu_reports(datadir, to_process, source, field_types):
+    """ Yield (filename, status, rows) for each daily report, in the order given.
+        With WORKERS > 1 the files are parsed in a process pool, but still come
+        back in order so the writer sees exactly what the serial path would.
+        With ENGINE=pandas the rows for each file are a DataFrame.
+    """
+    filenames = [filename for filename, status in to_process]
+    parser = parse_jhu_daily_report
+    if ENGINE == 'pandas':
+        parser = ncor_jhu_frames.parse_jhu_daily_frame
+    if WORKERS > 1:
+        LOG.info('Parsing %d files with %d workers', len(filenames), WORKERS)
+        # the workers log at the same level and sampling as we do
+        with concurrent.futures.ProcessPoolExecutor(max_workers = WORKERS,
+                                                    initializer = ncor_log.setup,
+                                                    initargs = (ncor_log.level_name(), ncor_log.SAMPLE)) as pool:
+            batches = pool.map(parser,
+                               itertools.repeat(datadir), filenames,
+                               itertools.repeat(source), itertools.repeat(field_types))
+            for (filename, status), rows in zip(to_process, batches):
+                yield filename, status, rows
+    else:
+        for filename, status in to_process:
+            yield filename, status, parser(datadir, filename, source, field_types)
+
+def write_jhu_rows(table_name, manifest, filename, status, rows):
+    """ Commit one file's rows and its [files] entry in a single transaction.
+        If the file has changed since it was last loaded, its old rows are replaced.
+    """
+    dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
+    if status == 'changed':
+        dbdo.dbdo_params(dbc, 'DELETE FROM [{}] WHERE Filename = ?'.format(table_name), (filename,), VERBOSE)
+    if ENGINE == 'pandas':
+        # the whole file in one executemany()
+        fields, values, sample = ncor_jhu_frames.frame_rows(rows)
+        plans.insert_rows(table_name, fields, values, sample)
+    else:
+        for fields, values in rows:
+            plans.insert(table_name, fields, values)
+    # Only add to the database on success addition
+    manifest.record(filename)
+    ncor_summaries.mark_pending(dbc, table_name, filename, VERBOSE)
+    plans.flush()
+    dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
+    return None
 
 def read_jhu_us_data():
     """ Read in the US specific data from JHU - this has Testing and Hospitalization
@@ -558,152 +629,17 @@ def read_jhu_us_data():
     source = 'JHU_US'
     table_name = 'jhu_us_data'
 
-    already_processed = dbdo.list_from_query(dbc, 'select filename from files where source = \'{}\';'.format(source))
     files = os.listdir(datadir)
     #print(files)
 
-    print('Reading JHU CSSE US data')
-    # precompile some regular expressions...
+    LOG.info('Reading JHU CSSE US data')
     namedate = re.compile(r'^([0-9]{2})-([0-9]{2})-([0-9]{4}).csv$')
-    mdy_date = re.compile(r'^([0-9]+)/([0-9]+)/([0-9]{2,4}) ([0-9]+):([0-9]+)$')
-    ymd_date = re.compile(r'^([0-9]{4})-([0-9]{2})-([0-9]{2})[T ]([0-9]{2}):([0-9]{2}):([0-9]{2})$')
-    city_state = re.compile(r'^(.*?)\#\s*(.*)') # split '"Tempe# AZ", a, b, c' with 'Tempe_AZ, a, b, c'
-    # replaces '""Alleghany, North Carolina, US", a, b, c' with 'Alleghany.North.Carolina.US, a, b, c'
-    fixcckey = re.compile(r'"([A-Za-z. ]+?)#\s*([A-Za-z. ]+?)#\s*([A-Za-z. ]+?)"')
-    fixprov  = re.compile(r'([A-Za-z]+)/([A-Za-z]+)')
-    fixspcs  = re.compile(r'(\s+)')
-    cruise = re.compile(r'^([A-Z][A-Z])\s+(\(.*\))$')
-    az2 = re.compile(r'^([A-Z][A-Z])$')
-
-
     field_types = field_types_from_schema(table_name)
+    manifest = Manifest(dbc, plans, source, VERBOSE)
+    to_process = manifest.files_to_process(datadir, [filename for filename in files if namedate.match(filename)])
 
-    for filename in files:
-        match = namedate.match(filename)
-
-        if match and (filename not in already_processed):
-            dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
-            month, day, year = match[1], match[2], match[3]
-            filedate = '{:04d}-{:02d}-{:02d}'.format(int(year), int(month), int(day))
-            print(filedate, filename)
-            with open('{}/{}'.format(datadir, filename), mode='r', encoding='utf-8-sig') as infile:
-                lines=list(infile)
-                # First Line - gives us the fieldnames
-                line = fixprov.sub(r'\1', lines.pop(0))
-                line = fixspcs.sub(r'_', line.rstrip())
-                # The fields can change (23 March 2020), so need to have a more robust way of handling them
-                # This figures out the fields from the first line, and adds extra if necessary
-                line_fields = line.rstrip().split(r',')
-                norm_fields = normalise_fieldnames(line_fields)
-                print(line_fields, '\n', norm_fields)
-
-                for line in lines:
-                    print('line1:{}'.format(line))
-                    # remove commas between double quotes - replace with #
-                    line = re.sub(',(?=[^"]*"[^"]*(?:"[^"]*"[^"]*)*$)', '#', line)
-                    line = re.sub('"', '', line).rstrip()
-                    print('line2:{}'.format(line))
-
-                    # Put all of the fields into a dict
-                    line_data = line.split(',')
-                    line_dict = {}
-                    for key, value in zip(norm_fields, line_data):
-                        line_dict[key] = value
-                    print('line_dict:{}'.format(line_dict))
-
-                    # Normalise some of the inputs: Countries
-                    line_dict['country'] = normalise_countries(line_dict['country'])
-
-                    # Earlier in the data, American Provinces were "City, ST": swap out the commas with underscores
-                    # We should Fix this to have Proper State names prior to 26 Feb
-                    match = city_state.match(line_dict['province'])
-                    if match:
-                        print('Match:{}; City:{}; State:{}.'.format(match[0], match[1], match[2]))
-                        admin2 = match[1]
-                        admin1 = match[2]
-                        # Sometimes there's something like: 'Omaha, NE (From Diamond Princess)' (case from cruise ship)
-                        # we shoud add the 'from ...' to the Admin2?  Or maybe to a comment field?
-                        from_cruise = cruise.match(admin1)
-                        if from_cruise:
-                            #print('match:{}; admin1:{}; admin2:{}.'.format(from_cruise[0], from_cruise[1], from_cruise[2]))
-                            admin1 = from_cruise[1]
-                            admin2 += from_cruise[2]
-                        # Test for 'Calgary, Alberta' or test for [A-Z]{2}?
-                        print(admin1, admin2)
-                        is_state = az2.match(admin1)
-                        if is_state:
-                            admin1 = admin1_from_abbr(admin1)
-                        line_dict['Admin2'] = admin2
-                        line_dict['Province'] = admin1
-
-                    if 'Combined_Key' in line_dict.keys():
-                        # The Combined Keys are "County, State, USA": swap out the commas with underscores
-                        line_dict['Combined_Key'] = fixcckey.sub(r'\1_\2_\3', line_dict['Combined_Key'])
-
-                    # Date of last update:
-                    # check which form the date is in: There's a MDY format and there's a proper ISO
-                    update   = line_dict['last_update']
-                    last_update = 'NULL' # So we can catch it if it falls
-                    # Trap the null set
-                    if update == '':
-                        last_update = datetime.datetime(int(year), int(month), int(day), 0, 0, 0)
-
-                    match = mdy_date.match(update)
-                    if match:
-                        #print(match)
-                        year = int(match[3])
-                        if year < 100:
-                            year = 2000 + year
-                        last_update = datetime.datetime(year, int(match[1]), int(match[2]), int(match[4]), int(match[5]), 0)
-                    else:
-                        match = ymd_date.match(update)
-                        if match:
-                            print(match)
-                            last_update = datetime.datetime(int(match[1]), int(match[2]), int(match[3]), int(match[4]), int(match[5]), int(match[6]))
-                    timestamp = last_update.strftime('%Y%m%d%H%M%S')
-                    if last_update == 'NULL':
-                        print('BARF!', update)
-                        exit()
-
-                    # if there's empty fields, set them to an appropriate null value base on the type
-                    for key in line_dict.keys():
-                        if line_dict[key] == '':
-                            if field_types[key] == 'integer':
-                                line_dict[key] = 0
-                            if field_types[key] == 'real':
-                                line_dict[key] = 0.0
-                            if field_types[key] == 'text':
-                                line_dict[key] =''
-
-                    #build up the values list
-                    fields = ['timestamp', 'date']
-                    values = [timestamp, '"{}"'.format(filedate)]
-                    print('line_dict', line_dict)
-                    for key in line_dict.keys():
-                        fields.append(key)
-                        if key in ['Lat, Long_']:
-                            line_dict[key] = float(line_dict[key])
-
-                        if type(line_dict[key]) == str:
-                            values.append('"{}"'.format(line_dict[key]))
-                        else:
-                            values.append('{}'.format(line_dict[key]))
-
-                    print('fields, values', fields, values)
-                    # FIXME: Parameterise this
-                    dbdo.dbdo(dbc, 'insert into [{T}] ({F}) Values ({V});'.
-                         format(T = table_name,
-                                F = ','.join(fields),
-                                V = ','.join(values)), VERBOSE)
-                    #exit()
-            # Only add to the database on success addition
-            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            # FIXME Parameterise this
-            dbdo.dbdo(dbc,
-                      ('INSERT INTO [files] (Filename, Source, DateProcessed) '
-                       'Values ("{F}", "{S}", "{N}")'.format(F = filename, S = source, N = now)),
-                      VERBOSE)
-            dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
+    for filename, status, rows in parsed_jhu_reports(datadir, to_process, source, field_types):
+        write_jhu_rows(table_name, manifest, filename, status, rows)
 
     return len(files)
 
@@ -711,158 +647,36 @@ def read_jhu_data():
     datadir = r'./JHU_data/COVID-19/csse_covid_19_data/csse_covid_19_daily_reports'
     source = 'JHU'
     table_name = 'jhu_data'
-    already_processed = dbdo.list_from_query(dbc, 'select filename from files;')
     files = os.listdir(datadir)
     #print(files)
 
-    print('Reading () CSSE data'.format(source))
-    # precompile some regular expressions...
+    LOG.info('Reading %s CSSE data', source)
     namedate = re.compile(r'^([0-9]{2})-([0-9]{2})-([0-9]{4}).csv$')
-    mdy_date = re.compile(r'^([0-9]+)/([0-9]+)/([0-9]{2,4}) ([0-9]+):([0-9]+)')
-    ymd_date = re.compile(r'^([0-9]{4})-([0-9]{2})-([0-9]{2})[T ]+([0-9]{2}):([0-9]{2})')
-    city_state = re.compile(r'^(.*?)\#\s*(.*)') # split '"Tempe# AZ", a, b, c' with 'Tempe_AZ, a, b, c'
-    # replaces '""Alleghany, North Carolina, US", a, b, c' with 'Alleghany.North.Carolina.US, a, b, c'
-    fixcckey = re.compile(r'"([A-Za-z. ]+?)#\s*([A-Za-z. ]+?)#\s*([A-Za-z. ]+?)"')
-    fixprov  = re.compile(r'([A-Za-z]+)/([A-Za-z]+)')
-    fixspcs  = re.compile(r'(\s+)')
-    cruise = re.compile(r'^([A-Z][A-Z])\s+(\(.*\))$')
-    az2 = re.compile(r'^([A-Z][A-Z])$')
     field_types = field_types_from_schema(table_name)
+    manifest = Manifest(dbc, plans, source, VERBOSE)
+    to_process = manifest.files_to_process(datadir, [filename for filename in files if namedate.match(filename)])
+
+    for filename, status, rows in parsed_jhu_reports(datadir, to_process, source, field_types):
+        write_jhu_rows(table_name, manifest, filename, status, rows)
 
-    for filename in files:
-        match = namedate.match(filename)
+    return len(files)
 
-        if match and (filename not in already_processed):
+def add_source_file_keys():
+    """ Databases made before the manifest have no Filename on the data rows.
+        Add the column and fill it in from the Date or Timestamp, which is how
+        the rows were named on the way in, so a changed file can be replaced.
+    """
+    jhu_name = "substr(Date, 6, 2) || '-' || substr(Date, 9, 2) || '-' || substr(Date, 1, 4) || '.csv'"
+    dxy_name = "substr(Timestamp, 1, 8) || '_' || substr(Timestamp, 9, 6) || '_getAreaStat.json'"
+    filenames = {'jhu_data': jhu_name, 'jhu_us_data': jhu_name,
+                 'cn_prov': dxy_name, 'cn_city': dxy_name}
+    for table, filename in filenames.items():
+        if plans.add_missing_columns(table, ['Filename'], ['']):
             dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
-            month, day, year = match[1], match[2], match[3]
-            filedate = '{:04d}-{:02d}-{:02d}'.format(int(year), int(month), int(day))
-            print(filedate, filename)
-            with open('{}/{}'.format(datadir, filename), mode='r', encoding='utf-8-sig') as infile:
-                lines=list(infile)
-                # First Line - gives us the fieldnames
-                line = fixprov.sub(r'\1', lines.pop(0))
-                line = fixspcs.sub(r'_', line.rstrip())
-                # The fields can change (23 March 2020), so need to have a more robust way of handling them
-                # This figures out the fields from the first line, and adds extra if necessary
-                line_fields = line.rstrip().split(r',')
-                # normalise the fields
-                norm_fields = normalise_fieldnames(line_fields)
-                print(line_fields, '\n', norm_fields)
-
-                for line in lines:
-                    print('line1:{}'.format(line))
-                    # remove commas between double quotes - replace with #
-                    line = re.sub(',(?=[^"]*"[^"]*(?:"[^"]*"[^"]*)*$)', '#', line)
-                    line = re.sub('"', '', line).rstrip()
-                    print('line2:{}'.format(line))
-
-                    # Put all of the fields into a dict
-                    line_data = line.split(',')
-                    line_dict = {}
-                    for key, value in zip(norm_fields, line_data):
-                        line_dict[key] = value
-
-                    print('line_dict:{}'.format(line_dict))
-                    print('field_types:{}'.format(field_types))
-
-                    # Normalise some of the inputs: Countries
-                    line_dict['country'] = normalise_countries(line_dict['country'])
-                    if line_dict['country'] == 'China' and line_dict['province'] == 'Hong Kong':
-                            line_dict['country'] = 'Hong Kong'
-                    if line_dict['country'] == 'China' and line_dict['province'] == 'Macau':
-                            line_dict['country'] = 'Macau'
-
-                    # Earlier in the data, American Provinces were "City, ST": swap out the commas with underscores
-                    # We should Fix this to have Proper State names prior to 26 Feb
-                    match = city_state.match(line_dict['province'])
-                    if match:
-                        print('Match:{}; City:{}; State:{}.'.format(match[0], match[1], match[2]))
-                        admin2 = match[1]
-                        admin1 = match[2]
-                        # Sometimes there's something like: 'Omaha, NE (From Diamond Princess)' (case from cruise ship)
-                        # we shoud add the 'from ...' to the Admin2?  Or maybe to a comment field?
-                        from_cruise = cruise.match(admin1)
-                        if from_cruise:
-                            #print('match:{}; admin1:{}; admin2:{}.'.format(from_cruise[0], from_cruise[1], from_cruise[2]))
-                            admin1 = from_cruise[1]
-                            admin2 += from_cruise[2]
-                        # Test for 'Calgary, Alberta' or test for [A-Z]{2}?
-                        print(admin1, admin2)
-                        is_state = az2.match(admin1)
-                        if is_state:
-                            admin1 = admin1_from_abbr(admin1)
-                        line_dict['Admin2'] = admin2
-                        line_dict['Province'] = admin1
-
-                    if 'Combined_Key' in line_dict.keys():
-                        # The Combined Keys are "County, State, USA": swap out the commas with underscores
-                        line_dict['Combined_Key'] = fixcckey.sub(r'\1_\2_\3', line_dict['Combined_Key'])
-
-                    # Date of last update:
-                    # check which form the date is in: There's a MDY format and there's a proper ISO
-                    update   = line_dict['last_update']
-                    print('update', update)
-                    last_update = 'NULL' # So we can catch it if it falls
-                     # Trap the null set
-                    if update == '':
-                        last_update = datetime.datetime(int(year), int(month), int(day), 0, 0, 0)
-                    match = mdy_date.match(update)
-                    if match:
-                        #print(match)
-                        year = int(match[3])
-                        if year < 100:
-                            year = 2000 + year
-                        last_update = datetime.datetime(year, int(match[1]), int(match[2]), int(match[4]), int(match[5]), 0)
-                        print('mdy last update:', last_update)
-                    else:
-                        match = ymd_date.match(update)
-                        if match:
-                            print(match)
-                            last_update = datetime.datetime(int(match[1]), int(match[2]), int(match[3]), int(match[4]), int(match[5]), 0)
-                            print('ymd last update:', last_update)
-                    timestamp = last_update.strftime('%Y%m%d%H%M%S')
-                    if last_update == 'NULL':
-                        print('BARF!', update)
-                        exit()
-
-                    # if there's empty fields, set them to an appropriate null value base on the type
-                    for key in line_dict.keys():
-                        if line_dict[key] == '':
-                            if field_types[key] == 'integer':
-                                line_dict[key] = 0
-                            if field_types[key] == 'real':
-                                line_dict[key] = 0.0
-                            if field_types[key] == 'text':
-                                line_dict[key] =''
-
-                    #build up the values list
-                    fields = ['timestamp', 'date']
-                    values = [timestamp, '"{}"'.format(filedate)]
-                    print('line_dict', line_dict)
-                    for key in line_dict.keys():
-                        fields.append(key)
-                        if key in ['Lat, Long_']:
-                            line_dict[key] = float(line_dict[key])
-
-                        if type(line_dict[key]) == str:
-                            values.append('"{}"'.format(line_dict[key]))
-                        else:
-                            values.append('{}'.format(line_dict[key]))
-
-                    print('fields, values', fields, values)
-                    dbdo.dbdo(dbc, 'insert into [jhu_data] ({}) Values ({});'.
-                         format(','.join(fields),
-                                ','.join(values)), VERBOSE)
-                    #exit()
-            # Only add to the database on success addition
-            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            dbdo.dbdo(dbc,
-                      ('INSERT INTO [files] (Filename, Source, DateProcessed) '
-                       'Values ("{F}", "{S}", "{N}")'.format(F = filename, S = source, N = now)),
-                      VERBOSE)
+            dbdo.dbdo(dbc, 'UPDATE [{}] SET Filename = {} WHERE Filename is NULL'.format(table, filename), VERBOSE)
             dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
-
-    return len(files)
+    plans.add_missing_columns('hgis_data', ['Filename'], [''])
+    return None
 
 def safe_list_for_tablenames(given_list):
     """ Given a list of table names, make sure they're safe for use
@@ -880,136 +694,132 @@ def safe_list_for_tablenames(given_list):
 
     return safe_list
 
+def rollup_base(name, countries = None):
+    """ The base rows for a rollup of a group of countries (all of them by default)
+        by date, e.g. World, or a WHO region or continent given its list of
+        countries. Returns a function of since giving (sql, params) for
+        SummaryMarks.update().
+        This is one aggregation over [jhu_data]: per country and date first, so a
+        country only counts on a date when its total confirmed is > 0 (as it
+        does in its own summary), then per date.
+    """
+    where = ''
+    if countries is not None:
+        where = 'and country in ({})'.format(', '.join(['?'] * len(countries)))
+    def base_for(since):
+        sql = ('SELECT \'rollup\' as Level, ? as Country, \'\' as Province, '
+               ' dates.date || CASE WHEN count(c.country) > 0 THEN \' 17:00\' ELSE \'\' END as Date, '
+               ' coalesce(sum(c.Confirmed), 0) as Confirmed, coalesce(sum(c.Deaths), 0) as Deaths, '
+               ' coalesce(sum(c.Recovered), 0) as Recovered, coalesce(sum(c.Active), 0) as Active, '
+               ' NULL as Tested, NULL as Hospitalized '
+               ' FROM (SELECT distinct(date) as date from [jhu_data] where date >= ?) as dates '
+               ' LEFT JOIN (SELECT date, country, sum(Confirmed) as Confirmed, sum(Deaths) as Deaths, '
+               '   sum(Recovered) as Recovered, sum(Active) as Active '
+               # a straight scan and sort beats walking the Date index here
+               '   FROM [jhu_data] NOT INDEXED where date >= ? {W} group by date, country) as c '
+               ' on c.date = dates.date and c.Confirmed > 0 '
+               ' group by dates.date').format(W = where)
+        return sql, [name, since, since] + list(countries or [])
+    return base_for
+
+def make_rollup_table(marks, name, countries = None):
+    """ Bring a rollup of countries (see rollup_base()) up to date """
+    columns = ['Date', 'Confirmed', 'Deaths', 'Recovered', 'Active']
+    marks.update('rollup', [(name, name, '')], columns, rollup_base(name, countries))
+    return None
+
+def jhu_base(level):
+    """ The base rows of every country's, or every province's, summary by date.
+        Provinces are only summarised for the countries that have more than one.
+        Returns a function of since, and optionally a list of countries to
+        limit it to, giving (sql, params) for SummaryMarks.update() and compute().
+    """
+    if level == 'country':
+        province = '\'\''
+        where = ''
+        group = 'country, date'
+    else:
+        province = 'province'
+        where = ('and province > "" and country in ('
+                 '  SELECT country from [jhu_data] where province > "" '
+                 '  group by country having count(distinct(province)) > 1)')
+        group = 'country, province, date'
+    def base_for(since, countries = None):
+        # all of it is quicker to scan than to look up, but not a few countries of it
+        indexed = 'NOT INDEXED' if since == '' and countries is None else ''
+        only = ''
+        if countries is not None:
+            only = 'and country in ({})'.format(', '.join(['?'] * len(countries)))
+        sql = ('SELECT ? as Level, country as Country, {P} as Province, date || \' 17:00\' AS Date, '
+               ' sum(Confirmed) as Confirmed, sum(Deaths) as Deaths, '
+               ' sum(Recovered) as Recovered, sum(Active) as Active, '
+               ' sum(People_tested) as Tested, sum(People_hospitalized) as Hospitalized '
+               ' FROM [jhu_data] {I} where date >= ? {W} {O} group by {G}'
+              ).format(P = province, I = indexed, W = where, O = only, G = group)
+        return sql, [level, since] + list(countries or [])
+    return base_for
+
+def county_base():
+    """ The base rows of every US county's summary by date, in one pass over
+        [jhu_data] grouped by (FIPS, date), with the FIPS code zero-padded
+        as the Province. Returns a function of since giving (sql, params)
+        for SummaryMarks.update().
+    """
+    def base_for(since):
+        indexed = 'NOT INDEXED' if since == '' else ''
+        sql = ('SELECT ? as Level, country as Country, printf(\'%05d\', FIPS) as Province, '
+               ' date || \' 17:00\' AS Date, '
+               ' sum(Confirmed) as Confirmed, sum(Deaths) as Deaths, '
+               ' sum(Recovered) as Recovered, sum(Active) as Active, '
+               ' sum(People_tested) as Tested, sum(People_hospitalized) as Hospitalized '
+               ' FROM [jhu_data] {I} where date >= ? and country = \'USA\' and FIPS > 0 '
+               ' group by FIPS, date').format(I = indexed)
+        return sql, ['county', since]
+    return base_for
+
 def make_summary_tables():
     """
-        Make Tables from JHU data of:
+        Make summaries from JHU data of:
             1. All confirmed, deaths, recovered by date
             2. Each Country by Date (sum up provinces)
+            2a. Each US county by Date, by FIPS code
             3. Each WHO Region by date TODO
+        They all go in [summaries], with a view for each (see ncor_summaries),
+        and only the dates loaded since the last run are recomputed.
     """
-    print('Make Summary Tables')
-    tablespec = ('Date Text, '
-                 'Confirmed Integer, '
-                 'Deaths Integer, '
-                 'Recovered Integer, '
-                 'Active Integer')
-    countries = dbdo.list_from_query(dbc, 'select distinct(country) from [jhu_data];')
-    rounding = 4
-    for country in countries:
-        dbdo.dbdo(dbc, "BEGIN", VERBOSE)
-        dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [{}]'.format(country), VERBOSE)
-        dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [{}.temp]'.format(country), VERBOSE)
-        #dbdo(dbc, 'CREATE TABLE [{}] ({})'.format(country, tablespec), VERBOSE)
-        provinces = dbdo.list_from_query(dbc, 'select distinct(province) from [jhu_data] where country = \"{}\" and province > ""'.format(country))
-        # some provinces have an apostrophe (') As this is used for the table name,
-        # we must escape it manually
-        provinces = safe_list_for_tablenames(provinces)
-
-
-        # Make a Table of all the provinces
-        country_dates = {}
-        dbdo.dbdo(dbc,
-             ('CREATE TABLE [{C}.temp] AS '
-              '  SELECT distinct(date) || \' 17:00\' AS Date, '
-              '   sum(Confirmed) as Confirmed, sum(Deaths) as Deaths, '
-              '   sum(Recovered) as Recovered, sum(Active) as Active, '
-              '   sum(People_tested) as Tested, sum(People_hospitalized) as Hospitalized '
-              '  FROM [jhu_data] where country = \'{C}\' group by date order by date'
-             ).format(C=country), VERBOSE)
-        dbdo.dbdo(dbc,
-             ('CREATE TABLE [{C}] AS '
-              '   SELECT Date, Confirmed, Deaths, Recovered, Active, Tested, Hospitalized, '
-              '   ROUND(CAST(Deaths as REAL) / Confirmed, {R}) as CFR, '
-              '   ROUND(CAST(Recovered as REAL) / Confirmed, {R}) as CRR, '
-              '   ROUND(Cast(Confirmed as REAL)/(LAG (Confirmed, 1, 0) OVER (order by date))-1, {R}) as C1day, '
-              '   ROUND(Cast(Deaths    as REAL)/(LAG (Deaths,    1, 0) OVER (order by date))-1, {R}) as D1day, '
-              '   ROUND(Cast(Recovered as REAL)/(LAG (Recovered, 1, 0) OVER (order by date))-1, {R}) as R1day, '
-              '   ROUND(CAGR(Confirmed, LAG (Confirmed, 7, 0) OVER (order by date), 7), {R}) as C7day, '
-              '   ROUND(CAGR(Deaths,    LAG (Deaths,    7, 0) OVER (order by date), 7), {R}) as D7day, '
-              '   ROUND(CAGR(Recovered, LAG (Recovered, 7, 0) OVER (order by date), 7), {R}) as R7day '
-              '  FROM [{C}.temp] order by date').format(C=country, R = rounding), VERBOSE)
-        dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [{}.temp]'.format(country), VERBOSE)
-        # Make a Table of all the provinces, if there's more than one.
-        if len(provinces) > 1:
-            print( country, provinces)
-            #exit()
-            for province in provinces:
-                if "'" in province:
-                    print('Exiting:', province, provinces)
-                    exit()
-
-                dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [{}.{}]'.format(country, province), VERBOSE)
-                dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [{}.{}.temp]'.format(country, province), VERBOSE)
-                # Create the Provincial Tables (also need to split the ISO date into Date and Time)
-                dbdo.dbdo(dbc,
-                    ('CREATE TABLE [{C}.{P}.temp] AS '
-                    '  SELECT distinct(date) || \' 17:00\' AS Date, '
-                    '   sum(Confirmed) as Confirmed, sum(Deaths) as Deaths, '
-                    '   sum(Recovered) as Recovered, sum(Active) as Active, '
-                    '   sum(People_tested) as Tested, sum(People_hospitalized) as Hospitalized '
-                    '  FROM [jhu_data] where country = \'{C}\' and province = \'{P}\' group by date order by date'
-                    ).format(C=country, P=province, R = rounding), VERBOSE)
-                dbdo.dbdo(dbc,
-                    ('CREATE TABLE [{C}.{P}] AS '
-                    '   SELECT Date, Confirmed, Deaths, Recovered, Active, Tested, Hospitalized, '
-                    '   ROUND(CAST(Deaths as REAL) / Confirmed, {R}) as CFR, '
-                    '   ROUND(CAST(Recovered as REAL) / Confirmed, {R}) as CRR, '
-                    '   ROUND(Cast(Confirmed as REAL)/(LAG (Confirmed, 1, 0) OVER (order by date))-1, {R}) as C1day, '
-                    '   ROUND(Cast(Deaths    as REAL)/(LAG (Deaths,    1, 0) OVER (order by date))-1, {R}) as D1day, '
-                    '   ROUND(Cast(Recovered as REAL)/(LAG (Recovered, 1, 0) OVER (order by date))-1, {R}) as R1day, '
-                    '   ROUND(CAGR(Confirmed, LAG (Confirmed, 7, 0) OVER (order by date), 7), {R}) as C7day, '
-                    '   ROUND(CAGR(Deaths,    LAG (Deaths,    7, 0) OVER (order by date), 7), {R}) as D7day, '
-                    '   ROUND(CAGR(Recovered, LAG (Recovered, 7, 0) OVER (order by date), 7), {R}) as R7day '
-                    '  FROM [{C}.{P}.temp] order by date').format(C=country, P=province, R = rounding), VERBOSE)
-                dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [{}.{}.temp]'.format(country, province), VERBOSE)
+    LOG.info('Make Summary Tables')
+    marks = ncor_summaries.SummaryMarks(dbc, 'jhu_data', VERBOSE, LAGS, METRICS, WORKERS)
+    if marks.up_to_date(['World', 'USA counties']):
+        LOG.info('Summary tables are up to date to %s', marks.latest)
+        return None
 
-        dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
+    columns = ['Date', 'Confirmed', 'Deaths', 'Recovered', 'Active', 'Tested', 'Hospitalized']
+    countries = dbdo.list_from_query(dbc, 'select distinct(country) from [jhu_data];')
+    provinces = dbdo.rows_from_query(dbc, ('select country, province from [jhu_data] where province > "" '
+                                           'group by country, province order by country, province'))
+    # Only the countries with more than one province get them summarised
+    counts = {}
+    for country, province in provinces:
+        counts[country] = counts.get(country, 0) + 1
+    provinces = [(country, province) for country, province in provinces if counts[country] > 1]
+    # some provinces have an apostrophe (') or the like: clean them up for the view names
+    names = safe_list_for_tablenames([province for country, province in provinces])
+    LOG.debug('%d countries, %d provinces', len(countries), len(provinces))
+    levels = [('country', [(country, country, '') for country in countries], jhu_base('country')),
+              ('province', [('{}.{}'.format(country, name), country, province)
+                            for (country, province), name in zip(provinces, names)], jhu_base('province')),
+              ('county', [('USA counties', 'USA', None)], county_base())]
+    # With WORKERS > 1, the countries and provinces are worked out in parallel first
+    marks.compute(levels)
 
-    # Make the master Table of all Countries
-    dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [World]', VERBOSE)
-    dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [World.temp]', VERBOSE)
     dbdo.dbdo(dbc, 'BEGIN', VERBOSE)
-    dbdo.dbdo(dbc, 'CREATE TABLE [World.temp] ({})'.format(tablespec), VERBOSE)
-    dates = dbdo.list_from_query(dbc, 'select distinct(Date) from [jhu_data] order by date')
-    for date in dates:
-        world = [0, 0, 0, 0]
-        for country in countries:
-            row = dbdo.row_from_query(
-                dbc,
-                ('select date, Confirmed, Deaths, Recovered, Active from [{}] '
-                    'where date like \'{}%\' and confirmed > 0').format(country, date))
-            if row is not None:
-                date = row[0]
-                for idx in range(1,len(row)):
-                    #print(idx)
-                    if row[idx] is not None:
-                        world[idx-1] += row[idx]
-
-        world_str = ', '.join(['{}'.format(w) for w in world])
-
-        #print(country, world, world_str)
-        dbdo.dbdo(dbc,
-                  ('INSERT into [World.temp] '
-                   '(Date, confirmed, deaths, Recovered, Active) '
-                   'Values (\'{}\', {})'.format(date, world_str)),
-                  VERBOSE)
-    dbdo.dbdo(dbc,
-         ('CREATE TABLE [World] AS '
-          '   SELECT Date, Confirmed, Deaths, Recovered, Active, '
-          '   ROUND(CAST(Deaths as REAL) / Confirmed, {R}) as CFR, '
-          '   ROUND(CAST(Recovered as REAL) / Confirmed, {R}) as CRR, '
-          '   ROUND(Cast(Confirmed as REAL)/(LAG (Confirmed, 1, 0) OVER (order by date))-1, {R}) as C1day, '
-          '   ROUND(Cast(Deaths    as REAL)/(LAG (Deaths,    1, 0) OVER (order by date))-1, {R}) as D1day, '
-          '   ROUND(Cast(Recovered as REAL)/(LAG (Recovered, 1, 0) OVER (order by date))-1, {R}) as R1day, '
-          '   ROUND(CAGR(Confirmed, LAG (Confirmed, 7, 0) OVER (order by date), 7), {R}) as C7day, '
-          '   ROUND(CAGR(Deaths,    LAG (Deaths,    7, 0) OVER (order by date), 7), {R}) as D7day, '
-          '   ROUND(CAGR(Recovered, LAG (Recovered, 7, 0) OVER (order by date), 7), {R}) as R7day '
-          '  FROM [World.temp] order by date').format(R = rounding),
-         VERBOSE)
-    dbdo.dbdo(dbc, 'DROP TABLE IF EXISTS [World.temp]', VERBOSE)
-
+    for level, series, base_for in levels:
+        # the counties' view has them all, so it needs their FIPS codes
+        marks.update(level, series, (['Province as FIPS'] if level == 'county' else []) + columns, base_for)
+    # Make the master Table of all Countries
+    make_rollup_table(marks, 'World')
+    marks.done()
     dbdo.dbdo(dbc, 'COMMIT', VERBOSE)
-
     return None
 
 def main():
@@ -1017,6 +827,10 @@ def main():
     """
     Go through the download dir and collect all of the various data sources:
     """
+    if EXPLAIN:
+        ncor_indexes.explain(dbc)
+        return None
+
     if (FIRSTRUN):
         make_tables()
         read_hksarg_pr()
@@ -1027,11 +841,23 @@ def main():
 
 
     if (UPDATE or FIRSTRUN):
+        add_source_file_keys()
+        ncor_summaries.add_missing_tables(dbc, VERBOSE)
+        ncor_watermark.add_missing_tables(dbc, VERBOSE)
         read_3g_dxy_cn_json()
         read_jhu_data()
         read_jhu_us_data()
         read_hgis_data()
-        make_summary_tables()
+        # what the summaries and plots check to see if there's anything new
+        changed = ncor_watermark.record_ingest(dbc, VERBOSE)
+        ncor_indexes.make_indexes(dbc, VERBOSE, changed)
+        settings = ncor_summaries.settings(LAGS)
+        if FORCE or not ncor_watermark.up_to_date(dbc, 'summaries', settings):
+            version = ncor_watermark.stage_version(dbc, settings)
+            make_summary_tables()
+            ncor_watermark.record(dbc, 'summaries', version, VERBOSE)
+        else:
+            LOG.info('Nothing new since the summaries were made: FORCE to make them anyway')
 
     if CLEANUP:
         dbdo.delete_named_tables(dbc, '%.0', VERBOSE)
@@ -1047,6 +873,14 @@ if __name__ == '__main__':
     FIRSTRUN = 0
     CLEANUP = 1
     UPDATE = 1 # Otherwise this does nothing!
+    WORKERS = 1 # Processes used to parse the JHU reports and work out the summaries, e.g. WORKERS=16
+    LOGLEVEL = 'info' # LOGLEVEL=debug shows the rows as they're read
+    SAMPLE = 1 # At debug level, only show 1 row in SAMPLE, e.g. SAMPLE=1000
+    EXPLAIN = 0 # Just print the query plans for the pipeline's queries
+    FORCE = 0 # Make the summaries even if nothing new has been loaded (also --force)
+    ENGINE = 'rows' # How to parse the JHU reports: 'rows', or 'pandas' for the DataFrame reader
+    METRICS = 'numpy' # How to work out the summary metrics: 'numpy', or 'sql' for window SQL and CAGR()
+    LAGS = [7] # The CAGR intervals in the summaries, e.g. LAGS=3,14,28 adds those to the 7 day one
 
     DATADIR = '01_download_data'
     for arg in sys.argv:
@@ -1058,10 +892,32 @@ if __name__ == '__main__':
             UPDATE = 1 - UPDATE
         if arg == 'CLEANUP':
             CLEANUP = 1 - CLEANUP
-
-    db_connect = sqlite3.connect('ncorv2019.sqlite')
-    db_connect.create_function('CAGR', 3, cagr)
+        if arg == 'EXPLAIN':
+            EXPLAIN = 1
+        if arg in ('FORCE', '--force'):
+            FORCE = 1
+        if arg.startswith('WORKERS='):
+            WORKERS = max(1, int(arg.split('=')[1]))
+        if arg.startswith('ENGINE='):
+            ENGINE = arg.split('=')[1].lower()
+        if arg.startswith('METRICS='):
+            METRICS = arg.split('=')[1].lower()
+        if arg.startswith('LAGS='):
+            LAGS = sorted(set([7] + [int(lag) for lag in arg.split('=')[1].split(',')]))
+        if arg.startswith('LOGLEVEL='):
+            LOGLEVEL = arg.split('=')[1]
+        if arg.startswith('SAMPLE='):
+            SAMPLE = int(arg.split('=')[1])
+
+    ncor_log.setup(LOGLEVEL, SAMPLE)
+    if ENGINE == 'pandas' and ncor_jhu_frames is None:
+        LOG.error('ENGINE=pandas needs pandas installed')
+        sys.exit(1)
+
+    # FIRSTRUN builds everything from scratch, so it can skip the fsyncs
+    db_connect = ncor_db.connect('ncorv2019.sqlite', 'bulk-load' if FIRSTRUN else 'default')
     dbc = db_connect.cursor()
+    plans = InsertPlans(dbc, VERBOSE)
 
     main()
 
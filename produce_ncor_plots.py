@@ -8,19 +8,33 @@ dave o'brien (c) 2020
 CC: BY-SA
 """
 import sys
-# import os
 # import re
-import sqlite3
-# import json
+import os
+import json
+import time
+import hashlib
+import itertools
 import datetime
 import math
+import concurrent.futures
 sys.path.append('/home/odaiwai/src/dob_DBHelper')
 import db_helper as dbdo    # This is a library of my own database routines
                             # - it just wraps sqlite commands into handier
                             # methods I like to use.
+from ncor_gazetteer import Gazetteer
+import ncor_log
+from ncor_log import LOG
+import ncor_db
+import ncor_watermark
+from ncor_summaries import days_column, new_column, THRESHOLDS
+from ncor_matrix import SummaryMatrix
+from ncor_populations import PopulationIndex
+from ncor_ranking import CountryRanking
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import matplotlib.dates as mdates # for date formatting
+from matplotlib.collections import LineCollection
 
 def make_plot(title, dates, confirmed, dead, cured):
     axis_range = [datetime.datetime(2020,1,29), datetime.datetime.now()]
@@ -45,13 +59,14 @@ def make_plots_from_dxy():
     china_total_cure = {}
     china_total_dead = {}
     chinadates = []
+    gazetteer = Gazetteer(dbc)
     for province in provinces:
-        province_en = dbdo.value_from_query(dbc, 'select distinct(ADM1_EN) from china_places where ADM1_ZH like \'{}%\';'.format(province))
+        province_en = gazetteer.province_en(province)
         print(province, province_en)
 
-        confirmed = dbdo.dict_from_query(dbc, 'select iso_date, confirmedCount from [cn_prov] where provinceName like \'{}\' order by timestamp;'.format(province))
-        dead = dbdo.dict_from_query(dbc, 'select iso_date, deadCount from [cn_prov] where provinceName like \'{}\' order by timestamp;'.format(province))
-        cured = dbdo.dict_from_query(dbc, 'select iso_date, curedCount from [cn_prov] where provinceName like \'{}\' order by timestamp;'.format(province))
+        confirmed = dbdo.dict_from_query(dbc, 'select iso_date, confirmedCount from [cn_prov] where provinceName = \'{}\' order by timestamp;'.format(province))
+        dead = dbdo.dict_from_query(dbc, 'select iso_date, deadCount from [cn_prov] where provinceName = \'{}\' order by timestamp;'.format(province))
+        cured = dbdo.dict_from_query(dbc, 'select iso_date, curedCount from [cn_prov] where provinceName = \'{}\' order by timestamp;'.format(province))
         dates = []
 
         #add each province to the China total
@@ -75,19 +90,20 @@ def make_plots_from_dxy():
     #print (type(chinadates), chinadates)
 
     make_plot('GreaterChina', chinadates, china_total_conf, china_total_dead, china_total_cure)
+    gazetteer.report()
     return 0
 
-def list_of_countries_by_confirmed(final_date_str):
-    countries = dbdo.list_from_query(dbc, 'select distinct(country) from [jhu_data] where date like \'{}%\' and confirmed > 1;'.format(final_date_str))
-    country_count = {}
-    for country in countries:
-        country_count[country] = dbdo.value_from_query(dbc, 'SELECT max(confirmed) from [{}]'.format(country))
-    # Create a list of tuples sorted by index 1 i.e. value field
-    country_tuples = sorted(country_count.items() , reverse=True, key=lambda x: x[1])
-    # Iterate over the sorted sequence
-    countries_by_confirmed = []
-    for elem in country_tuples :
-        countries_by_confirmed.append(elem[0])
+def country_ranking():
+    global RANKING
+    if RANKING is None:
+        RANKING = CountryRanking(dbc)
+    return RANKING
+
+def list_of_countries_by_confirmed(final_date_str, key = 'confirmed'):
+    # The countries on the day, biggest first, then World
+    populations = population_index() if key.endswith('_per_million') else None
+    ranking = country_ranking().ranked(final_date_str, key, populations)
+    countries_by_confirmed = [country for country, value in ranking]
     countries_by_confirmed.append('World')
     return countries_by_confirmed
 
@@ -99,6 +115,47 @@ def keys_values_as_lists_from_dict(dict):
         values.append(dict[key])
     return keys, values
 
+# The summary columns any of the plots use: the graphs' are the 7 day new
+# cases and the days since the thresholds
+MATRIX_COLUMNS = (['Confirmed', 'Deaths', 'Recovered', 'Active', 'CFR', 'C7Day', 'D7Day']
+                  + [new_column(column, 7) for column in THRESHOLDS]
+                  + [days_column(column) for column in THRESHOLDS])
+# Every country's summaries, loaded the first time summary_matrix() is called
+MATRIX = None
+# and their populations, the first time population_index() is
+POPULATIONS = None
+# and their ranking, the first time country_ranking() is
+RANKING = None
+
+def forget_cached():
+    """ Drop the summaries, populations and ranking, for when the data's changed """
+    global MATRIX, POPULATIONS, RANKING
+    MATRIX = None
+    POPULATIONS = None
+    RANKING = None
+    return None
+
+def summary_matrix():
+    global MATRIX
+    if MATRIX is None:
+        MATRIX = SummaryMatrix(dbc, MATRIX_COLUMNS)
+    return MATRIX
+
+def country_series(country, columns, above = None):
+    """ A country's columns from the summary matrix, as NumPy arrays by column:
+        'Date' as datetime64, the rest as floats, with NaN for NULL. With above
+        = (column, limit) just the days where column >= limit.
+    """
+    return summary_matrix().series(country, columns, above)
+
+def graph_days_cases(series, graph, days = None):
+    """ The days (or the days column given) and values of graph from series, where
+        its column is at or over its limit and the value isn't NULL
+    """
+    values = series[value_column(graph)]
+    found = (series[graph['column']] >= graph['limit']) & ~np.isnan(values)
+    return series[days or days_column(graph['column'])][found], values[found]
+
 def graph_definitions():
     graphs = []
     # Contains a list of the parameters for each graph
@@ -114,15 +171,21 @@ def graph_definitions():
 
     return graphs
 
+def value_column(graph):
+    """ The summary column a graph plots: the cases, or the new cases per day over
+        its lag, which is NULL if any of the days in it are
+    """
+    if graph['lag'] > 0:
+        return new_column(graph['column'], graph['lag'])
+    return graph['column']
+
 def graph_definitions_as_dict():
     graphs = []
     graph_uuid = 0
     # TODO: add per population graph_definitions_as_dict
     for column in 'Confirmed Recovered Deaths Active'.split():
-        if column == 'Deaths':
-            limit = 1
-        else:
-            limit = 10
+        # the summaries count the days since these (DaysC10, DaysD1...)
+        limit = THRESHOLDS[column]
 
         for lag in [0, 7]:
             graph = {'uuid': graph_uuid,
@@ -141,46 +204,33 @@ def graph_definitions_as_dict():
                 graph['doubling'] = False
 
             graphs.append(graph)
-            print(graph)
             graph_uuid += 1
 
-    print(graphs)
+    LOG.debug('graphs: %s', graphs)
     return graphs
 
-def list_of_populations_by_country(countries):
-    populations = {}
-    for country in countries:
-        country_alts = {'USA': 'United States',
-                        'Czechia': 'Czech Republic',
-                        #'Ivory Coast': 'Côte%',
-                        'Congo (Kinshasa)': 'Congo',
-                        'Cabo Verde': 'Cape Verde',
-                        'Hong Kong': 'Hong Kong (China)',
-                        'Macau': 'Macau (China)',
-                        'Sao Tome and Principe': 'São Tomé and Príncipe',
-                        'Congo (Brazzaville)': 'DR Congo',
-                        'Burma': 'Myanmar',
-                        'Timor-Leste': 'East Timor',
-                        'Diamond Princess': 'Vatican City', # Stand-in
-                        'MS Zaandam': 'Vatican City', # Stand-in
-                        #'Palestine': 'State of Palestine',
-                        #'Kosovo': ''
-                       }
-        pop_country = country
-        if country in country_alts.keys():
-            pop_country = country_alts[country]
-        population = dbdo.value_from_query(dbc,
-                                           ('SELECT population from [wiki_populations] '
-                                            'where country like \'{}\''.format(pop_country)))
-        if population == 'Null':
-            print('{} No Population!'.format(country))
-            population = 1
-        populations[country] = population
-    return populations
-
-def make_days_since_start_plot():
+def population_index():
+    global POPULATIONS
+    if POPULATIONS is None:
+        POPULATIONS = PopulationIndex(dbc)
+    return POPULATIONS
+
+def since_start_savefile(graph):
+    """ Where make_days_since_start_plot() saves a graph """
+    savefile = 'plots/{G}'.format(G=graph['column'])
+    if graph['by_pop'] is True:
+        savefile += '_per_million'
+
+    if graph['lag'] > 0:
+        savefile += '_new'
+
+    savefile +='_since_start.png'
+    return savefile
+
+def make_days_since_start_plot(only = None):
     #Make the rate of increase since N cases plot
     # with all the countries
+    # only: just the graphs with these file names, e.g. ['plots/Deaths_new_since_start.png']
     GRAPH_DAYS = True
     GRAPH_DATES = False
 
@@ -220,15 +270,18 @@ def make_days_since_start_plot():
     for by_pop in (True, False):
         for graph in graph_definitions_as_dict():
             graph['by_pop'] = by_pop
-            graphs.append(graph)
-
-    print(graphs)
+            if only is None or since_start_savefile(graph) in only:
+                graphs.append(graph)
 
     ANNOTATE_ALL = False
-    populations = list_of_populations_by_country(countries)
+    # populations in millions, but at least 1 - and 1 for the ones without one
+    populations = population_index()
+    pop_divisors = np.fmax(1, populations.vector(countries) / 1000000).tolist()
+    matrix = summary_matrix()
 
     for graph in graphs:
-        print(graph)
+        LOG.debug('graph: %s', graph)
+        start = time.perf_counter()
         fig = plt.figure(figsize=FIGSIZE)
         ax = plt.axes([0.1, 0.15, 0.85, 0.75])
         fig.suptitle('COVID 19 cases for Countries (last data: {})'.format(final_date_str))
@@ -255,54 +308,51 @@ def make_days_since_start_plot():
         ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
         #ax.set(ylim = (graph['limit'], max_cases))
         max_cases = 0
-        for country in countries:
+        # Everything gets the colour it would have from the colour cycle if it
+        # was plotted on its own, but the countries that aren't of interest are
+        # drawn all at once, after the loop: a LineCollection and a scatter
+        colour_cycle = itertools.cycle(plt.rcParams['axes.prop_cycle'].by_key()['color'])
+        background_lines = []
+        background_colours = []
+        # the days since the limit and the new cases per day are in the summaries,
+        # divided by the population/divisor for every country at once
+        aligned = matrix.aligned(countries, graph['column'], graph['limit'], value_column(graph),
+                                 days_column(graph['column']),
+                                 pop_divisors if graph['by_pop'] is True else None)
+        for country, days, cases in aligned:
             zord = 500 - countries.index(country)
-            pop_divisor = max(1,(populations[country] / 1000000))
-
-            if graph['lag'] > 0:
-                cmd = ('SELECT ROW_NUMBER() OVER (PARTITION BY {G} >= {L} order by date) as days, '
-                       'cast({G} - LAG ({G}, {D}, 0) OVER (order by date) as REAL)/{D} as {G} '
-                       'from [{C}] where {G} >= {L} order by Date'.format(C = country, G=graph['column'], L = graph['limit'], D=graph['lag']))
-            else:
-                cmd = ('SELECT ROW_NUMBER() OVER (PARTITION BY {G} >= {L} order by date) as days, '
-                       '{G} from [{C}] where {G} >= {L} order by Date'.format(C = country, G=graph['column'], L = graph['limit']))
-
-            #print(cmd)
-            results = dbdo.dict_from_query(dbc, cmd)
-            days, cases = keys_values_as_lists_from_dict(results)
-            #print(country, population, 'before', days, cases)
-
-            if graph['by_pop'] is True:
-                # Divide the cases by the population/divisor
-                adjusted_cases = []
-                for case in cases:
-                    adjusted_cases.append(case / pop_divisor)
-
-                #print('Adjusted', adjusted_cases)
-                cases = adjusted_cases
-            #print('after', days, cases)
+            pop_divisor = pop_divisors[countries.index(country)]
+            #print(country, pop_divisor, days, cases)
             # Add a marker and optionly an annotation for the last point
             if len(days) > 0:
                 # Keep track of the largest number
-                if max(cases) > max_cases:
-                    max_cases = max(cases)
+                if cases.max() > max_cases:
+                    max_cases = cases.max()
                     print('adjusting max cases to {} because of {} ({})'.format(max_cases, country, pop_divisor))
                     # If it's significant, add it to the list
                     countries_of_interest.append(country)
 
                 if country in countries_of_interest or ANNOTATE_ALL:
-                    ax.plot(days, cases, lw = 2.5, zorder = zord)
+                    ax.plot(days, cases, lw = 2.5, zorder = zord, color = next(colour_cycle))
                     ax.plot([days[-1]], [cases[-1]], marker='o', markersize=6,
-                            zorder = zord)
+                            zorder = zord, color = next(colour_cycle))
                     # Add a label
                     ax.annotate('{}: {:,.0f}'.format(country, cases[-1]),
                                 (days[-1]+1, cases[-1]), fontsize = 8, ha='left',
                                 bbox = box, zorder = zord)
                 else:
-                    #ax.plot(days, cases, color = '#80808080', lw = 1, zorder = zord)
-                    ax.plot(days, cases, lw = 1, zorder = zord)
-                    ax.plot([days[-1]], [cases[-1]], marker='o', markersize=3,
-                            color = '#80808080', zorder = zord)
+                    background_lines.append(np.column_stack([days, cases]))
+                    background_colours.append(next(colour_cycle))
+
+        if len(background_lines) > 0:
+            # Below the countries of interest, with the bigger countries on top
+            zord = 500 - len(countries)
+            ax.add_collection(LineCollection(background_lines[::-1], colors = background_colours[::-1],
+                                             linewidths = 1, zorder = zord,
+                                             capstyle = 'projecting', joinstyle = 'round'))
+            last_points = np.array([line[-1] for line in background_lines[::-1]])
+            ax.scatter(last_points[:, 0], last_points[:, 1], s = 3 ** 2, color = '#80808080',
+                       linewidths = plt.rcParams['lines.markeredgewidth'], zorder = zord)
 
         if graph['doubling']:
             # add dashed lines for 'doubles every (1..7) days
@@ -316,7 +366,8 @@ def make_days_since_start_plot():
                     double.append(double[-1] * (1 + rate))
                     if double[-1] >= axis_limit:
                         break
-                ax.plot(days, double, linestyle = 'dashed', linewidth = 0.5, zorder = 2)
+                ax.plot(days, double, linestyle = 'dashed', linewidth = 0.5, zorder = 2,
+                        color = next(colour_cycle))
                 ax.annotate('doubles in {} days'.format(ddays), (days[-1]+1, double[-1]),
                             fontsize = 8, ha='left', bbox = box, zorder = 2)
 
@@ -324,25 +375,25 @@ def make_days_since_start_plot():
         # Attribution on the canvas
         fig.text(0.5, 0.025, attrib_str, ha = 'center', fontsize = 8, bbox = attrib_box, transform=plt.gcf().transFigure)
         # save it out
-        savefile = 'plots/{G}'.format(G=graph['column'])
-        if graph['by_pop'] is True:
-            savefile += '_per_million'
-
-        if graph['lag'] > 0:
-            savefile += '_new'
-
-        savefile +='_since_start.png'
-        print(savefile)
+        savefile = since_start_savefile(graph)
         fig.savefig(savefile, format = 'png')
         plt.close()
+        LOG.info('%s in %.2fs', savefile, time.perf_counter() - start)
         #exit()
 
     return None
 
-def make_world_gridplots_from_jhu():
+def grid_savefile(graph):
+    """ Where make_world_gridplots_from_jhu() saves a graph """
+    if graph['lag'] > 0:
+        return 'plots/{G}_new_grid_since_start.png'.format(G=graph['column'])
+    return 'plots/{G}_grid_since_start.png'.format(G=graph['column'])
+
+def make_world_gridplots_from_jhu(only = None):
     """
     Make a grid plot (nxn) of the top countries by number of cases
     Each graph should be the rolling average of new confirmed cases over the last N days
+    only: just the graphs with these file names, e.g. ['plots/Deaths_grid_since_start.png']
     """
     start_date_str = dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date ASC  limit 1')
     final_date_str = dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date DESC limit 1')
@@ -352,33 +403,29 @@ def make_world_gridplots_from_jhu():
     countries = list_of_countries_by_confirmed(final_date_str)
     plt.style.use('seaborn-paper')
 
-    graphs = graph_definitions_as_dict()
+    graphs = [graph for graph in graph_definitions_as_dict()
+              if only is None or grid_savefile(graph) in only]
     num_graphx = 9 # Number of graphs in a row
     num_graphy = 6 # Number of graphs in a row
     FIGSIZE = [num_graphx * 1.5, num_graphy * 1.5]
     DAYS = True
 
+    series = {}
     for graph in graphs:
         fig, axes  = plt.subplots(num_graphx, num_graphy, figsize=FIGSIZE)
         fig.suptitle('SARS-CoV2 /COVID-19 in order of total confirmed cases')
         for row in range(0, num_graphx):
             for col in range(0, num_graphy):
                 country = countries[row*num_graphx + col]
+                if country not in series:
+                    series[country] = country_series(country, MATRIX_COLUMNS)
                 if DAYS:
-                    cmd = 'SELECT ROW_NUMBER() OVER (PARTITION BY {G} >= {L} order by date) as days, '.format(G = graph['column'], L = graph['limit'])
-                else:
-                    cmd = 'SELECT date as days, '
-                if graph['lag'] > 0:
-                    cmd += ('cast({G} - LAG ({G}, {D}, 0) OVER (order by date) as REAL)/{D} as {G} '
-                            'from [{C}] where {G} >= {L} order by Date'.format(C = country, G=graph['column'], L = graph['limit'], D=graph['lag']))
+                    days, cases = graph_days_cases(series[country], graph)
                 else:
-                    cmd += ('{G} from [{C}] where {G} >= {L} order by Date'.format(C = country, G=graph['column'], L = graph['limit']))
-                #print(cmd)
-                results = dbdo.dict_from_query(dbc, cmd)
-                days, cases = keys_values_as_lists_from_dict(results)
+                    days, cases = graph_days_cases(series[country], graph, 'Date')
 
                 # Determine the colour
-                max_cases = max(cases)
+                max_cases = cases.max()
                 colour = 'tab:red'
                 if cases[-1] <= 0.75 * max_cases:
                     colour = 'tab:orange'
@@ -398,10 +445,7 @@ def make_world_gridplots_from_jhu():
             ax.label_outer()
 
 
-        if graph['lag'] > 0:
-            fig.savefig('plots/{G}_new_grid_since_start.png'.format(G=graph['column']), format = 'png')
-        else:
-            fig.savefig('plots/{G}_grid_since_start.png'.format(G=graph['column']), format = 'png')
+        fig.savefig(grid_savefile(graph), format = 'png')
         plt.close()
 
     return None
@@ -411,214 +455,438 @@ def make_country_plots_from_jhu():
     Make a plot by Country:
     """
     plt.style.use('seaborn-paper')
-    # styles
-    box = dict(boxstyle = 'square', fc='#ffffff40')
-    attrib_str = r'plot produced by @odaiwai using MatPlotLib, Python and SQLITE3. Data from JHU CSSE. https://www.diaspoir.net/'
-    attrib_box = dict(boxstyle = 'square', fc='#ffffff80', pad = 0.25)
-
     final_date_str = dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date DESC limit 1')
     countries = list_of_countries_by_confirmed(final_date_str)
     for country in countries:
-        date_strs = dbdo.list_from_query(dbc, 'SELECT Date from [{}] order by Date'.format(country))
-        conf = dbdo.list_from_query(dbc, 'SELECT Confirmed from [{}] order by Date'.format(country))
-        sick = dbdo.list_from_query(dbc, 'SELECT (Confirmed-deaths-recovered) from [{}] order by Date'.format(country))
-        dead = dbdo.list_from_query(dbc, 'SELECT deaths from [{}] order by Date'.format(country))
-        cure = dbdo.list_from_query(dbc, 'SELECT Recovered from [{}] order by Date'.format(country))
-        cfr  = dbdo.list_from_query(dbc, 'SELECT CFR from [{}] order by Date'.format(country))
-        c7d  = dbdo.list_from_query(dbc, 'SELECT C7Day from [{}] order by Date'.format(country))
-        d7d  = dbdo.list_from_query(dbc, 'SELECT D7Day from [{}] order by Date'.format(country))
-        d1d  = dbdo.list_from_query(dbc, 'SELECT D1Day from [{}] order by Date'.format(country))
-        print (country, final_date_str, conf[-1], cure[-1], sick[-1], dead[-1], cfr[-1])
-        for index in range(0,len(d1d)):
-            if type(d1d[index]) == None:
-                d1d[index] = 0
-        # Get datetime objects for the dates and the axis_range
-        dates = []
-        for date in date_strs:
-            dates.append(datetime.datetime.strptime(date, '%Y-%m-%d %H:%M'))
-        axis_range = [dates[0], dates[-1]]
-        if axis_range[0] == axis_range[1]:
-            axis_range[0] = axis_range[1] - datetime.timedelta(days = 1)
-
-        # Build the Plot
-        fig = plt.figure(figsize=FIGSIZE)
-        ax = plt.axes([0.1, 0.175, 0.80, 0.725])
-        fig.suptitle('SARS2-CoV / COVID 19 for {}'.format(country))
-
-        # Primary Axis for C/S/D
-        ax.set(title = '{:,.0f} Confirmed Cases (JHU CSSE Data)'.format(conf[-1]),
-               xlabel='Date', xlim = axis_range, ylabel='Reported Cases')
-        ax.format_data = mdates.DateFormatter('%Y-%m-%d')
-        fig.autofmt_xdate()
-        ax.stackplot(dates, cure, sick, dead,
-                     labels=['Recovered', 'Sick', 'Deaths', 'Active'],
-                     colors=['green', 'orange', 'black', 'blue'])
-        ax.legend(loc='upper left')
-
-        # Annotate the final numbers
-        labelx = dates[len(dates)-2]
-        ax.annotate('Recovered {:,.0f}'.format(cure[-1]), (labelx, cure[-1]/2), fontsize = 8, ha='right', bbox = box)
-        ax.annotate('Sick {:,.0f}'.format(sick[-1]), (labelx, cure[-1] + conf[-1]/2 - dead[-1]), fontsize = 8, ha='right', bbox = box)
-        ax.annotate('deaths {:,.0f}'.format(dead[-1]), (labelx, conf[-1] - dead[-1]/2), fontsize = 8, ha='right', bbox = box)
-        ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
-
-        # Secondary Axis for CFR
-        ax2 = ax.twinx()
-        ax2.plot(dates, cfr, label='Case Fatality Rate', color='red')
-        ax2.annotate('CFR {:,.1f}%'.format(cfr[-1]*100), (labelx, cfr[-1]), fontsize = 8, ha='left', bbox = box)
+        make_country_plot(country, final_date_str)
+    return 0
 
-        # Death Rates in aggregate only
-        if country == 'World':
-            ax2.plot(dates, c7d, label='Weekly Growth Rate', linestyle = 'dashed')
-            ax2.annotate('C7D {:,.1f}%'.format(c7d[-1]*100), (labelx, c7d[-1]), fontsize = 8, ha='left', bbox = box)
-            ax2.plot(dates, d7d, label='Weekly Growth Rate (Deaths)', linestyle = 'dashed')
-            ax2.annotate('D7D {:,.1f}%'.format(d7d[-1]*100), (labelx, d7d[-1]), fontsize = 8, ha='left', bbox = box)
+def country_plot_series(country, final_date_str = None):
+    """ What make_country_plot() plots """
+    return country_series(country, ['Confirmed', 'Deaths', 'Recovered', 'CFR', 'C7Day', 'D7Day'])
 
-        ax2.set(ylim=(0.0,0.25), ylabel='Percentage')
-        ax2.yaxis.set_major_formatter(mpl.ticker.PercentFormatter(xmax = 1, decimals = 1, symbol='%'))
-        ax2.legend(loc='lower left')
+def make_country_plot(country, final_date_str, series = None):
+    """ The plot for one country, plots/{country}.png, of series, if it's already
+        been fetched with country_plot_series(). Returns the file name.
+    """
+    # styles
+    box = dict(boxstyle = 'square', fc='#ffffff40')
+    attrib_str = r'plot produced by @odaiwai using MatPlotLib, Python and SQLITE3. Data from JHU CSSE. https://www.diaspoir.net/'
+    attrib_box = dict(boxstyle = 'square', fc='#ffffff80', pad = 0.25)
 
-        # Attribution and save
-        fig.text(0.5, 0.025, attrib_str, ha = 'center', fontsize = 8, bbox = attrib_box, transform=plt.gcf().transFigure)
-        fig.savefig('plots/{}.png'.format(country), format = 'png')
+    if series is None:
+        series = country_plot_series(country)
+    dates = series['Date']
+    conf = series['Confirmed']
+    dead = series['Deaths']
+    cure = series['Recovered']
+    sick = conf - dead - cure
+    cfr  = series['CFR']
+    c7d  = series['C7Day']
+    d7d  = series['D7Day']
+    print (country, final_date_str, conf[-1], cure[-1], sick[-1], dead[-1], cfr[-1])
+    axis_range = [dates[0], dates[-1]]
+    if axis_range[0] == axis_range[1]:
+        axis_range[0] = axis_range[1] - np.timedelta64(1, 'D')
+
+    # Build the Plot
+    fig = plt.figure(figsize=FIGSIZE)
+    ax = plt.axes([0.1, 0.175, 0.80, 0.725])
+    fig.suptitle('SARS2-CoV / COVID 19 for {}'.format(country))
+
+    # Primary Axis for C/S/D
+    ax.set(title = '{:,.0f} Confirmed Cases (JHU CSSE Data)'.format(conf[-1]),
+           xlabel='Date', xlim = axis_range, ylabel='Reported Cases')
+    ax.format_data = mdates.DateFormatter('%Y-%m-%d')
+    fig.autofmt_xdate()
+    ax.stackplot(dates, cure, sick, dead,
+                 labels=['Recovered', 'Sick', 'Deaths', 'Active'],
+                 colors=['green', 'orange', 'black', 'blue'])
+    ax.legend(loc='upper left')
+
+    # Annotate the final numbers
+    labelx = dates[len(dates)-2]
+    ax.annotate('Recovered {:,.0f}'.format(cure[-1]), (labelx, cure[-1]/2), fontsize = 8, ha='right', bbox = box)
+    ax.annotate('Sick {:,.0f}'.format(sick[-1]), (labelx, cure[-1] + conf[-1]/2 - dead[-1]), fontsize = 8, ha='right', bbox = box)
+    ax.annotate('deaths {:,.0f}'.format(dead[-1]), (labelx, conf[-1] - dead[-1]/2), fontsize = 8, ha='right', bbox = box)
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+
+    # Secondary Axis for CFR
+    ax2 = ax.twinx()
+    ax2.plot(dates, cfr, label='Case Fatality Rate', color='red')
+    ax2.annotate('CFR {:,.1f}%'.format(cfr[-1]*100), (labelx, cfr[-1]), fontsize = 8, ha='left', bbox = box)
+
+    # Death Rates in aggregate only
+    if country == 'World':
+        ax2.plot(dates, c7d, label='Weekly Growth Rate', linestyle = 'dashed')
+        ax2.annotate('C7D {:,.1f}%'.format(c7d[-1]*100), (labelx, c7d[-1]), fontsize = 8, ha='left', bbox = box)
+        ax2.plot(dates, d7d, label='Weekly Growth Rate (Deaths)', linestyle = 'dashed')
+        ax2.annotate('D7D {:,.1f}%'.format(d7d[-1]*100), (labelx, d7d[-1]), fontsize = 8, ha='left', bbox = box)
+
+    ax2.set(ylim=(0.0,0.25), ylabel='Percentage')
+    ax2.yaxis.set_major_formatter(mpl.ticker.PercentFormatter(xmax = 1, decimals = 1, symbol='%'))
+    ax2.legend(loc='lower left')
+
+    # Attribution and save
+    fig.text(0.5, 0.025, attrib_str, ha = 'center', fontsize = 8, bbox = attrib_box, transform=plt.gcf().transFigure)
+    fig.savefig('plots/{}.png'.format(country), format = 'png')
+
+    plt.close('all')
+    return 'plots/{}.png'.format(country)
+
+def since_start_settings():
+    """ What the days since start plots by country have in common """
+    # General Parameters
+    settings = {}
+    settings['max_cases'] = dbdo.value_from_query(dbc,'SELECT confirmed from [world] order by Date DESC limit 1')
+    settings['start_date_str'] = dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date ASC limit 1')
+    settings['final_date_str'] = dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date DESC limit 1')
+    start_date = datetime.datetime.strptime(settings['start_date_str'], '%Y-%m-%d')
+    final_date = datetime.datetime.strptime(settings['final_date_str'], '%Y-%m-%d') + datetime.timedelta(days = 7)
+    settings['max_days'] = (final_date - start_date).days
+    settings['axis_range'] = [1, settings['max_days']]
+    #axis_range = [start_date, final_date]
 
-        plt.close('all')
-    return 0
+    # Setup the parameters for each graph
+    settings['graphs'] = graph_definitions_as_dict()
+    settings['colours'] = {'Confirmed': 'orange', 'Deaths': 'black',
+                           'Recovered': 'green', 'Active': 'blue'}
+    return settings
 
 def make_days_since_start_plot_by_country():
     #Make the rate of increase since N cases plot
     # with all the countries
+    plt.style.use('seaborn-paper')
+    settings = since_start_settings()
+    countries = list_of_countries_by_confirmed(settings['final_date_str'])
+    for country in countries:
+        make_days_since_start_plot_for(country, settings)
 
+    return None
+
+def since_start_series(country, settings):
+    """ What make_days_since_start_plot_for() plots: all of the graphs' values
+        since the 10th case
+    """
+    columns = [days_column('Confirmed')] + [value_column(graph) for graph in settings['graphs']]
+    return country_series(country, columns, ('Confirmed', 10))
+
+def make_days_since_start_plot_for(country, settings, series = None):
+    """ The days since start plot for one country, plots/{country}_since_start.png,
+        of series, if it's already been fetched with since_start_series().
+        Returns the file name.
+    """
     # Style and Attributions text
     box = dict(boxstyle = 'round', fc='#ffffffff')
     attrib_str = ('plot inspired by the work of https://twitter.com/jburnmurdoch/\n'
                   'produced by https://github.com/odaiwai using MatPlotLib, Python '
                   'and SQLITE3. Data from JHU CSSE. https://www.diaspoir.net/')
     attrib_box = dict(boxstyle = 'square', fc='#ffffff80', pad = 0.25)
-    plt.style.use('seaborn-paper')
 
-    # General Parameters
-    max_cases = dbdo.value_from_query(dbc,'SELECT confirmed from [world] order by Date DESC limit 1')
-    start_date_str = dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date ASC limit 1')
-    final_date_str = dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date DESC limit 1')
-    start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
-    final_date = datetime.datetime.strptime(final_date_str, '%Y-%m-%d') + datetime.timedelta(days = 7)
-    max_days = (final_date - start_date).days
-    axis_range = [1, max_days]
-    #axis_range = [start_date, final_date]
-    countries = list_of_countries_by_confirmed(final_date_str)
-    countries_of_interest = ['Hong Kong', 'Singapore', 'China', 'Italy', 'South Korea',
-                             'USA', 'Germany', 'United Kingdom', 'Ireland', 'France',
-                             'Poland', 'Japan', 'Spain', 'Taiwan', 'Vietnam',
-                             'Thailand', 'Australia', 'Malaysia', 'Macau', 'World',
-                             'Philippines', 'Turkey', 'Iran', 'Switzerland']
+    max_cases = settings['max_cases']
+    start_date_str = settings['start_date_str']
+    final_date_str = settings['final_date_str']
+    max_days = settings['max_days']
+    axis_range = settings['axis_range']
+    graphs = settings['graphs']
+    colours = settings['colours']
+
+    print(country, start_date_str, '->', final_date_str)
+    fig = plt.figure(figsize=FIGSIZE)
+    ax = plt.axes([0.1, 0.15, 0.85, 0.75])
+
+    suptitle = 'COVID 19 Cases in {}'.format(country)
+    fig.suptitle(suptitle)
+    ax.set(title = '{}: cases since Reporting started to {}'.format(country, final_date_str))
+    ax.set(xlabel='Days since reporting Started', xlim = axis_range, ylabel='Cases')
+    fig.autofmt_xdate()
+    # configure the Y-Axis
+    ax.set_yscale('log', base = 2) # basey deprecated
+    ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
+    #max_cases = 0
+    zord = 10 #
+    if series is None:
+        series = since_start_series(country, settings)
+    for graph in graphs:
+        col = colours[graph['column']]
+        found = ~np.isnan(series[value_column(graph)])
+        if found.any():
+            # we want to have dates in here...
+            first_date = np.datetime_as_string(series['Date'][found][0]).replace('T', ' ')
+            days = series[days_column('Confirmed')][found]
+            cases = series[value_column(graph)][found]
 
-    # Setup the parameters for each graph
-    FACTOR = 0.00001
-    #
+            #print (graph, '\n\t', first_date, '\n\t', days, '\n\t', cases)
+            # Add a marker and optionly an annotation for the last point
+            label = '{} cases since no. {} ({})'.format(graph['column'], graph['limit'], first_date)
+            style = 'solid'
+            if graph['lag'] > 0:
+                label = '{} new cases per day (over {} day) since no. {} ({})'.format(graph['column'], graph['lag'], graph['limit'], first_date)
+                style = 'dashed'
 
-    graphs = graph_definitions_as_dict()
-    colours = {'Confirmed': 'orange', 'Deaths': 'black',
-               'Recovered': 'green', 'Active': 'blue'}
+            final_note = '{:,.0f}'.format(cases[-1])
+            if graph['lag'] > 0:
+                final_note = '{:,.0f} per day'.format(cases[-1])
+            max_cases = max(max_cases, cases[-1])
+            ax.plot(days[graph['lag']:], cases[graph['lag']:], lw=2.5,
+                    zorder=zord, color=col, linestyle=style, label=label)
+            ax.plot([days[-1]], [cases[-1]], marker='o', markersize=6,
+                    zorder=zord)
+            # Add a label
+            ax.annotate(final_note, (days[-1], cases[-1]),
+                        fontsize=8, ha='left', bbox=box, zorder=zord)
+
+    if graph['doubling']:
+        # add dashed lines for 'doubles every (1..7) days
+        ax.set(ylim=(1, max_cases))
+        axis_limit = 2 ** int(math.log2(max_cases)-1)
+        for ddays in [1, 2, 3, 4, 5, 7, 14]:
+            rate = ((2/1) ** (1/ddays))-1
+            days = [0]
+            double = [1]
+            for day in range(0, max_days):
+                days.append(day)
+                double.append(double[-1] * (1 + rate))
+                if double[-1] >= axis_limit:
+                    break
+            ax.plot(days, double, linestyle = 'dashed', linewidth = 0.5, zorder = 2)
+            ax.annotate('doubles in {} days'.format(ddays),
+                        (days[-1]+1, double[-1]),
+                        fontsize = 8, ha='left', bbox = box, zorder = 2)
+
+    # Attribution on the canvas
+    ax.legend()
+    fig.text(0.5, 0.025, attrib_str, ha = 'center', fontsize = 8, bbox = attrib_box, transform=plt.gcf().transFigure)
+    # save it out
+    fig.savefig('plots/{C}_since_start.png'.format(C=country), format = 'png')
+    plt.close()
+    return 'plots/{C}_since_start.png'.format(C=country)
 
-    for country in countries:
-        print(country, start_date_str, '->', final_date_str)
-        fig = plt.figure(figsize=FIGSIZE)
-        ax = plt.axes([0.1, 0.15, 0.85, 0.75])
+# The seconds each plot takes is about a fixed part plus a part for each row
+# of the country's series, from the timings of a run (200 countries, 1100 days)
+PLOT_COSTS = {'make_country_plot': (0.17, 0.0001),
+              'make_days_since_start_plot_for': (0.21, 0.0001)}
 
-        suptitle = 'COVID 19 Cases in {}'.format(country)
-        fig.suptitle(suptitle)
-        ax.set(title = '{}: cases since Reporting started to {}'.format(country, final_date_str))
-        ax.set(xlabel='Days since reporting Started', xlim = axis_range, ylabel='Cases')
-        fig.autofmt_xdate()
-        # configure the Y-Axis
-        ax.set_yscale('log', base = 2) # basey deprecated
-        ax.yaxis.set_major_formatter(mpl.ticker.StrMethodFormatter('{x:,.0f}'))
-        #max_cases = 0
-        zord = 10 #
-        for graph in graphs:
-            col = colours[graph['column']]
-            # we want to have dates in here...
-            if graph['lag'] > 0:
-                cmd = ('SELECT Date, ROW_NUMBER() OVER '
-                       '(PARTITION BY Confirmed >= 10 order by date) as days, '
-                       'cast({G} - LAG ({G}, {D}, 0) OVER (order by date) as REAL)/{D} as {G} '
-                       'from [{C}] where Confirmed >= 10 order by Date'
-                       .format(C = country, G=graph['column'], L = graph['limit'], D=graph['lag']))
-            else:
-                cmd = ('SELECT Date, ROW_NUMBER() OVER '
-                       '(PARTITION BY Confirmed >= 10 order by date) as days, '
-                       '{G} from [{C}] where Confirmed >= 10 order by Date'
-                       .format(C = country, G=graph['column'], L = graph['limit']))
-            results = dbdo.rows_from_query(dbc, cmd) # 3 x n
-
-            if len(results) > 0:
-                dates = []
-                days = []
-                cases = []
-                for result in results:
-                    dates.append(result[0])
-                    days.append(result[1])
-                    cases.append(result[2])
-
-                #print (graph, results)
-                #print (graph, '\n\t', dates, '\n\t', days, '\n\t', cases)
-                # Add a marker and optionly an annotation for the last point
-                label = '{} cases since no. {} ({})'.format(graph['column'], graph['limit'], dates[0])
-                style = 'solid'
-                if graph['lag'] > 0:
-                    label = '{} new cases per day (over {} day) since no. {} ({})'.format(graph['column'], graph['lag'], graph['limit'], dates[0])
-                    style = 'dashed'
-
-                final_note = '{:,.0f}'.format(cases[-1])
-                if graph['lag'] > 0:
-                    final_note = '{:,.0f} per day'.format(cases[-1])
-                max_cases = max(max_cases, cases[-1])
-                ax.plot(days[graph['lag']:], cases[graph['lag']:], lw=2.5,
-                        zorder=zord, color=col, linestyle=style, label=label)
-                ax.plot([days[-1]], [cases[-1]], marker='o', markersize=6,
-                        zorder=zord)
-                # Add a label
-                ax.annotate(final_note, (days[-1], cases[-1]),
-                            fontsize=8, ha='left', bbox=box, zorder=zord)
+def start_worker(filename, figsize, level):
+    """ Set up a pool worker: logging, the Agg backend, the style, and its own
+        read-only connection as the dbc the plots use
+    """
+    global dbc, FIGSIZE
+    ncor_log.setup(level)
+    plt.switch_backend('agg')
+    plt.style.use('seaborn-paper')
+    FIGSIZE = figsize
+    dbc = ncor_db.connect(filename, 'read-mostly').cursor()
+    return None
 
-        if graph['doubling']:
-            # add dashed lines for 'doubles every (1..7) days
-            ax.set(ylim=(1, max_cases))
-            axis_limit = 2 ** int(math.log2(max_cases)-1)
-            for ddays in [1, 2, 3, 4, 5, 7, 14]:
-                rate = ((2/1) ** (1/ddays))-1
-                days = [0]
-                double = [1]
-                for day in range(0, max_days):
-                    days.append(day)
-                    double.append(double[-1] * (1 + rate))
-                    if double[-1] >= axis_limit:
-                        break
-                ax.plot(days, double, linestyle = 'dashed', linewidth = 0.5, zorder = 2)
-                ax.annotate('doubles in {} days'.format(ddays),
-                            (days[-1]+1, double[-1]),
-                            fontsize = 8, ha='left', bbox = box, zorder = 2)
+def render(plot, country, settings, series):
+    """ Make one figure, and say how long it took """
+    start = time.perf_counter()
+    savefile = plot(country, settings, series)
+    return savefile, time.perf_counter() - start
 
-        # Attribution on the canvas
-        ax.legend()
-        fig.text(0.5, 0.025, attrib_str, ha = 'center', fontsize = 8, bbox = attrib_box, transform=plt.gcf().transFigure)
-        # save it out
-        fig.savefig('plots/{C}_since_start.png'.format(C=country), format = 'png')
-        plt.close()
+# Change this when the plotting code changes, so every plot is made again
+RENDERER_VERSION = 1
+# The fingerprint of the inputs of each plot, the last time it was made
+FINGERPRINTS = 'plots/fingerprints.json'
 
+def plot_fingerprint(plot, country, settings, series):
+    """ A hash of everything a plot is made from: the plot, the country, its
+        settings (with the graph definitions), its series, FIGSIZE and RENDERER_VERSION
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps([RENDERER_VERSION, plot.__name__, country, settings, FIGSIZE],
+                          sort_keys = True, default = str).encode())
+    for column in sorted(series.keys()):
+        sha.update(column.encode())
+        sha.update(series[column].tobytes())
+    return sha.hexdigest()
+
+def read_fingerprints():
+    if not os.path.exists(FINGERPRINTS):
+        return {}
+    with open(FINGERPRINTS) as infh:
+        return json.load(infh)
+
+def write_fingerprints(fingerprints):
+    with open(FINGERPRINTS + '.new', 'w') as outfh:
+        json.dump(fingerprints, outfh, indent = 1, sort_keys = True)
+    os.replace(FINGERPRINTS + '.new', FINGERPRINTS)
     return None
 
+def render_country_plots(workers = 1, force = 0):
+    """
+    Make the plots of each country (make_country_plot() and
+    make_days_since_start_plot_for()), the slowest first, in a pool of workers
+    with WORKERS > 1. Each figure is made on its own, so they're the same as
+    they are made one after the other.
+
+    A plot whose inputs have the same fingerprint as the last time it was made
+    (in FINGERPRINTS) isn't made again, if its file is still there, unless force.
+    """
+    plt.style.use('seaborn-paper')
+    settings = since_start_settings()
+    final_date_str = settings['final_date_str']
+    countries = list_of_countries_by_confirmed(final_date_str)
+    plots = [(make_days_since_start_plot_for, since_start_series, 'plots/{}_since_start.png', settings),
+             (make_country_plot, country_plot_series, 'plots/{}.png', final_date_str)]
+    fingerprints = read_fingerprints()
+    jobs = []
+    skipped = []
+    made = {}
+    for country in countries:
+        for plot, fetch, savefile, plot_settings in plots:
+            savefile = savefile.format(country)
+            series = fetch(country, plot_settings)
+            fingerprint = plot_fingerprint(plot, country, plot_settings, series)
+            if not force and fingerprints.get(savefile) == fingerprint and os.path.exists(savefile):
+                skipped.append(savefile)
+                continue
+            made[savefile] = fingerprint
+            jobs.append((plot, country, plot_settings, series))
+
+    def cost(job):
+        fixed, per_row = PLOT_COSTS[job[0].__name__]
+        return fixed + per_row * len(job[3]['Date'])
+    jobs.sort(key = cost, reverse = True)
+
+    start = time.perf_counter()
+    timings = []
+    try:
+        if workers < 2 or len(jobs) < 2:
+            for plot, country, plot_settings, series in jobs:
+                timings.append(render(plot, country, plot_settings, series))
+                LOG.info('%s in %.2fs', *timings[-1])
+        else:
+            filename = dbdo.row_from_query(dbc, 'PRAGMA database_list')[2]
+            LOG.info('Making %d plots with %d workers', len(jobs), workers)
+            with concurrent.futures.ProcessPoolExecutor(max_workers = workers,
+                                                        initializer = start_worker,
+                                                        initargs = (filename, FIGSIZE, ncor_log.level_name())) as pool:
+                futures = [pool.submit(render, plot, country, plot_settings, series)
+                           for plot, country, plot_settings, series in jobs]
+                for future in concurrent.futures.as_completed(futures):
+                    timings.append(future.result())
+                    LOG.info('%s in %.2fs', *timings[-1])
+    finally:
+        # keep the fingerprints of the plots that were made, even if one failed
+        fingerprints.update([(savefile, made[savefile]) for savefile, seconds in timings])
+        write_fingerprints(fingerprints)
+
+    elapsed = time.perf_counter() - start
+    if len(timings) > 0:
+        LOG.info('%d country plots in %.1fs with %d workers (%.1fs of plotting, the slowest %s in %.2fs)',
+                 len(timings), elapsed, workers, sum([seconds for savefile, seconds in timings]),
+                 *max(timings, key = lambda timing: timing[1]))
+    if len(skipped) > 0:
+        LOG.info('%d country plots unchanged since they were made: %s', len(skipped), ', '.join(skipped))
+    return timings
+
+def matrix_series(countries, columns):
+    """ The rows of countries in the summary matrix for columns, with the dates:
+        what the charts of all of the countries are made from, for their fingerprints
+    """
+    matrix = summary_matrix()
+    rows = matrix.rows(countries)
+    series = {'Date': matrix.dates, 'rows': rows}
+    for column in columns:
+        series[column] = matrix.values[column.lower()][rows]
+    return series
+
+def chart_jobs():
+    """ The charts of all of the countries, one for each file, as (plot, savefile,
+        countries, settings, series): the since start charts of
+        make_days_since_start_plot() and the grids of make_world_gridplots_from_jhu()
+    """
+    dates = {'start_date_str': dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date ASC limit 1'),
+             'final_date_str': dbdo.value_from_query(dbc, 'SELECT Date from [jhu_data] order by Date DESC limit 1')}
+    countries = list_of_countries_by_confirmed(dates['final_date_str'])
+    jobs = []
+    for by_pop in (True, False):
+        for graph in graph_definitions_as_dict():
+            graph['by_pop'] = by_pop
+            columns = [graph['column'], value_column(graph), days_column(graph['column'])]
+            series = matrix_series(countries[:-1], columns)
+            if by_pop:
+                series['Population'] = population_index().vector(countries[:-1])
+            jobs.append((make_days_since_start_plot, since_start_savefile(graph), countries[:-1],
+                         dict(dates, graph = graph), series))
+    for graph in graph_definitions_as_dict():
+        columns = [graph['column'], value_column(graph), days_column(graph['column'])]
+        # every country a 9 x 9 grid could have in it
+        jobs.append((make_world_gridplots_from_jhu, grid_savefile(graph), countries[:81],
+                     dict(dates, graph = graph), matrix_series(countries[:81], columns)))
+    return jobs
+
+def stale_charts(force = 0):
+    """
+    The charts of all of the countries that need making, as {plot: {savefile:
+    fingerprint}}: all of them if force, or else the ones whose inputs have a
+    different fingerprint from the last time they were made (in FINGERPRINTS),
+    or whose file has gone
+    """
+    fingerprints = read_fingerprints()
+    stale = {}
+    skipped = []
+    for plot, savefile, countries, settings, series in chart_jobs():
+        fingerprint = plot_fingerprint(plot, countries, settings, series)
+        if not force and fingerprints.get(savefile) == fingerprint and os.path.exists(savefile):
+            skipped.append(savefile)
+        else:
+            stale.setdefault(plot, {})[savefile] = fingerprint
+    if len(skipped) > 0:
+        LOG.info('%d charts unchanged since they were made: %s', len(skipped), ', '.join(skipped))
+    return stale
+
+def render_charts(plot, charts):
+    """
+    Make charts ({savefile: fingerprint}, from stale_charts()) with one call of
+    plot, and record their fingerprints once it has made them all
+    """
+    if len(charts) == 0:
+        return 0
+    start = time.perf_counter()
+    plot(list(charts))
+    seconds = time.perf_counter() - start
+    # the country plots record theirs in between
+    fingerprints = read_fingerprints()
+    fingerprints.update(charts)
+    write_fingerprints(fingerprints)
+    LOG.info('%d charts from %s() in %.1fs', len(charts), plot.__name__, seconds)
+    return seconds
+
 def main():
     # main body
     """
     Go through the download dir and collect all of the various data sources:
     """
+    # The plots are drawn from the summaries: nothing to do if they haven't been
+    # made again since the plots were last made, or have never been made
+    version = ncor_watermark.stage_version(dbc, source = 'summaries')
+    if not FORCE and version is None:
+        LOG.info('The summaries have never been recorded as made: FORCE to make the plots anyway')
+        return 0
+    if not FORCE and ncor_watermark.up_to_date(dbc, 'plots', source = 'summaries'):
+        LOG.info('Nothing new since the plots were made: FORCE to make them anyway')
+        return 0
+
     #make_plots_from_dxy()
-    make_days_since_start_plot()
-    make_days_since_start_plot_by_country()
-    make_country_plots_from_jhu()
-    make_world_gridplots_from_jhu()
+    # make_days_since_start_plot()
+    stale = stale_charts(FORCE)
+    render_charts(make_days_since_start_plot, stale.get(make_days_since_start_plot, {}))
+    # make_days_since_start_plot_by_country() and make_country_plots_from_jhu()
+    render_country_plots(WORKERS, FORCE)
+    # make_world_gridplots_from_jhu()
+    render_charts(make_world_gridplots_from_jhu, stale.get(make_world_gridplots_from_jhu, {}))
+    # the countries that had no population, once for all the plots
+    if POPULATIONS is not None:
+        POPULATIONS.report()
+
+    if version is not None:
+        # this connection is read-only
+        writer = ncor_db.connect(DBFILE)
+        ncor_watermark.record(writer.cursor(), 'plots', version, VERBOSE)
+        writer.close()
 
     # TODO
     # Assign a Region to Countries, also a consistent colour, and flag emoji?
@@ -631,13 +899,21 @@ if __name__ == '__main__':
     VERBOSE = 0
     PLOTS = 1
     MINCASES = 8
+    FORCE = 0 # Make the plots even if nothing new has been loaded (also --force)
+    WORKERS = 1 # Processes used to make the plots of each country, e.g. WORKERS=8
 
     DATADIR = '01_download_data'
     for arg in sys.argv:
         if arg == 'VERBOSE':
             VERBOSE = 1
-
-    db_connect = sqlite3.connect('ncorv2019.sqlite')
+        if arg in ('FORCE', '--force'):
+            FORCE = 1
+        if arg.startswith('WORKERS='):
+            WORKERS = max(1, int(arg.split('=')[1]))
+
+    ncor_log.setup()
+    DBFILE = 'ncorv2019.sqlite'
+    db_connect = ncor_db.connect(DBFILE, 'read-mostly')
     dbc = db_connect.cursor()
 
     main()
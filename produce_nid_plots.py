@@ -3,21 +3,15 @@
    historic database."""
 
 import matplotlib.pyplot as plt
-from pandas.plotting import register_matplotlib_converters
-register_matplotlib_converters()
-import pandas as pd
-import numpy as np
-import sqlite3
 import datetime
 import re
-# Future versions of pandas will require you to explicitly register matplotlib converters.
-from pandas.plotting import register_matplotlib_converters
-register_matplotlib_converters()
 
 # my DB Helper
 import sys
 sys.path.append('/home/odaiwai/src/dob_DBHelper')
 import db_helper as dbdo
+import ncor_log
+import ncor_db
 
 
 def make_table_of_disease_by_month():
@@ -115,26 +109,11 @@ def hk_population():
     #print (monthly_pop)
 
     return monthly_pop
-# Constants
-
-
-# The Main Loop
-if __name__ == '__main__':
-    db_connect = sqlite3.connect('notifiable_infections_diseases.sqlite')
-    dbc = db_connect.cursor()
-    FIRSTRUN = 0
-
-    # Check if the table disease_by_month exists
-    check = dbdo.list_from_query(
-        dbc, 'select name from sqlite_master where name like \'disease_by_month\';')
-    if (FIRSTRUN is True) or (len(check) == 0):
-        make_table_of_disease_by_month()
-
-    # get the Data in Pandas Dataframe
-    #df = pd.read_sql_query('select * from [disease_by_month];', db_connect)
-    # print(df)
-    # print(type(df))
 
+def disease_plot_data():
+    """ What the plots of all of the diseases have in common: the dates of the
+        months, HK's population and the diseases' full names
+    """
     # get the list of dates and convert to date objects
     date_strs = dbdo.list_from_query(
         dbc, 'select Date from [disease_by_month] order by date;')
@@ -153,39 +132,62 @@ if __name__ == '__main__':
         hk_pop_dates.append(date)
         hk_pop_values.append(hk_pop[date])
 
-    axis_range = [datetime.datetime(1997, 1, 1), datetime.datetime(2020, 1, 1)]
-    diseases = dbdo.list_from_query(dbc, 'select distinct(ref) from diseases;')
     disease_full_names = dbdo.dict_from_query(
         dbc, 'select distinct(ref), name from [diseases];')
+    return {'dates': dates, 'hk_pop_dates': hk_pop_dates, 'hk_pop_values': hk_pop_values,
+            'names': disease_full_names}
 
-    for disease in diseases:
-        cases = dbdo.list_from_query(
+def make_disease_plot(disease, plot_data):
+    """ The plot of one disease, plots/{disease}.png. Returns the file name. """
+    axis_range = [datetime.datetime(1997, 1, 1), datetime.datetime(2020, 1, 1)]
+    cases = dbdo.list_from_query(
         dbc, 'select {} from  [disease_by_month] order by date;'.format(disease))
-        print('Plotting {}...'.format(disease))
-        fig, ax = plt.subplots()
-        fig.suptitle('Notifiable Infections and Diseases in HK')
-        ax.set_title(disease_full_names[disease])
-        ax.scatter(dates, cases, label=disease, )
-        ax.set(xlabel='Date', xlim=axis_range,
-               ylabel='Reported Cases per month')
-
-        # population on the second axis
-        ax2 = ax.twinx()
-        ax2.plot(hk_pop_dates, hk_pop_values,
-                 label='Population', color='red')
-        ax2.set(ylabel='Population')
-
-        ax.legend()
-        ax2.legend()
-        #fig, ax = plt.subplots()
-        # ax.set(ylim=[0,max(cases)])
-
-        fig.savefig('plots/' + disease + '.png', format='png')
-
-        plt.close()
-
-    #plot = plt.plot(dataframe)
-    # plot.show()
+    print('Plotting {}...'.format(disease))
+    fig, ax = plt.subplots()
+    fig.suptitle('Notifiable Infections and Diseases in HK')
+    ax.set_title(plot_data['names'][disease])
+    ax.scatter(plot_data['dates'], cases, label=disease, )
+    ax.set(xlabel='Date', xlim=axis_range,
+           ylabel='Reported Cases per month')
+
+    # population on the second axis
+    ax2 = ax.twinx()
+    ax2.plot(plot_data['hk_pop_dates'], plot_data['hk_pop_values'],
+             label='Population', color='red')
+    ax2.set(ylabel='Population')
+
+    ax.legend()
+    ax2.legend()
+    #fig, ax = plt.subplots()
+    # ax.set(ylim=[0,max(cases)])
+
+    savefile = 'plots/' + disease + '.png'
+    fig.savefig(savefile, format='png')
+
+    plt.close()
+    return savefile
+
+# Constants
+
+
+# The Main Loop
+if __name__ == '__main__':
+    ncor_log.setup()
+    # default, not read-mostly: this builds [disease_by_month] if it isn't there
+    db_connect = ncor_db.connect('notifiable_infections_diseases.sqlite')
+    dbc = db_connect.cursor()
+    FIRSTRUN = 0
+
+    # Check if the table disease_by_month exists
+    check = dbdo.list_from_query(
+        dbc, 'select name from sqlite_master where name like \'disease_by_month\';')
+    if (FIRSTRUN is True) or (len(check) == 0):
+        make_table_of_disease_by_month()
+
+    diseases = dbdo.list_from_query(dbc, 'select distinct(ref) from diseases;')
+    plot_data = disease_plot_data()
+    for disease in diseases:
+        make_disease_plot(disease, plot_data)
 
     # Tidy up and close.
     dbc.close()
@@ -15,6 +15,7 @@ use utf8;
 my $verbose = 0;
 my $getters = 1;
 my $options = "silent";
+my $force = "";   # FORCE: make the summaries and plots even if nothing's new
 my $logfile = "ncorplots.log";
 
 `date > $logfile`;
@@ -25,6 +26,7 @@ while (my $arg = shift(@ARGV)) {
 	if ( $arg =~ /verbose/ ) { $verbose = 1; }
 	if ( $arg =~ /silent/ )  { $verbose = 0; }
 	if ( $arg =~ /get/ )  { $getters = 1 - $getters; }
+	if ( $arg =~ /force/ )  { $force = "FORCE"; }
 }
 if ( $verbose ) {
 	$options = "verbose";
@@ -42,7 +44,7 @@ if ( $getters) {
 
 	run_all_scripts(@getters);
 	# Process the plots
-	my $result = `./process_ncor_2019_data.py $options >>$logfile 2>>$logfile`;
+	my $result = `./process_ncor_2019_data.py $options $force >>$logfile 2>>$logfile`;
 	my $finish_code = `echo \$# `;
 	#print "$finish_code";
 	if ( $finish_code != 0 ) {
@@ -51,7 +53,7 @@ if ( $getters) {
 	}
 
 	# Produce the Plots
-	$result = `./produce_ncor_plots.py $options >>$logfile 2>>$logfile`;
+	$result = `./produce_ncor_plots.py $options $force >>$logfile 2>>$logfile`;
 	$finish_code = `echo \$# `;
 	#print "$finish_code";
 	if ( $finish_code != 0 ) {